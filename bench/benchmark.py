@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+''' Benchmark of DMS against in-process stand-ins of HBase REST, WebHDFS and
+Solr (See fakes.py), so it runs without a Hadoop cluster. Every backend sleeps
+a fixed latency per request, which makes the number of round trips show up in
+the results like on a real cluster.
+
+For each table size a fresh set of backends is started and filled with that
+many files, then every operation is measured for each file size. The report
+has ops/sec and p50/p99 latency per operation.
+
+Usage: python bench/benchmark.py [--latency 1] [--file-sizes 1024,1048576]
+       [--table-sizes 10,1000] [--repeat 20] [--json results.json]
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import simplejson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from DMS import DMS
+from fakes import FakeHBase, FakeWebHDFS, FakeSolr
+
+OPERATIONS = ['upload', 'get_lastest_version', 'get_file_meta_data', 'download',
+              'update', 'delete', 'get_all_file']
+
+def percentile(times, p):
+    ''' This function return the p-th percentile (nearest rank) of times.
+    :param : times - sorted list of seconds
+    :param : p - percentile from 0 to 100
+    :return: seconds.
+    '''
+    index = int(round(p / 100.0 * len(times) + 0.5)) - 1
+    return times[max(0, min(index, len(times) - 1))]
+
+def measure(function, arguments):
+    ''' This function call function once for each item of arguments and time
+    every call.
+    :param : function - function to call
+    :param : arguments - list of argument tuples
+    :return: list of seconds per call.
+    '''
+    times = list()
+    for args in arguments:
+        start = time.time()
+        result = function(*args)
+        times.append(time.time() - start)
+        if result is False or result is None:
+            raise RuntimeError("%s%r failed" % (function.__name__, args))
+    return times
+
+def summary(operation, file_size, table_size, times):
+    ''' This function return a result row of one measured operation.
+    '''
+    times = sorted(times)
+    return {'operation': operation, 'file_size': file_size, 'table_size': table_size,
+            'count': len(times), 'ops_per_sec': len(times) / (sum(times) or 1e-9),
+            'p50_ms': percentile(times, 50) * 1000, 'p99_ms': percentile(times, 99) * 1000}
+
+def write_file(path, size):
+    ''' This function write a file of size random bytes.
+    '''
+    f = open(path, 'wb')
+    try:
+        while size > 0:
+            chunk = os.urandom(min(size, 1048576))
+            f.write(chunk)
+            size -= len(chunk)
+    finally:
+        f.close()
+
+def run_table(table_size, file_sizes, repeat, latency, dms_options, work_dir):
+    ''' This function run every operation of one table size on fresh backends.
+    :return: list of result rows (See summary).
+    '''
+    # DMS keys files by their names, so work with names in work_dir.
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    backends = [FakeHBase(latency).start(), FakeWebHDFS(latency).start(),
+                FakeSolr(latency).start()]
+    hbase, hdfs, solr = backends
+    dms = DMS(**dms_options)
+    try:
+        dms.hbase_connection(host=hbase.host, port=hbase.port)
+        dms.hdfs_connection(host=hdfs.host, port=str(hdfs.port), user_name='hdfs')
+        dms.solr_connection(host=solr.host, port=str(solr.port), collection='dms')
+
+        # Fill the table with small files.
+        names = list()
+        for i in range(table_size):
+            name = 'fill%06d.dat' % i
+            write_file(name, 1024)
+            names.append(name)
+        failed = [r for r in dms.upload_many(names, workers=8) if r['status'] != 'ok']
+        if failed:
+            raise RuntimeError("cannot fill the table: %s" % failed[0]['error'])
+
+        results = list()
+        download_dir = 'download/'
+        os.mkdir(download_dir)
+        for file_size in file_sizes:
+            name = 'bench%d.dat' % file_size
+            write_file(name, file_size)
+            versions = [(v,) for v in range(1, repeat + 1)]
+            named = [(name, v) for v, in versions]
+            times = dict()
+            times['upload'] = measure(dms.upload, [(name,)] * repeat)
+            times['get_lastest_version'] = measure(dms.get_lastest_version, [(name,)] * repeat)
+            times['get_file_meta_data'] = measure(dms.get_file_meta_data, named)
+            times['download'] = measure(dms.download, [(name, v, download_dir) for v, in versions])
+            times['update'] = measure(dms.update, named)
+            times['delete'] = measure(dms.delete, named)
+            for operation in OPERATIONS[:-1]:
+                results.append(summary(operation, file_size, table_size, times[operation]))
+        # get_all_file reads the whole table, it does not depend on file size.
+        times = measure(dms.get_all_file, [()] * max(1, min(repeat, 5)))
+        results.append(summary('get_all_file', None, table_size, times))
+        return results
+    finally:
+        dms.close()
+        for backend in backends:
+            backend.stop()
+        os.chdir(cwd)
+
+def report(results):
+    ''' This function print result rows as a table.
+    '''
+    print '%-20s %10s %10s %10s %10s %10s' % ('operation', 'file size', 'table size',
+                                              'ops/sec', 'p50 ms', 'p99 ms')
+    for r in results:
+        print '%-20s %10s %10d %10.1f %10.2f %10.2f' % (
+            r['operation'], '-' if r['file_size'] is None else r['file_size'],
+            r['table_size'], r['ops_per_sec'], r['p50_ms'], r['p99_ms'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DMS on stand-in backends.')
+    parser.add_argument('--latency', type=float, default=1.0,
+                        help='milliseconds added to every backend request (default: 1)')
+    parser.add_argument('--file-sizes', default='1024,1048576,8388608',
+                        help='comma separated file sizes in bytes')
+    parser.add_argument('--table-sizes', default='10,100,1000',
+                        help='comma separated numbers of files stored before measuring')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='calls per operation and file size (default: 20)')
+    parser.add_argument('--cache-entries', type=int, default=0,
+                        help='DMS cache_entries (default: 0, no cache)')
+    parser.add_argument('--dedup', action='store_true', help='DMS dedup mode')
+    parser.add_argument('--json', help='also write results to this json file')
+    args = parser.parse_args()
+
+    file_sizes = [int(size) for size in args.file_sizes.split(',')]
+    table_sizes = [int(size) for size in args.table_sizes.split(',')]
+    dms_options = {'cache_entries': args.cache_entries, 'dedup': args.dedup}
+    results = list()
+    for table_size in table_sizes:
+        work_dir = tempfile.mkdtemp(prefix='dms-bench-')
+        try:
+            results.extend(run_table(table_size, file_sizes, args.repeat,
+                                     args.latency / 1000.0, dms_options, work_dir))
+        finally:
+            shutil.rmtree(work_dir)
+    report(results)
+    if args.json:
+        f = open(args.json, 'w')
+        try:
+            simplejson.dump({'latency_ms': args.latency, 'options': dms_options,
+                             'results': results}, f, indent=2)
+        finally:
+            f.close()
+
+if __name__ == '__main__':
+    main()
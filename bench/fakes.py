@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+''' In-process stand-ins for the HBase REST (Stargate), WebHDFS and Solr HTTP
+servers used by DMS. They keep everything in memory, speak enough of each
+protocol for starbase, pywebhdfs and DMS.search, and can inject a fixed
+latency on every request so round trips cost something like a real cluster.
+'''
+import base64
+import collections
+import itertools
+import re
+import threading
+import time
+import urlparse
+import simplejson
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send a whole response at once, small writes stall on delayed acks.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            return ''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def _send(self, code, body='', headers=None, content_type='application/json'):
+        if not isinstance(body, str):
+            body = simplejson.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _dispatch(self):
+        self.server.backend.requests += 1
+        if self.server.backend.latency:
+            time.sleep(self.server.backend.latency)
+        body = self._body()
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        try:
+            self.server.backend.handle(self, self.command, urlparse.unquote(url.path), query, body)
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _dispatch
+
+
+class FakeBackend(object):
+    ''' Base class of the stand-in servers. Call start() to serve on a free
+    localhost port in a daemon thread and stop() to shut it down.
+    :param : latency - seconds to sleep before answering each request
+    '''
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.RLock()
+        self.server = None
+
+    def start(self, host='127.0.0.1', port=0):
+        ''' This function start serving in a daemon thread.
+        :param : host - host to listen on (default: '127.0.0.1')
+        :param : port - port to listen on (default: 0, any free port)
+        :return: this backend, its address is in host and port.
+        '''
+        self.server = _Server((host, port), _Handler)
+        self.server.backend = self
+        self.host, self.port = self.server.server_address
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        ''' This function stop serving and close the listening socket.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def handle(self, req, method, path, query, body):
+        raise NotImplementedError
+
+
+class FakeHBase(FakeBackend):
+    ''' Stargate stand-in: table list/schema, single row get/put/delete,
+    multi-row put and stateful scanners with batch, start/end row, column
+    projection and RowFilter/PrefixFilter support.
+    '''
+    def __init__(self, latency=0):
+        FakeBackend.__init__(self, latency)
+        self.tables = dict()
+        self.scanners = dict()
+        self.ids = itertools.count(1)
+
+    def _cells(self, row, columns=None):
+        cells = list()
+        for column in sorted(row.keys()):
+            if columns and not any(column == c or column.split(':')[0] == c for c in columns):
+                continue
+            cells.append({'column': base64.b64encode(column),
+                          '$': base64.b64encode(row[column]),
+                          'timestamp': 0})
+        return cells
+
+    def _row(self, key, row, columns=None, key_only=False):
+        cells = self._cells(row, columns)
+        if key_only:
+            for cell in cells:
+                cell['$'] = ''
+        return {'key': base64.b64encode(key), 'Cell': cells}
+
+    def _match(self, key, filter_string):
+        if not filter_string:
+            return True
+        f = simplejson.loads(filter_string)
+        if f['type'] in ('KeyOnlyFilter', 'FirstKeyOnlyFilter'):
+            return True
+        if f['type'] == 'PrefixFilter':
+            return key.startswith(base64.b64decode(f['value']))
+        if f['type'] == 'RowFilter':
+            value = f['comparator']['value']
+            if f['comparator']['type'] == 'RegexStringComparator':
+                return re.search(value, key) is not None
+            if f['comparator']['type'] == 'BinaryPrefixComparator':
+                return key.startswith(base64.b64decode(value))
+            return key == base64.b64decode(value)
+        return True
+
+    def handle(self, req, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts == ['']:
+            return req._send(200, {'table': [{'name': n} for n in sorted(self.tables)]})
+        table = parts[0]
+        with self.lock:
+            if len(parts) > 1 and parts[1] == 'schema':
+                if method in ('PUT', 'POST'):
+                    self.tables.setdefault(table, dict())
+                    return req._send(201)
+                if method == 'DELETE':
+                    self.tables.pop(table, None)
+                    return req._send(200)
+                if table not in self.tables:
+                    return req._send(404)
+                return req._send(200, {'name': table})
+            if table not in self.tables:
+                return req._send(404)
+            rows = self.tables[table]
+            if len(parts) > 1 and parts[1] == 'scanner':
+                return self._scanner(req, method, table, parts[2:], body)
+            if method in ('PUT', 'POST'):
+                data = simplejson.loads(body)
+                for item in data['Row']:
+                    key = base64.b64decode(item['key'])
+                    row = rows.setdefault(key, dict())
+                    for cell in item['Cell']:
+                        row[base64.b64decode(cell['column'])] = base64.b64decode(cell['$'])
+                return req._send(200)
+            key = parts[1]
+            columns = [c for c in parts[2].split(',') if c] if len(parts) > 2 else None
+            if method == 'GET':
+                if key not in rows:
+                    return req._send(404)
+                cells = self._cells(rows[key], columns)
+                if not cells:
+                    return req._send(404)
+                return req._send(200, {'Row': [self._row(key, rows[key], columns)]})
+            if method == 'DELETE':
+                if key not in rows:
+                    return req._send(404)
+                if columns:
+                    for column in list(rows[key]):
+                        if column in columns or column.split(':')[0] in columns:
+                            del rows[key][column]
+                    if not rows[key]:
+                        del rows[key]
+                else:
+                    del rows[key]
+                return req._send(200)
+        return req._send(405)
+
+    def _scanner(self, req, method, table, parts, body):
+        if not parts:
+            spec = simplejson.loads(body) if body else dict()
+            start = base64.b64decode(spec.get('startRow', ''))
+            end = base64.b64decode(spec.get('endRow', ''))
+            columns = [base64.b64decode(c) for c in spec.get('column', [])]
+            keys = collections.deque(k for k in sorted(self.tables[table])
+                    if k >= start and (not end or k < end) and self._match(k, spec.get('filter')))
+            scanner_id = str(next(self.ids))
+            key_only = 'KeyOnlyFilter' in (spec.get('filter') or '')
+            self.scanners[scanner_id] = (table, keys, columns or None, int(spec.get('batch') or 100), key_only)
+            location = 'http://%s:%s/%s/scanner/%s' % (self.host, self.port, table, scanner_id)
+            return req._send(201, headers={'Location': location})
+        scanner_id = parts[0]
+        if method == 'DELETE':
+            self.scanners.pop(scanner_id, None)
+            return req._send(200)
+        if scanner_id not in self.scanners:
+            return req._send(404)
+        table, keys, columns, batch, key_only = self.scanners[scanner_id]
+        rows = self.tables[table]
+        out = list()
+        while keys and len(out) < batch:
+            key = keys.popleft()
+            if key in rows and self._cells(rows[key], columns):
+                out.append(self._row(key, rows[key], columns, key_only))
+        if not out:
+            return req._send(204)
+        return req._send(200, {'Row': out})
+
+
+class FakeWebHDFS(FakeBackend):
+    ''' WebHDFS stand-in. CREATE, APPEND and OPEN go through a 307 redirect
+    to a "datanode" URL on the same server like a real namenode does.
+    '''
+    def __init__(self, latency=0):
+        FakeBackend.__init__(self, latency)
+        self.files = dict()
+        self.mtimes = dict()
+
+    def _status(self, path):
+        if path in self.files:
+            return {'FileStatus': {
+                'accessTime': 0, 'blockSize': 134217728, 'childrenNum': 0,
+                'fileId': abs(hash(path)), 'group': 'supergroup',
+                'length': len(self.files[path]),
+                'modificationTime': self.mtimes[path], 'owner': 'hdfs',
+                'pathSuffix': '', 'permission': '644', 'replication': 1,
+                'storagePolicy': 0, 'type': 'FILE'}}
+        prefix = path.rstrip('/') + '/'
+        if any(p.startswith(prefix) for p in self.files):
+            return {'FileStatus': {'length': 0, 'type': 'DIRECTORY',
+                                   'modificationTime': 0, 'owner': 'hdfs'}}
+
+    def _redirect(self, req, path, query):
+        query = dict(query, datanode='true')
+        location = 'http://%s:%s/webhdfs/v1%s?%s' % (
+            self.host, self.port, path, '&'.join('%s=%s' % kv for kv in query.items()))
+        return req._send(307, headers={'Location': location})
+
+    def handle(self, req, method, path, query, body):
+        if not path.startswith('/webhdfs/v1'):
+            return req._send(404)
+        path = '/' + path[len('/webhdfs/v1'):].lstrip('/')
+        op = query.get('op', '').upper()
+        datanode = query.get('datanode') == 'true'
+        not_found = {'RemoteException': {'exception': 'FileNotFoundException',
+                                         'message': 'File does not exist: ' + path}}
+        with self.lock:
+            if op == 'CREATE':
+                if not datanode:
+                    if path in self.files and query.get('overwrite', 'false') != 'true':
+                        return req._send(403, {'RemoteException': {
+                            'exception': 'FileAlreadyExistsException', 'message': path}})
+                    return self._redirect(req, path, query)
+                self.files[path] = body
+                self.mtimes[path] = int(time.time() * 1000)
+                return req._send(201)
+            if op == 'APPEND':
+                if path not in self.files:
+                    return req._send(404, not_found)
+                if not datanode:
+                    return self._redirect(req, path, query)
+                self.files[path] += body
+                self.mtimes[path] = int(time.time() * 1000)
+                return req._send(200)
+            if op == 'OPEN':
+                if path not in self.files:
+                    return req._send(404, not_found)
+                if not datanode:
+                    return self._redirect(req, path, query)
+                data = self.files[path]
+                offset = int(query.get('offset', 0))
+                if offset > len(data):
+                    return req._send(400, {'RemoteException': {
+                        'exception': 'EOFException', 'message': 'Offset beyond EOF'}})
+                if 'length' in query:
+                    data = data[offset:offset + int(query['length'])]
+                else:
+                    data = data[offset:]
+                return req._send(200, data, content_type='application/octet-stream')
+            if op == 'GETFILESTATUS':
+                status = self._status(path)
+                if not status:
+                    return req._send(404, not_found)
+                return req._send(200, status)
+            if op == 'LISTSTATUS':
+                prefix = path.rstrip('/') + '/'
+                names = sorted(set(p[len(prefix):].split('/')[0]
+                                   for p in self.files if p.startswith(prefix)))
+                statuses = list()
+                for name in names:
+                    status = self._status(prefix + name)['FileStatus']
+                    status['pathSuffix'] = name
+                    statuses.append(status)
+                return req._send(200, {'FileStatuses': {'FileStatus': statuses}})
+            if op == 'MKDIRS':
+                return req._send(200, {'boolean': True})
+            if op == 'RENAME':
+                destination = query['destination']
+                if path not in self.files or destination in self.files:
+                    return req._send(200, {'boolean': False})
+                self.files[destination] = self.files.pop(path)
+                self.mtimes[destination] = self.mtimes.pop(path)
+                return req._send(200, {'boolean': True})
+            if op == 'DELETE':
+                prefix = path.rstrip('/') + '/'
+                victims = [p for p in self.files if p == path or
+                           (query.get('recursive') == 'true' and p.startswith(prefix))]
+                for p in victims:
+                    del self.files[p]
+                    del self.mtimes[p]
+                return req._send(200, {'boolean': bool(victims)})
+        return req._send(400, {'RemoteException': {
+            'exception': 'UnsupportedOperationException', 'message': op}})
+
+
+class FakeSolr(FakeBackend):
+    ''' Solr stand-in for /solr/<collection>/select and /update. Queries
+    understand *:*, field:value and bare terms (substring match on any
+    field); start/rows/fl/fq/sort and cursorMark paging are supported.
+    '''
+    def __init__(self, latency=0):
+        FakeBackend.__init__(self, latency)
+        self.collections = dict()
+        self.updates = list()
+
+    def _matches(self, doc, q):
+        q = q.strip()
+        if q in ('', '*:*', '*'):
+            return True
+        if ':' in q:
+            field, value = q.split(':', 1)
+            values = doc.get(field)
+            if not isinstance(values, list):
+                values = [values]
+            return any(value.strip('"') == '*' or value.strip('"') == unicode(v) for v in values)
+        return any(q.lower() in unicode(v).lower() for v in doc.values())
+
+    def handle(self, req, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if len(parts) < 3 or parts[0] != 'solr':
+            return req._send(404)
+        docs = self.collections.setdefault(parts[1], dict())
+        with self.lock:
+            if parts[2] == 'update':
+                self.updates.append((query, body))
+                if body:
+                    data = simplejson.loads(body)
+                    if isinstance(data, list):
+                        data = {'add': [{'doc': d} for d in data]}
+                    adds = data.get('add', [])
+                    if isinstance(adds, dict):
+                        adds = [adds]
+                    for add in adds:
+                        doc = add.get('doc', add)
+                        docs[unicode(doc['id'])] = doc
+                    deletes = data.get('delete', [])
+                    if not isinstance(deletes, list):
+                        deletes = [deletes]
+                    for d in deletes:
+                        docs.pop(unicode(d.get('id') if isinstance(d, dict) else d), None)
+                return req._send(200, {'responseHeader': {'status': 0, 'QTime': 0}})
+            if parts[2] == 'select':
+                hits = [d for _, d in sorted(docs.items()) if self._matches(d, query.get('q', '*:*'))]
+                for fq in [v for k, v in urlparse.parse_qsl(urlparse.urlparse(req.path).query) if k == 'fq']:
+                    hits = [d for d in hits if self._matches(d, fq)]
+                if query.get('sort'):
+                    field, order = (query['sort'].split(',')[0].split() + ['asc'])[:2]
+                    hits.sort(key=lambda d: d.get(field), reverse=order == 'desc')
+                rows = int(query.get('rows', 10))
+                start = int(query.get('start', 0))
+                result = {'responseHeader': {'status': 0, 'QTime': 0}}
+                if 'cursorMark' in query:
+                    start = 0 if query['cursorMark'] == '*' else int(query['cursorMark'])
+                    result['nextCursorMark'] = str(min(start + rows, len(hits))) if hits[start:] else query['cursorMark']
+                page = hits[start:start + rows]
+                if query.get('fl'):
+                    fields = [f.strip() for f in query['fl'].split(',')]
+                    page = [dict((f, d[f]) for f in fields if f in d) for d in page]
+                result['response'] = {'numFound': len(hits), 'start': start, 'docs': page}
+                return req._send(200, result)
+        return req._send(404)
@@ -6,171 +6,3009 @@ Author Site: http://www.lukkid.in.th
 Github Page: https://github.com/lukkiddd/DMSHadoop
 Last Modified: 25 Apr, 14:22
 '''
-import simplejson
-from urllib2 import *
+import base64
+import bisect
+import bz2
+import copy
+import fcntl
+import functools
+import hashlib
+import importlib
+import itertools
+import mimetypes
+import multiprocessing
+import os
+import Queue
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import types
+import urlparse
+import uuid
+import zlib
+from collections import OrderedDict
 
+class Lazy:
+    def __init__(self, factory, *args, **kwargs):
+        ''' This class stand for an object which is made by factory(*args,
+        **kwargs) on the first use of its attributes, for example a module which
+        is imported or a backend connection which is opened only when it is
+        needed. Attributes which are set on it are its own.
+        :param : factory - function which makes the object
+        :return: Nothing.
+        '''
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.target = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self.target is None:
+            with self.lock:
+                if self.target is None:
+                    self.target = self.factory(*self.args, **self.kwargs)
+        return getattr(self.target, name)
+
+# Libraries are imported on first use, so a process only loads the ones it needs.
+simplejson = Lazy(importlib.import_module, 'simplejson')
+# Apache 2.0
+requests = Lazy(importlib.import_module, 'requests')
 # GPL 2.0/LGPL 2.1
-from starbase import Connection as hbaseConnection
+starbase = Lazy(importlib.import_module, 'starbase')
+transport = Lazy(importlib.import_module, 'starbase.client.transport')
+methods = Lazy(importlib.import_module, 'starbase.client.transport.methods')
 # OSI Approved :: Apache Software License
-from pywebhdfs.webhdfs import PyWebHdfsClient
+webhdfs = Lazy(importlib.import_module, 'pywebhdfs.webhdfs')
 # GNU GPL v2
-from hachoir_parser import createParser
-from hachoir_core.cmd_line import unicodeFilename
-from hachoir_metadata import extractMetadata
-from hachoir_core.i18n import getTerminalCharset
-from hachoir_core.tools import makePrintable
+hachoir_parser = Lazy(importlib.import_module, 'hachoir_parser')
+hachoir_stream = Lazy(importlib.import_module, 'hachoir_core.stream')
+hachoir_cmd_line = Lazy(importlib.import_module, 'hachoir_core.cmd_line')
+hachoir_metadata = Lazy(importlib.import_module, 'hachoir_metadata')
+
+def private_class(cls, **names):
+    ''' This function return a subclass of a library class whose methods see names
+    instead of globals of their module, for example requests=pool. starbase and
+    pywebhdfs call the requests module directly, so this gives every DMS its own
+    transport without changing them for anybody else.
+    :param : cls - class
+    :param : names - globals to replace
+    :return: class.
+    '''
+    namespace = dict()
+    for name, value in cls.__dict__.items():
+        if isinstance(value, types.FunctionType):
+            env = dict(value.func_globals)
+            env.update(names)
+            namespace[name] = types.FunctionType(value.func_code, env, value.func_name,
+                                                 value.func_defaults, value.func_closure)
+    return type(cls.__name__, (cls,), namespace)
+
+# Tables of each hbase which are known to exist (See DMS.check_table).
+checked_tables = set()
+
+class Cache:
+    def __init__(self, max_entries=1024, max_bytes=67108864, ttl=60):
+        ''' This class is an in-process LRU cache. Entries expire after ttl seconds
+        and the least recently used ones are evicted when there are more than
+        max_entries entries or their total size is more than max_bytes.
+        :param : max_entries - maximum number of entries (default: 1024)
+        :param : max_bytes - maximum total size of entries (default: 64 MB)
+        :param : ttl - seconds before an entry expires (default: 60)
+        :return: Nothing.
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        ''' This function return a cached value and mark it as recently used.
+        :param : key - cache key
+        :return: cached value, None if it is not cached or expired.
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expire, size, value = entry
+            if expire < time.time():
+                self.bytes -= size
+                return None
+            self.entries[key] = entry
+            return value
+
+    def put(self, key, value, size=0):
+        ''' This function store a value, then evict old entries over the limits.
+        :param : key - cache key
+        :param : value - value to cache
+        :param : size - value's size in bytes
+        :return: Nothing.
+        '''
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (time.time() + self.ttl, size, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def invalidate(self, key):
+        ''' This function remove a value from the cache.
+        :param : key - cache key
+        :return: Nothing.
+        '''
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+
+    def clear(self):
+        ''' This function remove all values from the cache.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+class Stats:
+    # Upper bounds (seconds) of latency histogram buckets, the last bucket has no bound.
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
 
-class DMS:
     def __init__(self, debug=0):
+        ''' This class collect counts, errors, bytes and latency histograms of DMS
+        operations and backend calls, and pass every record to hooks.
+        :param : debug - 1, show an error of a hook. 0 otherwise
+        :return: Nothing.
+        '''
+        self.debug = debug
+        self.lock = threading.Lock()
+        self.hooks = list()
+        self.reset()
+
+    def reset(self):
+        ''' This function clear all records.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        with self.lock:
+            self.records = {'operation': dict(), 'backend': dict()}
+
+    def record(self, kind, name, seconds, bytes_sent=0, bytes_received=0, error=False):
+        ''' This function add a record, then call hooks with it as a dict.
+        :param : kind - 'operation' (See timed) or 'backend' (See ConnectionPool)
+        :param : name - operation's name or backend call as [backend].[call], for
+                 example 'hbase.fetch' or 'hdfs.open'
+        :param : seconds - latency
+        :param : bytes_sent - request body's size (default: 0)
+        :param : bytes_received - response body's size (default: 0)
+        :param : error - True if it failed (default: False)
+        :return: Nothing.
+        '''
+        with self.lock:
+            entry = self.records[kind].get(name)
+            if entry is None:
+                entry = {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                         'bytes_sent': 0, 'bytes_received': 0,
+                         'histogram': [0] * (len(self.buckets) + 1)}
+                self.records[kind][name] = entry
+            entry['count'] += 1
+            entry['errors'] += int(error)
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['bytes_sent'] += bytes_sent
+            entry['bytes_received'] += bytes_received
+            entry['histogram'][bisect.bisect_left(self.buckets, seconds)] += 1
+            hooks = list(self.hooks)
+        if hooks:
+            event = {'kind': kind, 'name': name, 'seconds': seconds, 'bytes_sent': bytes_sent,
+                     'bytes_received': bytes_received, 'error': error}
+            for hook in hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    if self.debug:
+                        print "Stats hook failed:", e
+
+    def snapshot(self):
+        ''' This function return a copy of all records.
+        :param : Nothing.
+        :return: dict of 'operations' and 'backends', each is a dict of name ->
+                 {count, errors, seconds, max_seconds, bytes_sent, bytes_received,
+                 histogram - counts per bucket (See buckets)}, and 'buckets'.
+        '''
+        with self.lock:
+            return {'operations': copy.deepcopy(self.records['operation']),
+                    'backends': copy.deepcopy(self.records['backend']),
+                    'buckets': list(self.buckets)}
+
+def timed(name):
+    ''' This function return a decorator which records time of a DMS function as
+    operation name in its stats (See DMS.stats).
+    :param : name - operation's name
+    :return: decorator.
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def call(self, *args, **kwargs):
+            start = time.time()
+            error = True
+            try:
+                result = function(self, *args, **kwargs)
+                error = failed(result)
+                return result
+            finally:
+                self.metrics.record('operation', name, time.time() - start, error=error)
+        return call
+    return decorator
+
+def failed(result):
+    ''' This function tell whether a result of a DMS function is a failure, that is
+    False, a report with status 'failed', a list of reports with one of them
+    failed or a summary with failed keys (See delete_many).
+    :param : result - result of a DMS function
+    :return: True if the call failed.
+    '''
+    if result is False:
+        return True
+    if isinstance(result, list):
+        return any(failed(item) for item in result if isinstance(item, dict))
+    if not isinstance(result, dict):
+        return False
+    if 'status' in result and 'file' in result and 'error' in result:
+        return result['status'] == 'failed'
+    if 'deleted' in result and 'failed' in result:
+        return bool(result['failed'])
+    return False
+
+def counted(data, sent):
+    ''' This function yield chunks of a request body and add their size to sent.
+    :param : data - iterable of chunks
+    :param : sent - list of one number, the bytes sent so far
+    '''
+    for chunk in data:
+        sent[0] += len(chunk)
+        yield chunk
+
+class ConnectionPool:
+    def __init__(self, max_connections=10, timeout=None, keep_alive=True, stats=None):
+        ''' This class is a pool of persistent http connections (a requests session)
+        shared by hbase, hdfs and solr requests, so a tcp connection is reused
+        instead of opened for every call.
+        :param : max_connections - connections kept open per host (default: 10)
+        :param : timeout - seconds to wait for a server, None for no limit
+                 (default: None)
+        :param : keep_alive - False, close a connection after each request
+                 (default: True)
+        :param : stats - Stats to record every request in (default: None)
+        :return: Nothing.
+        '''
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.stats = stats
+        self.session = None
+        self.lock = threading.Lock()
+
+    def get_session(self):
+        ''' This function return the requests session, it is made on first use.
+        '''
+        with self.lock:
+            if self.session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.max_connections,
+                                                        pool_maxsize=self.max_connections)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.session = session
+        return self.session
+
+    def request(self, method, url, **kwargs):
+        ''' This function send a request through the pool.
+        :param : method - http method
+        :param : url - url
+        :param : kwargs - the same as requests.request
+        :return: requests response.
+        '''
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        if not self.keep_alive:
+            headers = dict(kwargs.get('headers') or {})
+            headers['Connection'] = 'close'
+            kwargs['headers'] = headers
+        session = self.session or self.get_session()
+        if self.stats is None:
+            return session.request(method, url, **kwargs)
+        start = time.time()
+        response = None
+        data = kwargs.get('data')
+        sent = [0]
+        if hasattr(data, 'read'):
+            sent[0] = self.remaining(data)
+        elif data is not None and not isinstance(data, (basestring, dict, list, tuple)):
+            kwargs['data'] = counted(data, sent)
+        try:
+            response = session.request(method, url, **kwargs)
+            return response
+        finally:
+            sent = sent[0]
+            if response is not None and isinstance(response.request.body, basestring):
+                sent = len(response.request.body)
+            received = len(response.content) if response is not None else 0
+            error = response is None or response.status_code >= 500
+            self.stats.record('backend', self.classify(method, url, kwargs.get('params')),
+                              time.time() - start, sent, received, error)
+
+    def remaining(self, file):
+        ''' This function return bytes left to read in a file object.
+        :param : file - file object
+        :return: size in bytes, 0 if unknown.
+        '''
+        try:
+            return os.fstat(file.fileno()).st_size - file.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            pass
+        try:
+            position = file.tell()
+            file.seek(0, os.SEEK_END)
+            size = file.tell() - position
+            file.seek(position)
+            return size
+        except (AttributeError, IOError, OSError, ValueError):
+            return 0
+
+    def classify(self, method, url, params=None):
+        ''' This function name a request by its backend and call, for example
+        'hbase.fetch', 'hbase.scan', 'hdfs.create', 'hdfs.open' or 'solr.select'.
+        :param : method - http method
+        :param : url - url
+        :param : params - query parameters which are not in url (default: None)
+        :return: name as a string.
+        '''
+        parts = urlparse.urlparse(url)
+        if '/webhdfs/' in parts.path:
+            query = dict(urlparse.parse_qsl(parts.query))
+            query.update(dict(params or {}))
+            return ''.join(['hdfs.',query.get('op', method).lower()])
+        if '/solr/' in parts.path:
+            return ''.join(['solr.',parts.path.rstrip('/').split('/')[-1]])
+        path = parts.path.strip('/').split('/')
+        if len(path) > 1 and path[1] == 'scanner':
+            return 'hbase.scan'
+        if len(path) < 2 or path[1] in ('schema', 'regions'):
+            return 'hbase.schema'
+        call = {'GET': 'fetch', 'PUT': 'insert', 'POST': 'insert', 'DELETE': 'remove'}
+        return ''.join(['hbase.',call.get(method, method.lower())])
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        ''' This function close all pooled connections.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        if self.session is not None:
+            self.session.close()
+
+class Throttle:
+    def __init__(self, target, slots):
+        ''' This class wrap a backend client (hdfs client, hbase table) so at most
+        slots of its methods run at the same time.
+        :param : target - backend client
+        :param : slots - threading.BoundedSemaphore shared by wrapped clients
+        :return: Nothing.
+        '''
+        self.target = target
+        self.slots = slots
+
+    def __getattr__(self, name):
+        attr = getattr(self.target, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            with self.slots:
+                return attr(*args, **kwargs)
+        return call
+
+class Future:
+    def __init__(self):
+        ''' This class is a result of a call which is running on a WorkerPool.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.value = None
+        self.error = None
+        self.callbacks = list()
+
+    def set_result(self, value):
+        ''' This function finish the future with a result.
+        '''
+        self.value = value
+        self.finish()
+
+    def set_exception(self, error):
+        ''' This function finish the future with an exception.
+        '''
+        self.error = error
+        self.finish()
+
+    def finish(self):
+        ''' This function wake up waiters, then call done callbacks.
+        '''
+        with self.lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, list()
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        ''' This function return True if the call has finished.
+        '''
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        ''' This function wait for the call, then return its result or raise its
+        exception.
+        :param : timeout - seconds to wait, None to wait until it finish
+        :return: result of the call.
+        '''
+        if not self.event.wait(timeout):
+            raise RuntimeError("timed out waiting for a result")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def exception(self, timeout=None):
+        ''' This function wait for the call, then return its exception.
+        :param : timeout - seconds to wait, None to wait until it finish
+        :return: exception raised by the call, None if it succeeded.
+        '''
+        if not self.event.wait(timeout):
+            raise RuntimeError("timed out waiting for a result")
+        return self.error
+
+    def add_done_callback(self, callback):
+        ''' This function call callback(future) when the call finish, or right
+        away if it has already finished.
+        :param : callback - function that take this future
+        :return: Nothing.
+        '''
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+class WorkerPool:
+    def __init__(self, workers=4):
+        ''' This class is a fixed number of worker threads which run submitted
+        calls in order.
+        :param : workers - number of worker threads (default: 4)
+        :return: Nothing.
+        '''
+        self.jobs = Queue.Queue()
+        self.threads = [threading.Thread(target=self.run) for i in range(0,workers)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def run(self):
+        ''' This function is a worker thread's loop.
+        '''
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            future, function, args, kwargs = job
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, function, *args, **kwargs):
+        ''' This function queue a call for a worker thread.
+        :param : function - function to call, then its arguments
+        :return: Future of the call.
+        '''
+        future = Future()
+        self.put(future, function, *args, **kwargs)
+        return future
+
+    def put(self, future, function, *args, **kwargs):
+        ''' This function queue a call which finishes a given future.
+        :param : future - Future of the call
+        :param : function - function to call, then its arguments
+        :return: Nothing.
+        '''
+        self.jobs.put((future, function, args, kwargs))
+
+    def close(self, wait=True):
+        ''' This function stop worker threads after queued calls are done.
+        :param : wait - True, wait for worker threads to stop (default: True)
+        :return: Nothing.
+        '''
+        for t in self.threads:
+            self.jobs.put(None)
+        if wait:
+            for t in self.threads:
+                t.join()
+
+def extract_meta_data(file, max_bytes=None):
+    ''' This function use to extract meta data from a file with hachoir. It is a
+    module function so worker processes of ExtractorPool can run it.
+    :param : file - file for extract
+    :param : max_bytes - parse only the first max_bytes of a file (default: None)
+    :return: meta data as dict, None if hachoir does not know the file.
+    '''
+    filename, realname = hachoir_cmd_line.unicodeFilename(file), file
+    if max_bytes is None:
+        parser = hachoir_parser.createParser(filename, realname)
+    else:
+        size = min(os.path.getsize(file), max_bytes)
+        # hachoir streams are sized in bits.
+        stream = hachoir_stream.FileInputStream(filename, realname, size=size * 8)
+        parser = hachoir_parser.guessParser(stream)
+    if parser is None:
+        return None
+    meta_data = hachoir_metadata.extractMetadata(parser)
+    if meta_data is None:
+        return None
+    meta_data_text = meta_data.exportPlaintext()
+    meta_list = dict()
+    for i in range(1,len(meta_data_text)):
+        meta_split = meta_data_text[i].split(":", 1)
+        column = meta_split[0].replace('- ','')
+        value = meta_split[1].lstrip()
+        meta_list.update({column:value})
+    return meta_list
+
+class ExtractorPool:
+    def __init__(self, workers=2, timeout=None):
+        ''' This class is a pool of processes which extract meta data (See
+        extract_meta_data), so parsing does not hold the GIL of DMS and a file
+        which hangs the parser can be killed. A worker process is restarted after
+        it times out or dies. Worker processes are started on the first extract.
+        :param : workers - number of worker processes (default: 2)
+        :param : timeout - seconds to wait for a file, None for no limit
+                 (default: None)
+        :return: Nothing.
+        '''
+        self.workers = workers
+        self.timeout = timeout
+        self.idle = Queue.Queue()
+        self.started = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        ''' This function start a worker process.
+        :param : Nothing.
+        :return: (process, connection) as a tuple.
+        '''
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=self.run, args=(child_conn,))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def run(self, conn):
+        ''' This function is a loop of a worker process, it extracts files sent
+        to conn until it gets None.
+        '''
+        while True:
+            job = conn.recv()
+            if job is None:
+                break
+            try:
+                conn.send((True, extract_meta_data(*job)))
+            except Exception as e:
+                conn.send((False, str(e) or e.__class__.__name__))
+
+    def extract(self, file, max_bytes=None):
+        ''' This function use to extract meta data of a file in a worker process.
+        It waits for a free worker process if all of them are busy.
+        :param : file - file for extract
+        :param : max_bytes - parse only the first max_bytes of a file (default: None)
+        :return: meta data as dict, None if hachoir does not know the file. Raise
+                 IOError if it fails or times out.
+        '''
+        with self.lock:
+            if not self.started:
+                for i in range(self.workers):
+                    self.idle.put(self.start())
+                self.started = True
+        process, conn = self.idle.get()
+        restart = True
+        try:
+            try:
+                conn.send((file, max_bytes))
+                if conn.poll(self.timeout):
+                    success, result = conn.recv()
+                    restart = False
+                else:
+                    success, result = False, "timed out after %s seconds" % self.timeout
+            except (EOFError, IOError):
+                success, result = False, "extractor process died"
+        finally:
+            if restart:
+                process.terminate()
+                process.join()
+                conn.close()
+                process, conn = self.start()
+            self.idle.put((process, conn))
+        if not success:
+            raise IOError("cannot extract %s: %s" % (file, result))
+        return result
+
+    def close(self):
+        ''' This function stop worker processes after queued files are done.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        while True:
+            try:
+                process, conn = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            conn.send(None)
+            process.join()
+            conn.close()
+
+class SolrIndexer:
+    def __init__(self, pool, url, batch_size=100, flush_interval=1.0, commit_within=1000,
+                 max_queue=10000, retries=3, debug=0):
+        ''' This class send adds and deletes of documents to solr in batches from a
+        background thread. A batch is sent when batch_size documents are queued or
+        flush_interval seconds after its first one, with commitWithin instead of a
+        commit per document. Adding to a full queue waits until there is room.
+        :param : pool - ConnectionPool to send requests with
+        :param : url - solr collection's url
+        :param : batch_size - maximum documents per update request (default: 100)
+        :param : flush_interval - seconds before a partial batch is sent (default: 1)
+        :param : commit_within - milliseconds solr may wait before a commit
+                 (default: 1000)
+        :param : max_queue - maximum queued documents (default: 10000)
+        :param : retries - times to retry a failed request (default: 3)
+        :param : debug - 1, show an error message. 0 otherwise
+        :return: Nothing.
+        '''
+        self.pool = pool
+        self.url = ''.join([url,'/update'])
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.commit_within = commit_within
+        self.retries = retries
+        self.debug = debug
+        self.failed = 0
+        self.queue = Queue.Queue(max_queue)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, document):
+        ''' This function queue a document to add (or replace) by its id.
+        :param : document - solr document as a dict, with an 'id'
+        :return: Nothing.
+        '''
+        self.queue.put(('add', document))
+
+    def delete(self, id):
+        ''' This function queue a document to delete.
+        :param : id - document's id
+        :return: Nothing.
+        '''
+        self.queue.put(('delete', id))
+
+    def flush(self):
+        ''' This function send queued documents now and wait until they are sent.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        self.queue.put(('flush', None))
+        self.queue.join()
+
+    def close(self):
+        ''' This function send queued documents, then stop the background thread.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        self.queue.put(('stop', None))
+        self.thread.join()
+
+    def run(self):
+        ''' This function is a loop of the background thread.
+        '''
+        # Only the last operation of a document in a batch matters.
+        operations = OrderedDict()
+        tasks = 0
+        deadline = None
+        while True:
+            try:
+                if deadline is None:
+                    op, value = self.queue.get()
+                else:
+                    op, value = self.queue.get(True, max(0, deadline - time.time()))
+                tasks += 1
+            except Queue.Empty:
+                op, value = 'flush', None
+            if op in ('add', 'delete'):
+                id = value['id'] if op == 'add' else value
+                operations.pop(id, None)
+                operations[id] = value if op == 'add' else None
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+                if len(operations) < self.batch_size:
+                    continue
+            if operations:
+                self.send(operations.items())
+            operations = OrderedDict()
+            deadline = None
+            for i in range(tasks):
+                self.queue.task_done()
+            tasks = 0
+            if op == 'stop':
+                break
+
+    def send(self, operations):
+        ''' This function send one batch to solr, deletes and adds as json update
+        requests.
+        :param : operations - list of (id, document or None to delete) tuples
+        :return: True if success otherwise False.
+        '''
+        deletes = [id for id, document in operations if document is None]
+        adds = [document for id, document in operations if document is not None]
+        bodies = list()
+        if deletes:
+            bodies.append({'delete': deletes})
+        if adds:
+            bodies.append(adds)
+        params = {'commitWithin': self.commit_within, 'wt': 'json'}
+        headers = {'Content-Type': 'application/json'}
+        success = True
+        for body in bodies:
+            data = simplejson.dumps(body)
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(min(0.1 * 2 ** attempt, 5))
+                try:
+                    response = self.pool.post(self.url, params=params, data=data, headers=headers)
+                    if response.status_code == 200:
+                        break
+                    error = response.status_code
+                except requests.RequestException as e:
+                    error = e
+            else:
+                self.failed += len(body) if body is adds else len(deletes)
+                success = False
+                if self.debug:
+                    print "[SOLR] cannot index documents:", error
+        return success
+
+class Spool:
+    def __init__(self, directory, drain, workers=2, retry_delay=1.0, max_retry_delay=60,
+                 max_attempts=None, chunk_size=4194304, debug=0):
+        ''' This class keep uploads and updates of files in a local directory until
+        they are stored (See DMS spool_dir). An entry is a directory of a copy of
+        file's content and an intent record (op, file, version), both are fsynced
+        before add returns, so an entry survives a crash and is replayed by the
+        next Spool of the directory. Worker threads drain entries oldest first
+        with drain(entry), entries of the same file one by one in order. A failed
+        entry is retried after a delay which doubles up to max_retry_delay, it is
+        moved to [directory]/failed after max_attempts. Only one process at a time
+        may use a directory.
+        :param : directory - spool directory, it is created if it is not exists
+        :param : drain - function(entry) which stores an entry, return True if it
+                 is stored, False if it can never be stored (it is moved to
+                 [directory]/failed), raise an error to retry it
+        :param : workers - number of worker threads (default: 2)
+        :param : retry_delay - seconds before the first retry (default: 1)
+        :param : max_retry_delay - maximum seconds between retries (default: 60)
+        :param : max_attempts - attempts to store an entry before it is moved to
+                 [directory]/failed, None to retry forever (default: None)
+        :param : chunk_size - bytes per read when a file is copied (default: 4 MB)
+        :param : debug - 1, show an error message. 0 otherwise
+        :return: Nothing. Worker threads are started by start.
+        '''
+        self.directory = directory
+        self.drain = drain
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.chunk_size = chunk_size
+        self.debug = debug
+        self.failed_dir = os.path.join(directory, 'failed')
+        if not os.path.isdir(self.failed_dir):
+            os.makedirs(self.failed_dir)
+        self.lock_file = open(os.path.join(directory, 'lock'), 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.lock_file.close()
+            raise IOError("spool directory %s is used by another process" % directory)
+        self.condition = threading.Condition()
+        self.entries = list()
+        # Last version given to an entry of each file (See set_version).
+        self.assigned = dict()
+        self.threads = list()
+        self.stopped = False
+        self.sequence = 0
+        self.load()
+
+    def load(self):
+        ''' This function read entries of the directory which are not drained yet.
+        '''
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                # Its add never returned, so nobody waits for it.
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not name.isdigit():
+                continue
+            f = open(os.path.join(path, 'intent'))
+            try:
+                intent = simplejson.load(f)
+            finally:
+                f.close()
+            self.entries.append(self.new_entry(name, intent))
+            self.sequence = max(self.sequence, int(name))
+
+    def new_entry(self, name, intent):
+        ''' This function return an entry of an intent record.
+        '''
+        path = os.path.join(self.directory, name)
+        return {'name': name, 'path': path, 'op': intent['op'], 'file': intent['file'],
+                'version': intent['version'],
+                'content': os.path.join(path, intent['content']),
+                'attempts': 0, 'retry_at': 0, 'busy': False}
+
+    def sync_dir(self, path):
+        ''' This function fsync a directory, so renames in it are durable.
+        '''
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def write_intent(self, path, intent):
+        ''' This function write an intent record of an entry durably.
+        '''
+        temp_file = os.path.join(path, 'intent.tmp')
+        f = open(temp_file, 'w')
+        try:
+            simplejson.dump(intent, f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(temp_file, os.path.join(path, 'intent'))
+        self.sync_dir(path)
+
+    def add(self, op, file, version, source):
+        ''' This function add an entry, it returns after the entry is on disk.
+        :param : op - 'upload' or 'update'
+        :param : file - file's name
+        :param : version - file's version, None for a new version of upload or the
+                 lastest version of update when it is drained
+        :param : source - file to copy content from
+        :return: entry as a dict.
+        '''
+        with self.condition:
+            self.sequence += 1
+            name = '%012d' % self.sequence
+        path = os.path.join(self.directory, name)
+        temp_path = ''.join([path,'.tmp'])
+        # Keep file's extension for extract.
+        content = ''.join(['content',os.path.splitext(file)[1]])
+        intent = {'op': op, 'file': file, 'version': version, 'content': content,
+                  'created': time.time()}
+        os.mkdir(temp_path)
+        try:
+            src = open(source, 'rb')
+            try:
+                dst = open(os.path.join(temp_path, content), 'wb')
+                try:
+                    for chunk in iter(functools.partial(src.read, self.chunk_size), ''):
+                        dst.write(chunk)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                finally:
+                    dst.close()
+            finally:
+                src.close()
+            self.write_intent(temp_path, intent)
+            os.rename(temp_path, path)
+            self.sync_dir(self.directory)
+        except:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        entry = self.new_entry(name, intent)
+        with self.condition:
+            self.entries.append(entry)
+            self.entries.sort(key=lambda entry: entry['name'])
+            self.condition.notify_all()
+        return entry
+
+    def set_version(self, entry, version):
+        ''' This function give an entry its version before it is drained, so a
+        replayed entry stores the same version again.
+        :param : entry - entry as a dict
+        :param : version - file's version
+        :return: Nothing.
+        '''
+        intent = {'op': entry['op'], 'file': entry['file'], 'version': version,
+                  'content': os.path.basename(entry['content'])}
+        self.write_intent(entry['path'], intent)
+        with self.condition:
+            entry['version'] = version
+            self.assigned[entry['file']] = max(version, self.assigned.get(entry['file'], 0))
+
+    def pending(self, file):
+        ''' This function return entries of a file which are not drained yet.
+        :param : file - file's name
+        :return: (list of entries in order, last version given to an entry of
+                 file or None) as a tuple.
+        '''
+        with self.condition:
+            entries = [dict(entry) for entry in self.entries if entry['file'] == file]
+            return entries, self.assigned.get(file)
+
+    def start(self):
+        ''' This function start worker threads if they are not started.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        with self.condition:
+            if self.threads or self.stopped:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def wait(self, file=None, timeout=None):
+        ''' This function wait until entries (of a file) are drained.
+        :param : file - file's name, None for all entries
+        :param : timeout - seconds to wait, None for no limit (default: None)
+        :return: True if they are drained, False if not (also when worker threads
+                 are not started).
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while [entry for entry in self.entries if file is None or entry['file'] == file]:
+                if not self.threads or self.stopped:
+                    return False
+                if deadline is None:
+                    self.condition.wait(1)
+                elif deadline <= time.time():
+                    return False
+                else:
+                    self.condition.wait(min(1, deadline - time.time()))
+            return True
+
+    def close(self):
+        ''' This function stop worker threads after the entries they are draining.
+        Other entries stay in the directory.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.lock_file.close()
+
+    def next_entry(self):
+        ''' This function return the first entry which may be drained now, only
+        the first entry of a file may be.
+        :return: (entry or None, seconds until an entry may be retried or None)
+                 as a tuple.
+        '''
+        now = time.time()
+        files = set()
+        wait = None
+        for entry in self.entries:
+            if entry['file'] in files:
+                continue
+            files.add(entry['file'])
+            if entry['busy']:
+                continue
+            if entry['retry_at'] <= now:
+                return entry, None
+            wait = min(wait or entry['retry_at'] - now, entry['retry_at'] - now)
+        return None, wait
+
+    def run(self):
+        ''' This function is a loop of a worker thread.
+        '''
+        while True:
+            with self.condition:
+                entry = None
+                while entry is None:
+                    if self.stopped:
+                        return
+                    entry, wait = self.next_entry()
+                    if entry is None:
+                        self.condition.wait(wait)
+                entry['busy'] = True
+            error = None
+            try:
+                stored = self.drain(entry)
+            except Exception as e:
+                stored, error = None, e
+            if (stored is None and self.max_attempts and
+                    entry['attempts'] + 1 >= self.max_attempts):
+                stored = False
+            if stored is not None:
+                if stored:
+                    shutil.rmtree(entry['path'], ignore_errors=True)
+                else:
+                    os.rename(entry['path'], os.path.join(self.failed_dir, entry['name']))
+                    if self.debug:
+                        print "[SPOOL] cannot store", entry['file'], error or '', "it is moved to", self.failed_dir
+            with self.condition:
+                entry['busy'] = False
+                if stored is None:
+                    entry['attempts'] += 1
+                    delay = self.retry_delay * 2 ** min(entry['attempts'] - 1, 20)
+                    entry['retry_at'] = time.time() + min(delay, self.max_retry_delay)
+                    if self.debug:
+                        print "[SPOOL] cannot store", entry['file'], error
+                else:
+                    self.entries.remove(entry)
+                self.condition.notify_all()
+
+class DownloadCache:
+    # ioctl of Linux which makes a file share the blocks of another (a reflink).
+    FICLONE = 0x40049409
+
+    def __init__(self, directory, max_bytes=1073741824, link=False):
+        ''' This class is a size bounded cache of downloaded files on a local disk,
+        processes may share a directory. A file is named by the sha256 of its key,
+        which changes when a version is changed, so an entry is never stale. Files
+        are written to [directory]/tmp then renamed, so readers never see a
+        partial one. The total size of cached files is kept in [directory]/size,
+        when it is larger than max_bytes least recently used files are removed.
+        Callers are given copies of cached files (reflinks where the file system
+        supports them), or with link read only hardlinks: a caller must not change
+        them, they are the cached files themselves.
+        :param : directory - cache directory, it is created if it is not exists
+        :param : max_bytes - maximum size of cached files (default: 1 GB)
+        :param : link - True, give hardlinks instead of copies (default: False)
+        :return: Nothing.
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hardlink = link
+        self.temp_dir = os.path.join(directory, 'tmp')
+        if not os.path.isdir(self.temp_dir):
+            os.makedirs(self.temp_dir)
+        self.lock_path = os.path.join(directory, 'lock')
+        self.size_path = os.path.join(directory, 'size')
+
+    def path(self, key):
+        ''' This function return a cached file's path of a key.
+        '''
+        return os.path.join(self.directory, hashlib.sha256(key).hexdigest())
+
+    def temp_file(self):
+        ''' This function return a new path to write a file to before put.
+        '''
+        return os.path.join(self.temp_dir, uuid.uuid4().hex)
+
+    def link(self, path, target):
+        ''' This function give a cached file to a caller at target, as a hardlink
+        with link (a copy across file systems), otherwise as a copy.
+        '''
+        if os.path.lexists(target):
+            os.remove(target)
+        if self.hardlink:
+            try:
+                os.link(path, target)
+                return
+            except OSError:
+                pass
+        self.copy(path, target)
+
+    def copy(self, path, target):
+        ''' This function copy a file, a reflink is tried first.
+        '''
+        src = open(path, 'rb')
+        try:
+            dst = open(target, 'wb')
+            try:
+                try:
+                    fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+                except (IOError, OSError):
+                    shutil.copyfileobj(src, dst, 4194304)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+
+    def get(self, key, target):
+        ''' This function use to give a cached file to a caller.
+        :param : key - cache key
+        :param : target - path to make a copy or a hardlink at
+        :return: True if it is cached otherwise False.
+        '''
+        path = self.path(key)
+        try:
+            # Recently used files are removed last (See evict).
+            os.utime(path, None)
+        except OSError:
+            pass
+        try:
+            self.link(path, target)
+        except (IOError, OSError):
+            # It is not cached or removed meanwhile.
+            if os.path.exists(target):
+                os.remove(target)
+            return False
+        return True
+
+    def put(self, key, temp_file, target):
+        ''' This function use to cache a file written to temp_file (See temp_file),
+        then give it to a caller like get.
+        :param : key - cache key
+        :param : temp_file - path of a written file, it is moved
+        :param : target - path to make a copy or a hardlink at
+        :return: Nothing.
+        '''
+        size = os.path.getsize(temp_file)
+        if size > self.max_bytes:
+            shutil.move(temp_file, target)
+            return
+        os.chmod(temp_file, 0444)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            path = self.path(key)
+            total = self.read_size()
+            if total is not None and os.path.exists(path):
+                total -= os.path.getsize(path)
+            os.rename(temp_file, path)
+            if total is None or total + size > self.max_bytes:
+                total = self.evict(path)
+            else:
+                total += size
+            self.write_size(total)
+        finally:
+            lock_file.close()
+        self.link(path, target)
+
+    def read_size(self):
+        ''' This function return the total size of cached files, None if it is
+        not known. The caller holds the lock.
+        '''
+        try:
+            f = open(self.size_path)
+            try:
+                return int(f.read())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+    def write_size(self, total):
+        ''' This function record the total size of cached files. The caller holds
+        the lock.
+        '''
+        f = open(self.size_path, 'w')
+        try:
+            f.write(str(total))
+        finally:
+            f.close()
+
+    def evict(self, keep=None):
+        ''' This function remove least recently used files until the cache is not
+        larger than 90% of max_bytes, so the next puts do not list the directory
+        again, and temp files left by a failed process. The caller holds the lock.
+        :param : keep - path of a file not to remove (default: None)
+        :return: total size of cached files.
+        '''
+        files = list()
+        for name in os.listdir(self.directory):
+            if len(name) != 64:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            files.append((status.st_mtime, status.st_size, path))
+        total = sum([size for mtime, size, path in files])
+        limit = self.max_bytes * 0.9
+        for mtime, size, path in sorted(files):
+            if total <= limit:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        expired = time.time() - 86400
+        for name in os.listdir(self.temp_dir):
+            path = os.path.join(self.temp_dir, name)
+            try:
+                if os.stat(path).st_mtime < expired:
+                    os.remove(path)
+            except OSError:
+                pass
+        return total
+
+class DMS:
+    # MIME type prefixes of formats which are already compressed (See choose_codec).
+    compressed_types = ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'video/',
+                        'audio/', 'application/zip', 'application/gzip',
+                        'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+                        'application/x-7z-compressed', 'application/x-rar',
+                        'application/vnd.openxmlformats-officedocument',
+                        'application/vnd.oasis.opendocument')
+
+    def __init__(self, debug=0, chunk_size=4194304, inline_limit=1048576, dedup=False,
+                 cache_entries=0, cache_bytes=67108864, cache_ttl=60,
+                 max_connections=10, timeout=None, keep_alive=True, meta_index=(),
+                 extract_workers=0, extract_timeout=None, extract_max_bytes=None,
+                 extract_cache=None, search_cache_entries=0, search_cache_ttl=10,
+                 compression=None, compression_level=None, compression_min_size=1024,
+                 compression_skip_types=None, pack_limit=0, pack_size=134217728,
+                 split_limit=0, split_size=67108864, transfer_workers=4, delta=False,
+                 delta_chain=10, delta_limit=16777216, read_only=False, spool_dir=None,
+                 spool_workers=2, spool_retry_delay=1.0, download_cache=None,
+                 download_cache_bytes=1073741824, spool_max_attempts=20, spool_timeout=300,
+                 download_cache_link=False):
         ''' This function use to init a class. To show an error messages debug
         should be 1.
         :param : debug - 1, show an error or success message. 0 otherwise
+        :param : chunk_size - bytes per request when a file is streamed to or
+                 from hdfs (default: 4 MB)
+        :param : inline_limit - files up to this size also keep their content in
+                 hbase, larger files keep only an hdfs path (default: 1 MB)
+        :param : dedup - True, store each unique content once on hdfs as a blob
+                 named by its sha256 and let versions reference it. Use the same
+                 setting for every DMS sharing a table. (default: False)
+        :param : cache_entries - cache up to this many fetched rows and version
+                 lists in this process, 0 to disable (default: 0)
+        :param : cache_bytes - maximum size of cached rows (default: 64 MB)
+        :param : cache_ttl - seconds before a cached entry expires, this bounds
+                 how stale a change made by another process can be (default: 60)
+        :param : max_connections - http connections kept open per host, shared by
+                 hbase, hdfs and solr (default: 10)
+        :param : timeout - seconds to wait for hbase, hdfs or solr, None for no
+                 limit (default: None)
+        :param : keep_alive - False, do not reuse http connections (default: True)
+        :param : meta_index - names of meta_data columns to index for find_by_meta,
+                 for example ('MIME type', 'length', 'modificationTime'). Use the
+                 same setting for every DMS sharing a table. (default: (), none)
+        :param : extract_workers - extract meta data in this many worker processes
+                 (See ExtractorPool), 0 to extract in the calling thread (default: 0)
+        :param : extract_timeout - seconds before extracting a file is given up,
+                 only with extract_workers (default: None, no limit)
+        :param : extract_max_bytes - parse only the first bytes of a file
+                 (default: None, whole file)
+        :param : extract_cache - directory to keep extracted meta data by file's
+                 sha256, so the same content is never parsed twice (default: None)
+        :param : search_cache_entries - cache up to this many search results, 0 to
+                 disable (default: 0)
+        :param : search_cache_ttl - seconds before a cached search result expires
+                 (default: 10)
+        :param : compression - codec to compress stored content with, 'zlib' or
+                 'bz2', None to store it as it is (See choose_codec). A version's
+                 codec is kept in its meta_data, reads decompress it. (default:
+                 None)
+        :param : compression_level - codec's level, None for its default
+        :param : compression_min_size - do not compress smaller files (default: 1 KB)
+        :param : compression_skip_types - MIME type prefixes of files which are
+                 already compressed (default: None, See compressed_types)
+        :param : pack_limit - files up to this size are appended to shared
+                 container files on hdfs instead of having their own (See
+                 pack_data), 0 to disable. Containers are tracked in [table]_pack.
+                 Use the same setting for every DMS sharing a table. Not used in
+                 dedup mode. (default: 0)
+        :param : pack_size - start a new container file after this size
+                 (default: 128 MB)
+        :param : split_limit - files larger than this are stored as parts of
+                 split_size bytes, each one its own hdfs file (See store_parts),
+                 0 to disable. Not used in dedup mode. (default: 0)
+        :param : split_size - bytes per part (default: 64 MB)
+        :param : transfer_workers - threads uploading or downloading parts of
+                 a file (default: 4)
+        :param : delta - True, store a version as a delta of the version before it
+                 in hbase when the delta is small (See encode_version), reads
+                 rebuild it. Use the same setting for every DMS sharing a table.
+                 Not used in dedup mode. (default: False)
+        :param : delta_chain - store a full copy at least every delta_chain
+                 versions, so rebuilding reads at most this many rows (default: 10)
+        :param : delta_limit - files larger than this are always stored as full
+                 copies, a delta is built in memory (default: 16 MB)
+        :param : read_only - True, never extract meta data, check or create hbase
+                 tables or write anything, writes fail with IOError "DMS is read
+                 only". For processes which only read. (default: False)
+        :param : spool_dir - local directory to keep uploads and updates in, they
+                 return when a file is copied there and worker threads store it on
+                 hdfs and hbase later, retrying up to spool_max_attempts times
+                 (See Spool).
+                 Entries left by a previous DMS are stored after connecting.
+                 Versions are numbered when they are stored, reads of a file by
+                 its name and version see spooled versions. Only one process at a
+                 time may use a spool directory. (default: None, store at once)
+        :param : spool_workers - threads storing spooled files (default: 2)
+        :param : spool_retry_delay - seconds before storing a file is retried,
+                 it doubles for every failure up to a minute (default: 1)
+        :param : spool_max_attempts - attempts to store a spooled file before it
+                 is moved to [spool_dir]/failed, None to retry forever (default: 20)
+        :param : spool_timeout - seconds delete, delete_many and flush wait for
+                 spooled files to be stored, None for no limit (default: 300)
+        :param : download_cache - local directory to keep downloaded files in, a
+                 download of the same version is then a copy of it. Processes may
+                 share it. (See DownloadCache) (default: None)
+        :param : download_cache_bytes - maximum size of download_cache, least
+                 recently used files are removed first (default: 1 GB)
+        :param : download_cache_link - True, a download from download_cache is a
+                 read only hardlink of the cached file instead of a copy, faster
+                 for large files but it must not be changed (default: False)
+        :return: Nothing.
+        '''
+        self.debug = debug
+        self.chunk_size = chunk_size
+        self.inline_limit = inline_limit
+        self.dedup = dedup
+        self.cache = None
+        if cache_entries:
+            self.cache = Cache(cache_entries, cache_bytes, cache_ttl)
+        self.metrics = Stats(debug)
+        self.pool = ConnectionPool(max_connections, timeout, keep_alive, self.metrics)
+        self.meta_index = tuple(meta_index)
+        self.extract_max_bytes = extract_max_bytes
+        self.extract_cache = extract_cache
+        if extract_cache and not os.path.isdir(extract_cache):
+            os.makedirs(extract_cache)
+        self.extractor = None
+        self.indexer = None
+        self.compression = compression
+        if compression not in (None, 'zlib', 'bz2'):
+            raise ValueError("unknown codec: %s" % compression)
+        self.compression_level = compression_level
+        self.compression_min_size = compression_min_size
+        if compression_skip_types is not None:
+            self.compressed_types = tuple(compression_skip_types)
+        self.pack_limit = 0 if dedup else pack_limit
+        self.pack_size = pack_size
+        # Container this DMS appends to, shared with its copies (See upload_many).
+        self.packer = {'lock': threading.Lock(), 'name': None, 'offset': 0}
+        self.split_limit = 0 if dedup else split_limit
+        self.delta = delta and not dedup
+        self.delta_chain = delta_chain
+        self.delta_limit = delta_limit
+        self.split_size = split_size
+        self.transfer_workers = transfer_workers
+        self.search_cache = None
+        if search_cache_entries:
+            self.search_cache = Cache(search_cache_entries, cache_bytes, search_cache_ttl)
+        self.read_only = read_only
+        if extract_workers and not read_only:
+            self.extractor = ExtractorPool(extract_workers, extract_timeout)
+        self.download_cache = None
+        if download_cache:
+            self.download_cache = DownloadCache(download_cache, download_cache_bytes,
+                                                download_cache_link)
+        self.spool = None
+        if spool_dir and not read_only:
+            self.spool = Spool(spool_dir, self.drain, spool_workers, spool_retry_delay,
+                               max_attempts=spool_max_attempts, chunk_size=chunk_size,
+                               debug=debug)
+        self.spool_timeout = spool_timeout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        ''' This function use to close all http connections of this DMS. You can
+        also use DMS as a context manager (with DMS() as dms: ...).
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        if self.spool is not None:
+            self.spool.close()
+        if self.indexer is not None:
+            self.indexer.close()
+        self.pool.close()
+        if self.extractor is not None:
+            self.extractor.close()
+
+    def stats(self):
+        ''' This function return a snapshot of time of DMS operations (upload,
+        download, extract, ...) and calls, bytes and latency of each backend call
+        (hbase.fetch, hbase.insert, hbase.scan, hdfs.create, hdfs.open, hdfs.
+        getfilestatus, solr.select, ...) since this DMS is created.
+        :param : Nothing.
+        :return: stats as a dict (See Stats.snapshot).
+        '''
+        return self.metrics.snapshot()
+
+    def reset_stats(self):
+        ''' This function use to clear stats.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        self.metrics.reset()
+
+    def add_stats_hook(self, hook):
+        ''' This function use to add a function which is called with every record
+        of stats, for example to export them to a metrics system. It is called in
+        the thread which made the call, so it should be fast.
+        :param : hook - function(event), event is a dict of kind ('operation' or
+                 'backend'), name, seconds, bytes_sent, bytes_received and error
+        :return: Nothing.
+        '''
+        with self.metrics.lock:
+            self.metrics.hooks.append(hook)
+
+    def remove_stats_hook(self, hook):
+        ''' This function use to remove a hook (See add_stats_hook).
+        :param : hook - function which is added
+        :return: Nothing.
+        '''
+        with self.metrics.lock:
+            self.metrics.hooks.remove(hook)
+
+    def flush(self):
+        ''' This function use to wait until spooled files are stored (See
+        spool_dir), then send documents queued for solr (See solr_connection) now
+        and wait until they are sent.
+        :param : Nothing.
+        :return: True if spooled files are stored, False if they are not in
+                 spool_timeout seconds or they cannot be stored now (hbase and
+                 hdfs are not connected or the DMS is closed).
+        '''
+        stored = True
+        if self.spool is not None:
+            stored = self.spool.wait(timeout=self.spool_timeout)
+            if not stored and self.debug:
+                print "[SPOOL] spooled files are not stored."
+        if self.indexer is not None:
+            self.indexer.flush()
+        return stored
+
+    def hbase_connection(self, host, port, table='dms', key_layout='version'):
+        ''' This function use to establish a connection to hbase, for preparing to
+        insert, remove, fetch data from hbase. We use starbase for connect to hbase
+        via rest api.(See more: https://github.com/barseghyanartur/starbase)
+        :param : host - hbase rest host
+        :param : port - hbase rest running port
+        :param : table - DMS table on hbase (default: 'dms'). File's versions are
+                 indexed in another table named [table]_version, blob references
+                 of dedup mode are in [table]_blob, meta data index (See
+                 meta_index) is in [table]_meta and containers of small files
+                 (See pack_limit) are in [table]_pack.
+        :param : key_layout - row key layout of the table (See row_key), 'version'
+                 or 'name'. Use migrate_table to change it. (default: 'version')
+        :return: Nothing. The connection is made and tables are checked on their
+                 first use.
+        '''
+        self.hbase = Lazy(self.connect_hbase, host, port)
+        self.open_tables(table, key_layout)
+        self.start_spool()
+
+    def connect_hbase(self, host, port):
+        ''' This function use to make a starbase connection (See hbase_connection)
+        whose tables send their requests through the pool of this DMS (See
+        private_class). Its http_request is the request class to use with it.
+        :param : host - hbase rest host
+        :param : port - hbase rest running port
+        :return: starbase connection.
+        '''
+        request = private_class(transport.HttpRequest, requests=self.pool)
+        batch = private_class(importlib.import_module('starbase.client.table.batch').Batch,
+                              HttpRequest=request)
+        table = private_class(importlib.import_module('starbase.client.table').Table,
+                              HttpRequest=request, Batch=batch)
+        connection = private_class(starbase.Connection, HttpRequest=request, Table=table)
+        connection.http_request = request
+        return connection(host=host, port=port)
+
+    def open_tables(self, table, key_layout='version'):
+        ''' This function use to open (and create if they are not exists) DMS table
+        and its version index and blob tables on the connected hbase.
+        :param : table - DMS table on hbase
+        :param : key_layout - row key layout of the table (See row_key)
         :return: Nothing.
         '''
-        self.debug = debug
-        pass
+        if key_layout not in ('version', 'name'):
+            raise ValueError("unknown key layout: %s" % key_layout)
+        self.key_layout = key_layout
+        self.hbase_table = self.open_table(table, 'meta_data', 'file')
+        self.version_table = self.open_table(''.join([table,'_version']), 'version')
+        # Blobs and containers are opened without dedup and pack_limit too, a
+        # version stored by another DMS may be in them. A table is only checked
+        # when it is used.
+        self.blob_table = self.open_table(''.join([table,'_blob']), 'ref')
+        if self.meta_index:
+            self.meta_table = self.open_table(''.join([table,'_meta']), 'row')
+        self.pack_table = self.open_table(''.join([table,'_pack']), 'entry', 'info')
+
+    def open_table(self, name, *families):
+        ''' This function use to open an hbase table, it is created with families
+        if it is not exists. The check is made on the first use of the table
+        (See check_table), reads by its name (See fetch and scan) do not need it.
+        :param : name - table's name
+        :param : families - column families of a new table
+        :return: starbase table.
+        '''
+        t = Lazy(self.check_table, name, families)
+        t.name = name
+        return t
+
+    def check_table(self, name, families):
+        ''' This function use to get a starbase table, it is created with families
+        if it is not exists. A table is checked once per process and hbase.
+        :param : name - table's name
+        :param : families - column families of a new table
+        :return: starbase table.
+        '''
+        t = self.hbase.table(name)
+        checked = (self.hbase.base_url, name)
+        if not self.read_only and checked not in checked_tables:
+            if (not t.exists()):
+                t.create(*families)
+            checked_tables.add(checked)
+        # The table is known to exist now, so skip the extra exists() request
+        # starbase sends before every row operation.
+        t.disable_row_operation_if_exists_checks()
+        return t
+
+    def hdfs_connection(self, host, port, user_name, hdfs_path='/tmp/'):
+        ''' This function use to establish a connection to hdfs, for preparing to
+        create, retrieve, update, delete file in hdfs. We use pywebhdfs in order to
+        do this task via hdfs rest api.(See more: http://pythonhosted.org/pywebhdfs/)
+        :param : host - hdfs rest host
+        :param : port - hdfs rest running port
+        :param : user_name - hdfs username (for authentication)
+        :param : hdfs_path - location to store files. (default: '/tmp/')
+        :return: Nothing. The client is made on its first use.
+        '''
+        self.hdfs = Lazy(self.connect_hdfs, host, port, user_name)
+        self.hdfs_path = hdfs_path
+        self.start_spool()
+
+    def start_spool(self):
+        ''' This function start storing spooled files once hbase and hdfs are
+        connected (See spool_dir).
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        if (self.spool is not None and getattr(self, 'hbase', None) is not None and
+                getattr(self, 'hdfs', None) is not None):
+            self.spool.start()
+
+    def connect_hdfs(self, host, port, user_name):
+        ''' This function use to make a pywebhdfs client (See hdfs_connection)
+        which sends its requests through the pool of this DMS.
+        :param : host - hdfs rest host
+        :param : port - hdfs rest running port
+        :param : user_name - hdfs username
+        :return: pywebhdfs client.
+        '''
+        client = private_class(webhdfs.PyWebHdfsClient, requests=self.pool)
+        return client(host=host, port=port, user_name=user_name, timeout=self.pool.timeout)
+
+    def solr_connection(self, host, port, collection, index=False, batch_size=100,
+                        flush_interval=1.0, commit_within=1000, max_queue=10000):
+        ''' This function use to establish a connection to solr, for query or
+        search any text on a system. With index, uploaded and updated versions are
+        added to solr and deleted ones are removed, in batches from a background
+        thread (See SolrIndexer and build_document).
+        :param : host - solr's host
+        :param : port - solr's running port
+        :param : collection - solr's collection for searching
+        :param : index - True, keep solr in sync with DMS (default: False)
+        :param : batch_size - maximum documents per update request (default: 100)
+        :param : flush_interval - seconds before a partial batch is sent (default: 1)
+        :param : commit_within - milliseconds solr may wait before a commit
+                 (default: 1000)
+        :param : max_queue - maximum queued documents, uploads wait when it is
+                 full (default: 10000)
+        '''
+        self.solr = ''.join(['http://',host,':',port,'/solr/',collection])
+        if self.indexer is not None:
+            self.indexer.close()
+            self.indexer = None
+        if index:
+            self.indexer = SolrIndexer(self.pool, self.solr, batch_size, flush_interval,
+                                       commit_within, max_queue, debug=self.debug)
+
+    def build_document(self, key, row, content=None):
+        ''' This function use to build a solr document of a version. Its id is the
+        row key and content is indexed only if it is stored in hbase as utf-8 text.
+        :param : key - row key
+        :param : row - row as a dict (See build_row)
+        :param : content - file's content if it is not in row (default: None)
+        :return: solr document as a dict.
+        '''
+        meta_data = row['meta_data']
+        document = {'id': key, 'name': row['file']['name'], 'version': meta_data['version']}
+        for field, column in (('mime_type', 'MIME type'), ('length', 'length'),
+                              ('modificationTime', 'modificationTime')):
+            if column in meta_data:
+                document[field] = meta_data[column]
+        if content is None:
+            content = row['file'].get('content')
+            if content is not None and meta_data.get('codec'):
+                content = ''.join(self.decompress_chunks([content], meta_data['codec']))
+        if content is not None:
+            try:
+                document['content'] = content.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        return document
+
+    @timed('extract')
+    def extract(self, file, digest=None):
+        ''' This function use to extract meta data from a file. We use hachoir3 library
+        to extract them. (See more: http://hachoir3.readthedocs.org)
+        With extract_cache, a result (also None when hachoir does not know the
+        file) is kept by file's sha256 and extract_max_bytes and reused for the
+        same content. A failed or timed out extract is not kept.
+        :param : file - file for extract
+        :param : digest - sha256 of a file if it is already known (default: None)
+        :return: meta data as dict for success, None if fail.
+        '''
+        if self.read_only:
+            return None
+        if self.extract_cache:
+            if digest is None:
+                f = open(file, 'rb')
+                try:
+                    digest = self.hash_file(f)[0]
+                finally:
+                    f.close()
+            cache_file = os.path.join(self.extract_cache, digest)
+            if self.extract_max_bytes is not None:
+                cache_file = ''.join([cache_file,'.',str(self.extract_max_bytes)])
+            try:
+                f = open(cache_file)
+                try:
+                    return simplejson.load(f)['meta_data']
+                finally:
+                    f.close()
+            except (IOError, ValueError, KeyError):
+                pass
+        try:
+            if self.extractor is not None:
+                meta_list = self.extractor.extract(file, self.extract_max_bytes)
+            else:
+                meta_list = extract_meta_data(file, self.extract_max_bytes)
+        except Exception as e:
+            if self.debug:
+                print "Something went wrong, meta data of",file,"could not extract.",e
+            # It may work next time (a timeout, a killed process), keep nothing.
+            return None
+        if self.extract_cache:
+            # Write a new file then rename it, so readers never see a partial one.
+            temp_file = ''.join([cache_file,'.',str(os.getpid()),'.',str(threading.current_thread().ident)])
+            try:
+                f = open(temp_file, 'w')
+                try:
+                    simplejson.dump({'meta_data': meta_list}, f)
+                finally:
+                    f.close()
+                os.rename(temp_file, cache_file)
+            except (IOError, OSError):
+                if self.debug:
+                    print "Cannot cache meta data of",file
+        return meta_list
+
+    def row_key(self, file, version, key_layout=None):
+        ''' This function return the row key of a file's version. There are 2 row
+        key layouts:
+        'version' - v[version].[file], for example v1.mytext.txt
+        'name' - [file].[9999999999 - version] (10 digits), for example
+                 mytext.txt.9999999998 for version 1. Versions of a file are next
+                 to each other and the newest one comes first, so they can be read
+                 with a bounded range scan (See scan_versions).
+        :param : file - file's name
+        :param : version - file's version
+        :param : key_layout - 'version' or 'name' (default: layout of DMS table)
+        :return: row key as a string.
+        '''
+        if (key_layout or self.key_layout) == 'name':
+            return '%s.%010d' % (file, 9999999999 - int(version))
+        return ''.join(['v',str(version),'.',file])
+
+    def parse_row_key(self, key, key_layout=None):
+        ''' This function return a file's name and version of a row key.
+        :param : key - row key
+        :param : key_layout - 'version' or 'name' (default: layout of DMS table)
+        :return: (file, version as an integer) tuple, None if key is not a row key
+                 of the layout.
+        '''
+        if (key_layout or self.key_layout) == 'name':
+            file, dot, number = key.rpartition('.')
+            if not dot or len(number) != 10 or not number.isdigit():
+                return None
+            return file, 9999999999 - int(number)
+        version, dot, file = key.partition('.')
+        if not dot or version[:1] != 'v' or not version[1:].isdigit():
+            return None
+        return file, int(version[1:])
+
+    def version_name(self, file, version):
+        ''' This function return a name of a file's version on hdfs and in a
+        download directory (v[version].[file]), it does not depend on the row key
+        layout.
+        :param : file - file's name
+        :param : version - file's version
+        :return: name as a string.
+        '''
+        return ''.join(['v',str(version),'.',file])
+
+    def fetch(self, table, key, columns=None):
+        ''' This function use to fetch a row of an hbase table. Rows are decoded
+        here (See decode_row) instead of by starbase, whose json_decode appends to
+        a default argument for every cell and gets slower the longer a process
+        runs.
+        :param : table - starbase table
+        :param : key - row key
+        :param : columns - list of 'family' or 'family:column', or a dict of
+                 family -> list of columns (default: None, all columns)
+        :return: row as a dict, None if it is not exists.
+        '''
+        if isinstance(columns, dict):
+            columns = [''.join([family,':',column])
+                       for family, names in columns.items() for column in names]
+        url = '/'.join([table.name, key, ','.join(columns or [])])
+        # Keep the limit of a throttled table (See upload_many).
+        slots = table.slots if isinstance(table, Throttle) else None
+        if slots is not None:
+            slots.acquire()
+        try:
+            response = self.hbase.http_request(connection=self.hbase, url=url).get_response()
+        finally:
+            if slots is not None:
+                slots.release()
+        if response.status_code != 200 or not response.content:
+            return None
+        return self.decode_row(response.content['Row'][0])[1]
+
+    def decode_row(self, item):
+        ''' This function decode a row of a stargate json response, its key,
+        columns and values are base64.
+        :param : item - row of a response
+        :return: (row key, row as a dict of column family -> {column: value}) tuple.
+        '''
+        row = dict()
+        for cell in item['Cell']:
+            family, column = base64.b64decode(cell['column']).split(':', 1)
+            row.setdefault(family, dict())[column] = base64.b64decode(cell['$'])
+        return base64.b64decode(item['key']), row
+
+    def fetch_row(self, key):
+        ''' This function use to fetch a whole row from hbase, through the cache
+        if it is enabled.
+        :param : key - row key
+        :return: row as a dict, None if it is not exists.
+        '''
+        if self.cache is not None:
+            row = self.cache.get(('row', key))
+            if row is not None:
+                return row
+        row = self.fetch(self.hbase_table, key)
+        if row and self.cache is not None:
+            size = sum([len(str(c)) + len(str(v)) for cf in row.values() for c, v in cf.items()])
+            self.cache.put(('row', key), row, size)
+        return row
+
+    def invalidate(self, file, key=None):
+        ''' This function use to drop cached entries of a file after it changed.
+        :param : file - file's name
+        :param : key - row key of a changed version (default: None)
+        :return: Nothing.
+        '''
+        if self.cache is not None:
+            self.cache.invalidate(('version', file))
+            if key:
+                self.cache.invalidate(('row', key))
+
+    def build_row(self, file, file_content, file_meta, hdfs_meta, version, path=None):
+        ''' This function use to build a whole hbase row of a file (content, file's
+        meta data, hdfs's file's meta data and version) as a single mutation.
+        :param : file - file's name
+        :param : file_content - file's content, None to store only the hdfs path
+        :param : file_meta - file's meta data from extract (None is allowed)
+        :param : hdfs_meta - hdfs's FileStatus of a stored file
+        :param : version - file's version
+        :param : path - hdfs path of a stored file
+        :return: row as a dict of column family -> {column: value}.
+        '''
+        meta_data = dict()
+        meta_data.update(file_meta or dict())
+        meta_data.update(hdfs_meta)
+        meta_data['version'] = version
+        row = {
+            'file': {'name': file},
+            'meta_data': meta_data
+        }
+        if file_content is not None:
+            row['file']['content'] = file_content
+        if path:
+            row['file']['path'] = path
+        return row
+
+    def check_writable(self):
+        ''' This function raise IOError if DMS is read only (See read_only).
+        '''
+        if self.read_only:
+            raise IOError("DMS is read only")
+
+    def insert_row(self, key, row):
+        ''' This function use to insert a whole row to hbase in one request instead
+        of one request per column.
+        :param : key - row key
+        :param : row - row as a dict (See build_row)
+        :return: True if success otherwise False.
+        '''
+        self.check_writable()
+        status = self.hbase_table.insert(key, row)
+        if status != 200:
+            if self.debug:
+                self.print_insert_error(row)
+            return False
+        return True
+
+    def insert_rows(self, rows, table=None):
+        ''' This function use to insert many rows to hbase with a starbase batch,
+        so all of them are sent in one request.
+        :param : rows - list of (key, row) tuples (See build_row)
+        :param : table - starbase table to insert into (default: DMS table)
+        :return: True if success otherwise False.
+        '''
+        self.check_writable()
+        if not rows:
+            return True
+        if table is None:
+            table = self.hbase_table
+        batch = table.batch()
+        if batch is None:
+            if self.debug:
+                print "[HBASE] cannot create a batch."
+            return False
+        for key, row in rows:
+            batch.insert(key, row)
+        result = batch.commit(finalize=True)
+        if [status for status in result['response'] if status != 200]:
+            if self.debug:
+                for key, row in rows:
+                    print "Error inserting row:", key
+                    self.print_insert_error(row)
+            return False
+        return True
+
+    def print_insert_error(self, row):
+        ''' This function use to print which columns of a row could not be inserted.
+        :param : row - row as a dict (See build_row)
+        :return: Nothing.
+        '''
+        if 'content' in row.get('file', {}):
+            print "Error inserting: file content"
+        for column in row.get('meta_data', {}).keys():
+            print "Error inserting:", column
+
+    def store_file(self, f, path, overwrite=False, codec=None):
+        ''' This function use to stream a file to hdfs chunk by chunk (create,
+        then append), so a whole file is never held in memory.
+        :param : f - opened file object
+        :param : path - hdfs path
+        :param : overwrite - overwrite an existing hdfs file (default: False)
+        :param : codec - compress a file with this codec (default: None)
+        :return: stored (compressed) content if it is not larger than inline_limit,
+                 otherwise None.
+        '''
+        chunks = iter(lambda: f.read(self.chunk_size), '')
+        if codec:
+            chunks = self.compress_chunks(chunks, codec)
+        return self.write_chunks(chunks, path, overwrite, self.inline_limit)[0]
+
+    def write_chunks(self, chunks, path, overwrite=False, inline_limit=0):
+        ''' This function use to write chunks to an hdfs file, the first one
+        creates it and the rest are appended.
+        :param : chunks - iterable of chunks
+        :param : path - hdfs path
+        :param : overwrite - overwrite an existing hdfs file (default: False)
+        :param : inline_limit - keep content up to this size (default: 0)
+        :return: (content if it is not larger than inline_limit otherwise None,
+                 number of written bytes) as a tuple.
+        '''
+        inline = list()
+        size = 0
+        created = False
+        for chunk in chunks:
+            if created:
+                self.hdfs.append_file(path,chunk)
+            else:
+                self.hdfs.create_file(path,chunk,overwrite=overwrite)
+                created = True
+            size += len(chunk)
+            if inline is not None:
+                if size <= inline_limit:
+                    inline.append(chunk)
+                else:
+                    inline = None
+        if not created:
+            self.hdfs.create_file(path,'',overwrite=overwrite)
+        if inline is None:
+            return None, size
+        return ''.join(inline), size
+
+    def hdfs_status(self, path):
+        ''' This function return FileStatus of an hdfs path, None if it is not
+        exists.
+        '''
+        try:
+            return self.hdfs.get_file_dir_status(path)['FileStatus']
+        except Exception:
+            return None
+
+    def store_parts(self, f, path, codec=None):
+        ''' This function use to store a large file as parts of split_size bytes in
+        the hdfs directory path, transfer_workers parts at a time. A part is
+        written to a temporary name, then renamed to [index].[sha256 prefix], so
+        parts which are already on hdfs are not sent again when an interrupted
+        upload or update is retried. Other files in the directory are removed.
+        :param : f - opened file object
+        :param : path - hdfs directory of parts
+        :param : codec - compress each part on its own with this codec (default: None)
+        :return: manifest as a dict, parts is a list of [name, stored length,
+                 length] (See read_parts).
+        '''
+        size = os.fstat(f.fileno()).st_size
+        existing = dict()
+        status = self.hdfs_status(path)
+        if status and status['type'] != 'DIRECTORY':
+            self.hdfs.delete_file_dir(path)
+        elif status:
+            for item in self.hdfs.list_dir(path)['FileStatuses']['FileStatus']:
+                existing[item['pathSuffix']] = item['length']
+
+        def read_part(index):
+            part = open(f.name, 'rb')
+            try:
+                part.seek(index * self.split_size)
+                left = self.split_size
+                while left > 0:
+                    chunk = part.read(min(self.chunk_size, left))
+                    if not chunk:
+                        break
+                    left -= len(chunk)
+                    yield chunk
+            finally:
+                part.close()
+
+        def store_part(index):
+            h = hashlib.sha256()
+            length = 0
+            for chunk in read_part(index):
+                h.update(chunk)
+                length += len(chunk)
+            name = '%05d.%s' % (index, h.hexdigest()[:16])
+            if codec:
+                name = '.'.join([name, codec])
+            if name in existing:
+                return [name, existing[name], length]
+            chunks = read_part(index)
+            if codec:
+                chunks = self.compress_chunks(chunks, codec)
+            temp = ''.join([path,'/',name,'.tmp'])
+            stored = self.write_chunks(chunks, temp, overwrite=True)[1]
+            if not self.hdfs.rename_file_dir(temp, ''.join([path,'/',name])).get('boolean'):
+                raise IOError("[HDFS] cannot rename a part: %s" % temp)
+            return [name, stored, length]
+
+        count = max(1, (size + self.split_size - 1) // self.split_size)
+        pool = WorkerPool(max(1, min(self.transfer_workers, count)))
+        try:
+            futures = [pool.submit(store_part, index) for index in range(count)]
+            parts = [future.result() for future in futures]
+        finally:
+            pool.close()
+        names = set([name for name, stored, length in parts])
+        for name in existing:
+            if name not in names:
+                self.hdfs.delete_file_dir(''.join([path,'/',name]))
+        return {'parts': parts}
+
+    def read_parts(self, path, manifest, codec=None, offset=0, length=None):
+        ''' This function use to read a file stored as parts (See store_parts) like
+        read_content, only parts which overlap offset and length are read.
+        :param : path - hdfs directory of parts
+        :param : manifest - manifest of parts
+        :param : codec - file's codec (default: None)
+        :param : offset - first byte to read (default: 0)
+        :param : length - number of bytes to read (default: None, to the end)
+        :return: generator of file's chunks.
+        '''
+        start = 0
+        for name, stored, size in manifest['parts']:
+            end = start + size
+            if length is not None and start >= offset + length:
+                break
+            if end > offset:
+                part_offset = max(0, offset - start)
+                part_length = None
+                if length is not None:
+                    part_length = min(size, offset + length - start) - part_offset
+                for chunk in self.read_content(''.join([path,'/',name]), codec,
+                                               part_offset, part_length):
+                    yield chunk
+            start = end
+
+    def download_parts(self, path, manifest, codec, target):
+        ''' This function use to download a file stored as parts, transfer_workers
+        parts at a time. Parts are written at their offsets of [target].download
+        and each finished one is recorded in [target].progress, so an interrupted
+        download continues from the parts which are done. [target].download is
+        renamed to target at the end.
+        :param : path - hdfs directory of parts
+        :param : manifest - manifest of parts
+        :param : codec - file's codec
+        :param : target - local file
+        :return: Nothing. Raise an error if it fails.
+        '''
+        parts = manifest['parts']
+        temp = ''.join([target,'.download'])
+        progress = ''.join([target,'.progress'])
+        signature = hashlib.sha256(simplejson.dumps(parts)).hexdigest()
+        done = set()
+        if os.path.exists(temp) and os.path.exists(progress):
+            f = open(progress)
+            try:
+                lines = f.read().split('\n')
+            finally:
+                f.close()
+            # The last line is either empty or not completely written.
+            if lines[0] == signature:
+                done = set([int(line) for line in lines[1:-1]])
+        if not done:
+            open(temp, 'wb').close()
+            f = open(progress, 'w')
+            try:
+                f.write(''.join([signature,'\n']))
+            finally:
+                f.close()
+        offsets = [0]
+        for name, stored, size in parts:
+            offsets.append(offsets[-1] + size)
+
+        lock = threading.Lock()
+        log = open(progress, 'a')
+        def fetch_part(index):
+            f = open(temp, 'r+b')
+            try:
+                f.seek(offsets[index])
+                for chunk in self.read_content(''.join([path,'/',parts[index][0]]), codec):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            with lock:
+                log.write('%d\n' % index)
+                log.flush()
+
+        todo = [index for index in range(len(parts)) if index not in done]
+        pool = WorkerPool(max(1, min(self.transfer_workers, len(todo))))
+        try:
+            futures = [pool.submit(fetch_part, index) for index in todo]
+            for future in futures:
+                future.result()
+        finally:
+            pool.close()
+            log.close()
+        os.rename(temp, target)
+        os.remove(progress)
+
+    def choose_codec(self, file, size):
+        ''' This function is the compression policy. A file is compressed with the
+        codec of DMS unless it is smaller than compression_min_size or its MIME type
+        (guessed from its name) is already compressed, like JPEG or ZIP.
+        :param : file - file's name
+        :param : size - file's size
+        :return: codec's name, None to store a file as it is.
+        '''
+        if not self.compression or size < self.compression_min_size:
+            return None
+        mime_type, encoding = mimetypes.guess_type(file)
+        if encoding:
+            return None
+        for prefix in self.compressed_types:
+            if (mime_type or '').startswith(prefix):
+                return None
+        return self.compression
+
+    def compress_chunks(self, chunks, codec):
+        ''' This function use to compress chunks as a stream, compressed chunks are
+        joined up to about chunk_size.
+        :param : chunks - iterable of chunks
+        :param : codec - 'zlib' or 'bz2'
+        :return: generator of compressed chunks.
+        '''
+        if codec == 'zlib':
+            compressor = zlib.compressobj(-1 if self.compression_level is None else self.compression_level)
+        elif codec == 'bz2':
+            compressor = bz2.BZ2Compressor(self.compression_level or 9)
+        else:
+            raise ValueError("unknown codec: %s" % codec)
+        output = list()
+        size = 0
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                output.append(data)
+                size += len(data)
+            if size >= self.chunk_size:
+                yield ''.join(output)
+                output = list()
+                size = 0
+        output.append(compressor.flush())
+        yield ''.join(output)
+
+    def decompress_chunks(self, chunks, codec):
+        ''' This function use to decompress chunks as a stream, a zlib chunk is
+        decompressed chunk_size bytes at a time.
+        :param : chunks - iterable of compressed chunks
+        :param : codec - 'zlib' or 'bz2'
+        :return: generator of chunks.
+        '''
+        if codec == 'zlib':
+            decompressor = zlib.decompressobj()
+            for chunk in chunks:
+                while chunk:
+                    data = decompressor.decompress(chunk, self.chunk_size)
+                    chunk = decompressor.unconsumed_tail
+                    if data:
+                        yield data
+            data = decompressor.flush()
+            if data:
+                yield data
+        elif codec == 'bz2':
+            decompressor = bz2.BZ2Decompressor()
+            for chunk in chunks:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+        else:
+            raise ValueError("unknown codec: %s" % codec)
+
+    def read_content(self, path, codec=None, offset=0, length=None, span=None,
+                     manifest=None):
+        ''' This function use to read a stored file like read_chunks, but
+        decompress it if it is compressed. A compressed file is read from its
+        start, bytes before offset are skipped after decompression.
+        :param : path - hdfs path
+        :param : codec - file's codec (default: None)
+        :param : offset - first byte to read (default: 0)
+        :param : length - number of bytes to read (default: None, to the end)
+        :param : span - (offset, length) of a packed file in its container
+                 (default: None, the whole hdfs file)
+        :param : manifest - manifest of a file stored as parts (default: None)
+        :return: generator of file's chunks.
+        '''
+        if manifest:
+            for chunk in self.read_parts(path, manifest, codec, offset, length):
+                yield chunk
+            return
+        start, size = span or (0, None)
+        if not codec:
+            if size is not None:
+                offset = min(offset, size)
+                length = size - offset if length is None else min(length, size - offset)
+            for chunk in self.read_chunks(path, start + offset, length):
+                yield chunk
+            return
+        chunks = self.decompress_chunks(self.read_chunks(path, start, size), codec)
+        for chunk in chunks:
+            if offset >= len(chunk):
+                offset -= len(chunk)
+                continue
+            chunk = chunk[offset:]
+            offset = 0
+            if length is not None:
+                chunk = chunk[:length]
+                length -= len(chunk)
+            if chunk:
+                yield chunk
+            if length == 0:
+                break
+
+    def hash_file(self, f):
+        ''' This function use to compute sha256 of a file chunk by chunk, then
+        rewind it.
+        :param : f - opened file object
+        :return: (hex digest, file's size) as a tuple.
+        '''
+        h = hashlib.sha256()
+        size = 0
+        chunk = f.read(self.chunk_size)
+        while chunk:
+            h.update(chunk)
+            size += len(chunk)
+            chunk = f.read(self.chunk_size)
+        f.seek(0)
+        return h.hexdigest(), size
+
+    def store_blob(self, f, key, codec=None):
+        ''' This function use to store a file as a content addressed blob (dedup
+        mode). The version key is added to the blob's references first, so
+        release_blob of another version keeps the blob from then on. The blob is
+        only written to hdfs if it is not there yet, to a temporary name which is
+        renamed to the blob's name, so uploads of the same content at once never
+        write to the same hdfs file.
+        :param : f - opened file object
+        :param : key - row key of the version which references the blob
+        :param : codec - compress a file with this codec (default: None)
+        :return: (file's stored content or None, blob's hdfs path, blob's name -
+                 digest, with .[codec] if it is compressed) as a tuple.
+        '''
+        digest, size = self.hash_file(f)
+        if codec:
+            digest = '.'.join([digest, codec])
+        path = ''.join([self.hdfs_path,'blobs/',digest])
+        if self.blob_table.insert(digest, {'ref': {key: '1'}}) != 200:
+            raise IOError("cannot add a blob reference: %s" % key)
+        if self.hdfs_status(path) is None:
+            temp = ''.join([path,'.',uuid.uuid4().hex,'.tmp'])
+            file_content = self.store_file(f, temp, overwrite=True, codec=codec)
+            if not self.hdfs.rename_file_dir(temp, path).get('boolean'):
+                # Another upload of the same content renamed its copy first.
+                self.hdfs.delete_file_dir(temp)
+        else:
+            file_content = None
+            if size <= self.inline_limit:
+                file_content = f.read()
+                if codec:
+                    file_content = ''.join(self.compress_chunks([file_content], codec))
+        return file_content, path, digest
+
+    def release_blob(self, digest, key):
+        ''' This function use to remove a version's reference from a blob, and
+        delete the blob from hdfs when its last reference is gone (dedup mode).
+        The blob is renamed before it is deleted, so store_blob does not reuse it
+        from then on, and it is renamed back if a reference is added meanwhile.
+        :param : digest - blob's name (See store_blob)
+        :param : key - row key of the version which references the blob
+        :return: True if success otherwise False.
+        '''
+        if self.blob_table.remove(digest, 'ref', key) != 200:
+            if self.debug:
+                print "[HBASE] cannot remove a blob reference:",key
+            return False
+        if self.fetch(self.blob_table, digest) is not None:
+            return True
+        path = ''.join([self.hdfs_path,'blobs/',digest])
+        fenced = ''.join([path,'.',uuid.uuid4().hex,'.deleting'])
+        if not self.hdfs.rename_file_dir(path, fenced).get('boolean'):
+            # It is removed already.
+            return True
+        if self.fetch(self.blob_table, digest) is not None:
+            if not self.hdfs.rename_file_dir(fenced, path).get('boolean'):
+                # store_blob wrote it again meanwhile.
+                self.hdfs.delete_file_dir(fenced)
+            return True
+        if not self.hdfs.delete_file_dir(fenced):
+            if self.debug:
+                print "[HDFS] Cannot remove a file path:",fenced
+            return False
+        return True
+
+    def store_content(self, f, key, path, codec=None, overwrite=False):
+        ''' This function use to store a version's content on hdfs, as a blob in
+        dedup mode, packed into a container if it is not larger than pack_limit,
+        otherwise as its own file.
+        :param : f - opened file object
+        :param : key - row key of the version
+        :param : path - hdfs path of the version's own file
+        :param : codec - compress a file with this codec (default: None)
+        :param : overwrite - overwrite an existing hdfs file (default: False)
+        :return: (stored content or None, hdfs path, blob's name or None,
+                 (container's name, offset, length) or None, manifest of parts
+                 or None) as a tuple.
+        '''
+        self.check_writable()
+        storage = self.storage(os.fstat(f.fileno()).st_size)
+        if storage == 'blob':
+            file_content, path, digest = self.store_blob(f, key, codec)
+            return file_content, path, digest, None, None
+        if storage == 'pack':
+            data = f.read()
+            if codec:
+                data = ''.join(self.compress_chunks([data], codec))
+            name, offset = self.pack_data(data, key)
+            file_content = data if len(data) <= self.inline_limit else None
+            return file_content, self.pack_path(name), None, (name, offset, len(data)), None
+        if storage == 'parts':
+            return None, path, None, None, self.store_parts(f, path, codec)
+        return self.store_file(f, path, overwrite, codec), path, None, None, None
+
+    def storage(self, size):
+        ''' This function return how a file of size is stored (See store_content),
+        'blob', 'pack', 'parts' or 'file'.
+        '''
+        if self.dedup:
+            return 'blob'
+        if self.pack_limit and size <= self.pack_limit:
+            return 'pack'
+        if self.split_limit and size > self.split_limit:
+            return 'parts'
+        return 'file'
+
+    def pack_path(self, name):
+        ''' This function return hdfs path of a container (See pack_data).
+        '''
+        return ''.join([self.hdfs_path,'packs/',name])
+
+    def pack_data(self, data, key):
+        ''' This function use to append a small file to the container this DMS
+        writes to, so many small files share one hdfs file (and one namenode
+        object). Each DMS has its own container, the only writer of it, and
+        starts a new one when it reaches pack_size. Live entries of a container
+        are kept in [table]_pack as row key -> 'offset,length', with its size and
+        time of the last change (info:size, info:modified).
+        :param : data - file's stored content
+        :param : key - row key of the version
+        :return: (container's name, offset) as a tuple.
+        '''
+        with self.packer['lock']:
+            for attempt in range(2):
+                name, offset = self.packer['name'], self.packer['offset']
+                if name is None or (offset and offset + len(data) > self.pack_size):
+                    name, offset = uuid.uuid4().hex, 0
+                try:
+                    if not offset:
+                        self.hdfs.create_file(self.pack_path(name), data)
+                    elif data:
+                        self.hdfs.append_file(self.pack_path(name), data)
+                except Exception:
+                    # A failed append may leave a partial tail, continue in a new
+                    # container.
+                    self.packer['name'] = None
+                    if attempt:
+                        raise
+                    continue
+                self.packer['name'] = name
+                self.packer['offset'] = offset + len(data)
+                break
+            row = {'entry': {key: ','.join([str(offset), str(len(data))])},
+                   'info': {'size': offset + len(data), 'modified': int(time.time() * 1000)}}
+            status = self.pack_table.insert(name, row)
+        if status != 200:
+            raise IOError("cannot add a container entry: %s" % key)
+        return name, offset
+
+    def release_pack(self, name, key):
+        ''' This function use to remove a version's entry from its container. Its
+        bytes stay on hdfs until compact_packs.
+        :param : name - container's name
+        :param : key - row key of the version
+        :return: True if success otherwise False.
+        '''
+        if self.pack_table.remove(name, 'entry', key) != 200:
+            if self.debug:
+                print "[HBASE] cannot remove a container entry:",key
+            return False
+        return True
+
+    def compact_packs(self, min_live=0.5, min_age=600):
+        ''' This function use to reclaim space of deleted small files. Live entries
+        of a container with less than min_live of its bytes in use are copied to
+        the container of this DMS, their rows are pointed to the new place and
+        their entries are released. Containers which were changed in the last
+        min_age seconds are skipped because another DMS may still write to them.
+        The clock of a writer is not trusted for that: the container is renamed
+        before it is deleted, so no one can append to it, and it is kept (renamed
+        back) if its length or its info:size changed since it was scanned or it
+        has entries of versions which are not stored yet.
+        :param : min_live - compact containers with a smaller live ratio (default: 0.5)
+        :param : min_age - seconds since a container is last changed (default: 600)
+        :return: summary as a dict (containers - number of deleted containers,
+                 moved - number of moved files, reclaimed - number of freed bytes).
+        '''
+        summary = {'containers': 0, 'moved': 0, 'reclaimed': 0}
+        now = time.time() * 1000
+        for name, row in list(self.scan(table=self.pack_table)):
+            info = row.get('info', dict())
+            if name == self.packer['name'] or 'size' not in info:
+                continue
+            if now - int(info.get('modified', 0)) < min_age * 1000:
+                continue
+            size = int(info['size'])
+            path = self.pack_path(name)
+            entries = dict((key, map(int, entry.split(','))) for key, entry in
+                           row.get('entry', dict()).items())
+            live = sum([length for offset, length in entries.values()])
+            if size and float(live) / size >= min_live:
+                continue
+            pending = False
+            for key, (offset, length) in entries.items():
+                current = self.fetch(self.hbase_table, key, ['meta_data:pack'])
+                if not current:
+                    # The entry is added before the version's row, it may be
+                    # written right now.
+                    pending = True
+                    continue
+                if current['meta_data'].get('pack') == name:
+                    data = ''.join(self.read_chunks(path, offset, length))
+                    new_name, new_offset = self.pack_data(data, key)
+                    row = {'file': {'path': self.pack_path(new_name)},
+                           'meta_data': {'pack': new_name, 'pack_offset': new_offset}}
+                    if not self.insert_row(key, row):
+                        raise IOError("cannot move a packed file: %s" % key)
+                    parsed = self.parse_row_key(key)
+                    self.invalidate(parsed[0] if parsed else None, key)
+                    summary['moved'] += 1
+                self.release_pack(name, key)
+            if pending or not self.remove_pack(name, size):
+                continue
+            summary['containers'] += 1
+            summary['reclaimed'] += size - live
+        if self.debug:
+            print "[Compacted]", summary
+        return summary
+
+    def remove_pack(self, name, size):
+        ''' This function use to delete a container whose entries are moved (See
+        compact_packs). It is renamed first, an append to it fails from then on,
+        and it is renamed back if a writer changed it after it was scanned.
+        :param : name - container's name
+        :param : size - info:size of the container when it was scanned
+        :return: True if it is deleted otherwise False.
+        '''
+        path = self.pack_path(name)
+        fenced = ''.join([path,'.compacting'])
+        if not self.hdfs.rename_file_dir(path, fenced).get('boolean'):
+            return False
+        length = self.hdfs.get_file_dir_status(fenced)['FileStatus']['length']
+        row = self.fetch(self.pack_table, name) or dict()
+        if (length != size or int(row.get('info', dict()).get('size', -1)) != size or
+                row.get('entry')):
+            if self.debug:
+                print "[HBASE] a container is changed while it is compacted:",name
+            self.hdfs.rename_file_dir(fenced, path)
+            return False
+        if self.pack_table.remove(name) != 200 or not self.hdfs.delete_file_dir(fenced):
+            if self.debug:
+                print "[HDFS] cannot remove a container:",name
+            return False
+        return True
+
+    def split_pieces(self, data):
+        ''' This function split data into pieces which end at line breaks (long
+        lines are cut every 4 KB), so an edit only changes pieces around it.
+        '''
+        for line in data.splitlines(True):
+            for i in range(0, len(line), 4096):
+                yield line[i:i + 4096]
+
+    def make_delta(self, base, data):
+        ''' This function use to encode data as copies of ranges of base and
+        inserted bytes. Pieces of data (See split_pieces) are looked up in base,
+        a copy is extended as long as data follows base.
+        :param : base - content of the version before
+        :param : data - new content
+        :return: delta as a zlib compressed string (See apply_delta).
+        '''
+        offsets = dict()
+        position = 0
+        for piece in self.split_pieces(base):
+            offsets.setdefault(piece, position)
+            position += len(piece)
+        ops = list()
+        for piece in self.split_pieces(data):
+            last = ops[-1] if ops else None
+            if last and last[0] == 'copy':
+                end = last[1] + last[2]
+                if base[end:end + len(piece)] == piece:
+                    last[2] += len(piece)
+                    continue
+            offset = offsets.get(piece)
+            # A copy costs 17 bytes, short pieces are cheaper to insert.
+            if offset is not None and len(piece) > 16:
+                ops.append(['copy', offset, len(piece)])
+            elif last and last[0] == 'insert':
+                last[1].append(piece)
+            else:
+                ops.append(['insert', [piece]])
+        out = list()
+        for op in ops:
+            if op[0] == 'copy':
+                out.append(struct.pack('>BQQ', 0, op[1], op[2]))
+            else:
+                piece = ''.join(op[1])
+                out.append(struct.pack('>BQ', 1, len(piece)))
+                out.append(piece)
+        return zlib.compress(''.join(out))
+
+    def apply_delta(self, base, delta):
+        ''' This function use to rebuild content from base and a delta (See
+        make_delta).
+        :param : base - content of the version before
+        :param : delta - delta
+        :return: content.
+        '''
+        data = zlib.decompress(delta)
+        out = list()
+        i = 0
+        while i < len(data):
+            if data[i] == '\x00':
+                offset, length = struct.unpack_from('>QQ', data, i + 1)
+                out.append(base[offset:offset + length])
+                i += 17
+            else:
+                length, = struct.unpack_from('>Q', data, i + 1)
+                out.append(data[i + 9:i + 9 + length])
+                i += 9 + length
+        return ''.join(out)
+
+    def encode_version(self, file, version, f, size, base=None):
+        ''' This function is the delta policy (delta mode). A version is stored as
+        a delta of the version before it if it is not larger than delta_limit,
+        the chain since the last full copy is shorter than delta_chain and the
+        delta is not larger than inline_limit and half of the file.
+        :param : file - file's name
+        :param : version - file's version
+        :param : f - opened file object, it is rewound
+        :param : size - file's size
+        :param : base - version before it if it is known (default: None)
+        :return: (delta, base version, chain length, content) as a tuple, None to
+                 store a full copy.
+        '''
+        if not self.delta or size > self.delta_limit:
+            return None
+        if base is None:
+            older = [int(v) for v in self.get_file_version(file)['version'] if int(v) < version]
+            if not older:
+                return None
+            base = older[-1]
+        row = self.fetch_row(self.row_key(file, base))
+        if not row:
+            return None
+        depth = int(row['meta_data'].get('delta_depth', 0)) + 1
+        if depth >= self.delta_chain:
+            return None
+        content = f.read()
+        f.seek(0)
+        delta = self.make_delta(self.version_content(file, base, row), content)
+        if len(delta) > self.inline_limit or len(delta) * 2 > size:
+            return None
+        return delta, base, depth, content
+
+    def version_content(self, file, version, row=None):
+        ''' This function return whole content of a version. A delta is applied to
+        the content of its base, back to the last full copy.
+        :param : file - file's name
+        :param : version - file's version
+        :param : row - version's row if it is already fetched (default: None)
+        :return: content as a string. Raise IOError if a version is not exists.
+        '''
+        if row is None:
+            row = self.fetch_row(self.row_key(file, version))
+        deltas = list()
+        while row and 'delta_base' in row['meta_data']:
+            deltas.append(row['file']['delta'])
+            version = int(row['meta_data']['delta_base'])
+            row = self.fetch_row(self.row_key(file, version))
+        if not row:
+            raise IOError("%s is not exists." % self.row_key(file, version))
+        content = row['file'].get('content')
+        codec = row['meta_data'].get('codec')
+        if content is None:
+            path = row['file'].get('path') or self.get_file_path(file, version)
+            manifest = row['file'].get('manifest')
+            if manifest:
+                manifest = simplejson.loads(manifest)
+            content = ''.join(self.read_content(path, codec, span=self.pack_span(row['meta_data']),
+                                                manifest=manifest))
+        elif codec:
+            content = ''.join(self.decompress_chunks([content], codec))
+        for delta in reversed(deltas):
+            content = self.apply_delta(content, delta)
+        return content
+
+    def delta_content(self, file, version, row=None):
+        ''' This function return whole content of a version if it is stored as a
+        delta. It is decided by the version's row, not by the delta mode of this
+        DMS.
+        :param : file - file's name
+        :param : version - file's version
+        :param : row - version's row if it is already fetched (See location_row)
+                 (default: None)
+        :return: content as a string, None if it is not a delta.
+        '''
+        if row is None:
+            row = self.location_row(file, version)
+        if not row or 'delta_base' not in row.get('meta_data', dict()):
+            return None
+        return self.version_content(file, version, row)
+
+    def location_row(self, file, version):
+        ''' This function use to fetch the columns of a version's row which tell
+        how it is stored (See delta_content and get_file_location).
+        :param : file - file's name
+        :param : version - file's version
+        :return: row as a dict, None if it is not exists.
+        '''
+        key = self.row_key(file, version)
+        if self.cache is not None:
+            return self.fetch_row(key)
+        return self.fetch(self.hbase_table, key, {
+            'file': ['path', 'manifest', 'delta'],
+            'meta_data': ['codec', 'pack_offset', 'length', 'stored_length',
+                          'delta_base']})
 
-    def hbase_connection(self, host, port, table='dms'):
-        ''' This function use to establish a connection to hbase, for preparing to
-        insert, remove, fetch data from hbase. We use starbase for connect to hbase
-        via rest api.(See more: https://github.com/barseghyanartur/starbase)
-        :param : host - hbase rest host
-        :param : port - hbase rest running port
-        :param : table - DMS table on hbase (default: 'dms')
+    def detach_version(self, file, version):
+        ''' This function use to store the version after version as a full copy if
+        it is a delta of version, before version is changed or removed.
+        :param : file - file's name
+        :param : version - file's version
         :return: Nothing.
         '''
-        self.hbase = hbaseConnection(host=host, port=port)
-        t = self.hbase.table(table)
-        if (not t.exists()):
-            t.create('meta_data','file')
-        self.hbase_table = t
+        newer = [int(v) for v in self.get_file_version(file)['version'] if int(v) > version]
+        if not newer:
+            return
+        key = self.row_key(file, newer[0])
+        row = self.fetch_row(key)
+        if not row or row['meta_data'].get('delta_base') != str(version):
+            return
+        content = self.version_content(file, newer[0], row)
+        f = tempfile.NamedTemporaryFile()
+        try:
+            f.write(content)
+            f.flush()
+            f.seek(0)
+            codec = self.choose_codec(file, len(content))
+            path = ''.join([self.hdfs_path,self.version_name(file, newer[0])])
+            file_content, path, digest, pack, manifest = self.store_content(
+                f, key, path, codec, True)
+        finally:
+            f.close()
+        row = {'file': {'path': path}, 'meta_data': dict()}
+        if file_content is not None:
+            row['file']['content'] = file_content
+        if not pack and not manifest:
+            row['meta_data']['length'] = self.hdfs.get_file_dir_status(path)['FileStatus']['length']
+        self.set_storage_meta(row, digest, codec, len(content), pack, manifest, None)
+        if not self.insert_row(key, row):
+            raise IOError("cannot store a full copy: %s" % key)
+        self.hbase_table.remove(key, 'file', 'delta')
+        self.hbase_table.remove(key, 'meta_data', 'delta_base')
+        self.hbase_table.remove(key, 'meta_data', 'delta_depth')
+        self.invalidate(file, key)
 
-    def hdfs_connection(self, host, port, user_name, hdfs_path='/tmp/'):
-        ''' This function use to establish a connection to hdfs, for preparing to
-        create, retrieve, update, delete file in hdfs. We use pywebhdfs in order to
-        do this task via hdfs rest api.(See more: http://pythonhosted.org/pywebhdfs/)
-        :param : host - hdfs rest host
-        :param : port - hdfs rest running port
-        :param : user_name - hdfs username (for authentication)
-        :param : hdfs_path - location to store files. (default: '/tmp/')
-        :return: Nothing.
+    def get_file_path(self, file, version):
+        ''' This function use to find where a version is stored on hdfs, the path in
+        its row or [hdfs_path]v[version].[file].
+        :param : file - file's name
+        :param : version - file's version
+        :return: hdfs path.
         '''
-        self.hdfs = PyWebHdfsClient(host=host, port=port, user_name=user_name)
-        self.hdfs_path = hdfs_path
+        return self.get_file_location(file, version)[0]
 
-    def solr_connection(self, host, port, collection):
-        ''' This function use to establish a connection to solr, for query or
-        search any text on a system.
-        :param : host - solr's host
-        :param : port - solr's running port
-        :param : collection - solr's collection for searching
+    def get_file_location(self, file, version, row=None):
+        ''' This function use to find where a version is stored on hdfs, its codec
+        and where it is in its container if it is packed. They are read from the
+        version's row, whatever options this DMS has, because another DMS may
+        have stored it.
+        :param : file - file's name
+        :param : version - file's version
+        :param : row - version's row if it is already fetched (See location_row)
+                 (default: None)
+        :return: (hdfs path, codec or None, (offset, length) or None, manifest of
+                 parts or None) as a tuple.
         '''
-        self.solr = ''.join(['http://',host,':',port,'/solr/',collection])
+        path = ''.join([self.hdfs_path,self.version_name(file, version)])
+        if row is None:
+            row = self.location_row(file, version)
+        if row:
+            meta_data = row.get('meta_data', dict())
+            file_data = row.get('file', dict())
+            manifest = None
+            if 'manifest' in file_data:
+                manifest = simplejson.loads(file_data['manifest'])
+            return (file_data.get('path', path), meta_data.get('codec'),
+                    self.pack_span(meta_data), manifest)
+        return path, None, None, None
 
-    def extract(self, file):
-        ''' This function use to extract meta data from a file. We use hachoir3 library
-        to extract them. (See more: http://hachoir3.readthedocs.org)
-        :param : file - file for extract
-        :return: meta data as dict for success, 0 if fail.
-        '''
-    	try:
-    		filename, realname = unicodeFilename(file), file
-    		parser = createParser(filename, realname)
-    		meta_data = extractMetadata(parser)
-    		meta_data_text = meta_data.exportPlaintext()
-    		meta_list = dict()
-    		for i in range(1,len(meta_data_text)):
-    			meta_split = meta_data_text[i].split(":")
-    			column = meta_split[0].replace('- ','')
-    			value = meta_split[1].lstrip()
-    			meta_list.update({column:value})
-    		return meta_list
-    	except:
-            if self.debug:
-        		print "Something went wrong, meta data of",file,"could not extract."
+    def pack_span(self, meta_data):
+        ''' This function return (offset, length) of a packed version in its
+        container, None if it is not packed.
+        '''
+        if 'pack_offset' not in meta_data:
             return None
-
+        # Rows stored before stored_length keep it in length.
+        return (int(meta_data['pack_offset']),
+                int(meta_data.get('stored_length', meta_data['length'])))
 
     def upload(self, file):
         ''' This function use to uplaod a file to hdfs and store meta data on hbase
         Meta data consist of 2 main parts: file's meta data and hdfs's file's meta data.
         This function will increase a file version if it is already store in hbase.
+        With spool_dir it returns when the file is spooled.
         :param : file - file's name
         :return: True if success otherwise False.
         '''
-        version = 1
-        key = ''.join(['v',str(version),'.',file])
-        path = ''.join([self.hdfs_path,key])
+        return self.put_file(file)['status'] == 'ok'
+
+    @timed('upload')
+    def put_file(self, file, version=None, source=None):
+        ''' This function upload a file like upload, but return a report of it.
+        :param : file - file's name
+        :param : version - version to store (or overwrite) instead of a new one, to
+                 store a spooled file (See drain) (default: None)
+        :param : source - file to read instead of file, to store a spooled file
+                 (default: None)
+        :return: report as a dict (file, version, status - 'ok' or 'failed', error).
+                 Version of a spooled file is None, it is numbered when it is stored.
+        '''
+        report = {'file': file, 'version': None, 'status': 'failed', 'error': None}
+        if self.spool is not None and source is None:
+            try:
+                self.spool.add('upload', file, None, file)
+            except (IOError, OSError) as e:
+                print "Cannot spool file:",file
+                report['error'] = str(e)
+                return report
+            if self.debug:
+                print "[Spooled]", file
+            report['status'] = 'ok'
+            return report
+        replay = version is not None
 
-        # Read a file
+        # Open a file
         try:
-            f = open(file,'r')
-            file_content = f.read()
-            f.close()
-        except:
+            f = open(source or file,'rb')
+        except Exception as e:
             print "Cannot read file:",file
-
-        # Check file's version
-        while self.hbase_table.fetch(key) != None:
-            version = int(self.get_lastest_version(file)) + 1
-            key = ''.join(['v',str(version),'.',file])
-            path = ''.join([self.hdfs_path,key])
+            report['error'] = str(e)
+            return report
 
         # Try to upload file.
         try:
-            self.hdfs.create_file(path,file_content)
-            hdfs_meta = self.hdfs.get_file_dir_status(path)['FileStatus']
-            file_meta = self.extract(file)
-            t = self.hbase_table
-            status = t.insert(
-                key,
-                {
-                    'file': {'content': file_content}
-                }
-            )
-            if status != 200:
-                if self.debug:
-                    print "Error inserting: file content"
-            # save hbase meta data
-            for i in range(0,len(file_meta.keys())):
-                status = t.insert(
-                    key,
-                    {
-                        'meta_data': {file_meta.keys()[i]: file_meta[file_meta.keys()[i]]}
-                    }
-                )
-                if status != 200:
-                    if self.debug:
-                        print "Error inserting:", file_meta.keys()[i]
-            # save hdfs meta data
-            for i in range(0,len(hdfs_meta.keys())):
-                status = t.insert(
-                    key,
-                    {
-                        'meta_data': {hdfs_meta.keys()[i]: hdfs_meta[hdfs_meta.keys()[i]]}
-                    }
-                )
-                if status != 200:
-                    if self.debug:
-                        print "Error inserting:", hdfs_meta.keys()[i]
-            # save version
-            status = t.insert(
-                key,
-                {
-                    'meta_data': {'version': version}
-                }
-            )
-            if status != 200:
-                if self.debug:
-                    print "Error inserting: version"
-        except:
+            try:
+                # Check file's version
+                if replay:
+                    lastest_version = version - 1
+                else:
+                    version = 1
+                    lastest_version = self.get_lastest_version(file)
+                    if lastest_version:
+                        version = lastest_version + 1
+                key = self.row_key(file, version)
+                path = ''.join([self.hdfs_path,self.version_name(file, version)])
+                size = os.fstat(f.fileno()).st_size
+                codec = file_content = digest = pack = manifest = None
+                delta = None
+                if lastest_version:
+                    delta = self.encode_version(file, version, f, size, lastest_version)
+                if delta:
+                    path = None
+                else:
+                    codec = self.choose_codec(file, size)
+                    file_content, path, digest, pack, manifest = self.store_content(
+                        f, key, path, codec, replay)
+            finally:
+                f.close()
+            if delta:
+                hdfs_meta = {'length': len(delta[0]), 'modificationTime': int(time.time() * 1000)}
+            else:
+                hdfs_meta = self.hdfs.get_file_dir_status(path)['FileStatus']
+            file_meta = self.extract(source or file, digest)
+            row = self.build_row(file, file_content, file_meta, hdfs_meta, version, path)
+            self.set_storage_meta(row, digest, codec, size, pack, manifest, delta)
+            if not self.insert_row(key, row):
+                raise IOError("cannot insert a row: %s" % key)
+            if replay:
+                self.invalidate(file, key)
+            self.index_version(file, version)
+            self.index_meta(key, row['meta_data'])
+            if self.indexer is not None:
+                content = delta[3] if delta and size <= self.inline_limit else None
+                self.indexer.add(self.build_document(key, row, content))
+        except Exception as e:
             if self.debug:
                 print "Upload failed."
-            return False
+            report['error'] = str(e) or e.__class__.__name__
+            return report
         if self.debug:
             print "[Uploaded]", file, "version:", version
+        report['version'] = version
+        report['status'] = 'ok'
+        return report
+
+    def set_storage_meta(self, row, digest, codec, size, pack, manifest, delta=None):
+        ''' This function use to record how a version is stored in its row (See
+        store_content). length is file's size, stored_length is the size of what
+        is stored (compressed, a delta or an entry of a container), it replaces
+        the length of hdfs's FileStatus in the row.
+        :param : row - row as a dict (See build_row)
+        :param : digest - blob's name or None
+        :param : codec - codec or None
+        :param : size - file's size before compression
+        :param : pack - (container's name, offset, length) or None
+        :param : manifest - manifest of parts or None
+        :param : delta - (delta, base version, chain length, content) or None
+        :return: Nothing.
+        '''
+        meta_data = row['meta_data']
+        stored = meta_data.get('length')
+        if digest:
+            meta_data['hash'] = digest
+        if codec:
+            meta_data['codec'] = codec
+        if pack:
+            meta_data['pack'], meta_data['pack_offset'], stored = pack
+        if manifest:
+            row['file']['manifest'] = simplejson.dumps(manifest)
+            meta_data['parts'] = len(manifest['parts'])
+            stored = sum([part[1] for part in manifest['parts']])
+        if delta:
+            row['file']['delta'] = delta[0]
+            meta_data['delta_base'], meta_data['delta_depth'] = delta[1:3]
+            stored = len(delta[0])
+        meta_data['length'] = size
+        if stored is not None:
+            meta_data['stored_length'] = stored
+
+    def drain(self, entry):
+        ''' This function use to store a spooled upload or update on hdfs and hbase
+        (See Spool). Its version is numbered when it is first drained and kept in
+        the spool, so a replayed entry stores the same version again.
+        :param : entry - spool entry
+        :return: True if success, False if it can never be stored (an update of a
+                 file which is not exists). Raise IOError to retry it.
+        '''
+        file, version = entry['file'], entry['version']
+        if version is None:
+            lastest_version = self.get_lastest_version(file, False)
+            if entry['op'] == 'upload':
+                version = (lastest_version or 0) + 1
+            elif lastest_version is None:
+                if self.debug:
+                    print "Cannot update.",file,"is not exists."
+                return False
+            else:
+                version = lastest_version
+            self.spool.set_version(entry, version)
+        exists = self.fetch(self.hbase_table, self.row_key(file, version),
+                            ['meta_data:version']) is not None
+        if entry['op'] == 'update' and not exists:
+            if self.debug:
+                print "Cannot update.",self.row_key(file, version),"is not exists."
+            return False
+        if exists:
+            if not self.update(file, version, entry['content']):
+                raise IOError("cannot update %s" % self.row_key(file, version))
+        else:
+            report = self.put_file(file, version, entry['content'])
+            if report['status'] != 'ok':
+                raise IOError(report['error'])
         return True
 
+    def spooled_versions(self, file, stored=None):
+        ''' This function return versions of a file which are spooled and not
+        stored yet (See spool_dir), the last upload or update of a version wins.
+        :param : file - file's name
+        :param : stored - file's stored versions (See get_file_version), None to
+                 read them
+        :return: dict of version -> spool entry.
+        '''
+        versions = dict()
+        if self.spool is None:
+            return versions
+        entries, assigned = self.spool.pending(file)
+        if not entries:
+            return versions
+        if stored is None:
+            stored = self.get_file_version(file, False)['version']
+        lastest_version = max([int(version) for version in stored] + [assigned or 0])
+        for entry in entries:
+            version = entry['version']
+            if version is None:
+                version = lastest_version + (entry['op'] == 'upload')
+            lastest_version = max(lastest_version, version)
+            if version:
+                versions[version] = entry
+        return versions
+
+    def open_spooled(self, file, version):
+        ''' This function use to open content of a version which is spooled and
+        not stored yet.
+        :param : file - file's name
+        :param : version - file's version
+        :return: file object, None if the version is not spooled.
+        '''
+        if self.spool is None or not version:
+            return None
+        entry = self.spooled_versions(file).get(int(version))
+        if entry is None:
+            return None
+        try:
+            return open(entry['content'], 'rb')
+        except IOError:
+            # It is stored and removed from the spool meanwhile.
+            return None
+
+    @timed('upload_many')
+    def upload_many(self, files, workers=4, hbase_workers=None, hdfs_workers=None):
+        ''' This function use to upload many files concurrently with a bounded pool
+        of worker threads. Versions of the same file are uploaded one by one.
+        :param : files - list of file's names
+        :param : workers - number of worker threads (default: 4)
+        :param : hbase_workers - maximum concurrent hbase requests (default: workers)
+        :param : hdfs_workers - maximum concurrent hdfs requests (default: workers)
+        :return: list of reports (See put_file) in the same order as files.
+        '''
+        # Every worker uses a copy of this DMS whose backends are throttled.
+        hbase_slots = threading.BoundedSemaphore(hbase_workers or workers)
+        hdfs_slots = threading.BoundedSemaphore(hdfs_workers or workers)
+        worker_dms = copy.copy(self)
+        worker_dms.hdfs = Throttle(self.hdfs, hdfs_slots)
+        worker_dms.hbase_table = Throttle(self.hbase_table, hbase_slots)
+        worker_dms.version_table = Throttle(self.version_table, hbase_slots)
+        worker_dms.blob_table = Throttle(self.blob_table, hbase_slots)
+        if self.meta_index:
+            worker_dms.meta_table = Throttle(self.meta_table, hbase_slots)
+        worker_dms.pack_table = Throttle(self.pack_table, hbase_slots)
+
+        file_locks = dict((file, threading.Lock()) for file in files)
+        def put_file(file):
+            with file_locks[file]:
+                return worker_dms.put_file(file)
+
+        pool = WorkerPool(max(1, min(workers, len(files))))
+        try:
+            futures = [pool.submit(put_file, file) for file in files]
+            reports = list()
+            for file, future in zip(files, futures):
+                try:
+                    reports.append(future.result())
+                except Exception as e:
+                    reports.append({'file': file, 'version': None,
+                                    'status': 'failed', 'error': str(e)})
+        finally:
+            pool.close()
+        return reports
+
+    @timed('download')
     def download(self, file, version=None, download_dir=''):
         ''' This function use to retrieve or download file from hdfs. Then save
         it as a new file named (v[version].[file] - For example, v1.mytext.txt).
@@ -184,90 +3022,247 @@ class DMS:
         '''
         if not version:
             version = self.get_lastest_version(file)
-        key = ''.join(['v',str(version),'.',file])
-        path = ''.join([self.hdfs_path,key])
-        downloaded_file = ''.join([download_dir,key])
+            if version is None:
+                if self.debug:
+                    print file,"is not exists."
+                return False
+        name = self.version_name(file, version)
+        downloaded_file = target = ''.join([download_dir,name])
         try:
-            f = open(downloaded_file, 'w')
-            f.write(self.hdfs.read_file(path))
-            f.close()
+            content = cache_key = None
+            spooled = self.open_spooled(file, version)
+            if spooled is None and self.download_cache is not None:
+                cache_key = self.download_cache_key(file, version)
+                if cache_key and self.download_cache.get(cache_key, downloaded_file):
+                    if self.debug:
+                        print "[Downloaded]",name,"(cached)"
+                    return True
+                if cache_key:
+                    target = self.download_cache.temp_file()
+            if spooled is None:
+                row = self.location_row(file, version)
+                content = self.delta_content(file, version, row)
+            if spooled is None and content is None:
+                path, codec, span, manifest = self.get_file_location(file, version, row)
+            if spooled is not None:
+                try:
+                    f = open(target, 'wb')
+                    try:
+                        for chunk in iter(functools.partial(spooled.read, self.chunk_size), ''):
+                            f.write(chunk)
+                    finally:
+                        f.close()
+                finally:
+                    spooled.close()
+            elif content is not None:
+                f = open(target, 'wb')
+                try:
+                    f.write(content)
+                finally:
+                    f.close()
+            elif manifest:
+                self.download_parts(path, manifest, codec, target)
+            else:
+                f = open(target, 'wb')
+                try:
+                    for chunk in self.read_content(path, codec, span=span):
+                        f.write(chunk)
+                finally:
+                    f.close()
+            if cache_key:
+                self.download_cache.put(cache_key, target, downloaded_file)
         except:
+            if target != downloaded_file and os.path.exists(target):
+                os.remove(target)
             if self.debug:
                 print "Cannot download a file:", file
             return False
         if self.debug:
-            print "[Downloaded]",key
+            print "[Downloaded]",name
         return True
 
-    def update(self, file, version=None):
+    def download_cache_key(self, file, version):
+        ''' This function return a key of a version in download_cache: its table,
+        row key, modificationTime and length, which change when it is updated.
+        :param : file - file's name
+        :param : version - file's version
+        :return: key as a string, None if the version is not exists.
+        '''
+        key = self.row_key(file, version)
+        if self.cache is not None:
+            row = self.fetch_row(key)
+        else:
+            row = self.fetch(self.hbase_table, key, ['meta_data:modificationTime',
+                                                     'meta_data:length'])
+        if not row or 'modificationTime' not in row.get('meta_data', dict()):
+            return None
+        meta_data = row['meta_data']
+        return '/'.join([self.hbase_table.name, key, str(meta_data['modificationTime']),
+                         str(meta_data.get('length'))])
+
+    def read_chunks(self, path, offset=0, length=None):
+        ''' This function use to read a file on hdfs chunk by chunk with ranged
+        requests (offset and length), so memory use does not depend on file size.
+        :param : path - hdfs path
+        :param : offset - first byte to read (default: 0)
+        :param : length - number of bytes to read (default: None, to the end)
+        :return: generator of file's chunks.
+        '''
+        while length is None or length > 0:
+            size = self.chunk_size
+            if length is not None:
+                size = min(size, length)
+            chunk = self.hdfs.read_file(path, offset=offset, length=size)
+            if chunk:
+                yield chunk
+            if len(chunk) < size:
+                break
+            offset += len(chunk)
+            if length is not None:
+                length -= len(chunk)
+
+    @timed('get_file_range')
+    def get_file_range(self, file, version=None, offset=0, length=None):
+        ''' This function use to read only a part of a file from hdfs, for example
+        a header of a document for preview. You can specify a file's version.
+        :param : file - file's name
+        :param : version - file's version
+        :param : offset - first byte to read (default: 0)
+        :param : length - number of bytes to read (default: None, to the end)
+        :return: file's bytes as a string for success, False if fail.
+        '''
+        if not version:
+            version = self.get_lastest_version(file)
+            if version is None:
+                if self.debug:
+                    print file,"is not exists."
+                return False
+        try:
+            spooled = self.open_spooled(file, version)
+            if spooled is not None:
+                try:
+                    spooled.seek(offset)
+                    return spooled.read(-1 if length is None else length)
+                finally:
+                    spooled.close()
+            row = self.location_row(file, version)
+            content = self.delta_content(file, version, row)
+            if content is not None:
+                return content[offset:None if length is None else offset + length]
+            path, codec, span, manifest = self.get_file_location(file, version, row)
+            return ''.join(self.read_content(path, codec, offset, length, span, manifest))
+        except:
+            if self.debug:
+                print "Cannot read a file:", self.version_name(file, version)
+            return False
+
+    @timed('update')
+    def update(self, file, version=None, source=None):
         ''' This function use to update file to hdfs and data stored in hbase by
         overwrite that file on hdfs, and also insert new data to hbase too. You can
-        specify a file's version in order to update it.
+        specify a file's version in order to update it. With spool_dir it returns
+        when the file is spooled.
         :param : file - file's name
         :param : version - file's version
+        :param : source - file to read instead of file, to store a spooled file
+                 (default: None)
         :return: True if success otherwise False.
         '''
+        if self.spool is not None and source is None:
+            try:
+                self.spool.add('update', file, version or None, file)
+            except (IOError, OSError):
+                print "Cannot spool file:",file
+                return False
+            if self.debug:
+                print "[Spooled]", file
+            return True
         if not version:
             version = self.get_lastest_version(file)
-        key = ''.join(['v',str(version),'.',file])
-        path = ''.join([self.hdfs_path,key])
+            if version is None:
+                if self.debug:
+                    print file,"is not exists."
+                return False
+        key = self.row_key(file, version)
+        path = ''.join([self.hdfs_path,self.version_name(file, version)])
 
-        # Read a file
+        # Open a file
         try:
-            f = open(file,'r')
-            file_content = f.read()
-            f.close()
+            f = open(source or file,'rb')
         except:
             print "Cannot read file:",file
+            return False
 
         # Try to upload file.
         try:
-            self.hdfs.create_file(path,file,overwrite=True)
-            hdfs_meta = self.hdfs.get_file_dir_status(path)['FileStatus']
-            file_meta = self.extract(file)
-            status = t.insert(
-                key,
-                {
-                    'file': {'content': file_content,
-                             'name': file}
-                }
-            )
-            if status != 200:
-                if self.debug:
-                    print "Error inserting: file content"
-
-            # save hbase meta data
-            for i in range(0,len(file_meta.keys())):
-                status = t.insert(
-                    key,
-                    {
-                        'meta_data': {file_meta.keys()[i]: file_meta[file_meta.keys()[i]]}
-                    }
-                )
-                if status != 200:
-                    if self.debug:
-                        print "Error inserting:", file_meta.keys()[i]
-            # save hdfs meta data
-            for i in range(0,len(hdfs_meta.keys())):
-                status = t.insert(
-                    key,
-                    {
-                        'meta_data': {hdfs_meta.keys()[i]: hdfs_meta[hdfs_meta.keys()[i]]}
-                    }
-                )
-                if status != 200:
-                    if self.debug:
-                        print "Error inserting:", hdfs_meta.keys()[i]
-            # save version
-            status = t.insert(
-                key,
-                {
-                    'meta_data': {'version': version}
-                }
-            )
-            if status != 200:
-                if self.debug:
-                    print "Error inserting: version"
+            digest = None
+            old_meta = dict()
+            try:
+                # Read how the version is stored even without these options, another
+                # DMS may have compressed, packed or split it.
+                old_row = self.fetch(self.hbase_table, key, ['meta_data'])
+                if old_row:
+                    old_meta = old_row['meta_data']
+                size = os.fstat(f.fileno()).st_size
+                codec = file_content = pack = manifest = None
+                # The next version may be a delta of this one even without delta
+                # mode, another DMS may have stored it.
+                self.detach_version(file, version)
+                delta = self.encode_version(file, version, f, size)
+                if 'parts' in old_meta and (delta or self.storage(size) != 'parts'):
+                    self.hdfs.delete_file_dir(path, recursive=True)
+                if delta:
+                    path = None
+                else:
+                    codec = self.choose_codec(file, size)
+                    file_content, path, digest, pack, manifest = self.store_content(
+                        f, key, path, codec, True)
+            finally:
+                f.close()
+            if delta:
+                hdfs_meta = {'length': len(delta[0]), 'modificationTime': int(time.time() * 1000)}
+            else:
+                hdfs_meta = self.hdfs.get_file_dir_status(path)['FileStatus']
+            file_meta = self.extract(source or file, digest)
+            row = self.build_row(file, file_content, file_meta, hdfs_meta, version, path)
+            self.set_storage_meta(row, digest, codec, size, pack, manifest, delta)
+            if not codec and 'codec' in old_meta:
+                self.hbase_table.remove(key, 'meta_data', 'codec')
+            if 'original_length' in old_meta:
+                # length is file's size since stored_length is kept.
+                self.hbase_table.remove(key, 'meta_data', 'original_length')
+            if not pack and 'pack' in old_meta:
+                self.hbase_table.remove(key, 'meta_data', 'pack')
+                self.hbase_table.remove(key, 'meta_data', 'pack_offset')
+            if not manifest and 'parts' in old_meta:
+                self.hbase_table.remove(key, 'meta_data', 'parts')
+                self.hbase_table.remove(key, 'file', 'manifest')
+            if not delta and 'delta_base' in old_meta:
+                self.hbase_table.remove(key, 'file', 'delta')
+                self.hbase_table.remove(key, 'meta_data', 'delta_base')
+                self.hbase_table.remove(key, 'meta_data', 'delta_depth')
+            if delta:
+                self.hbase_table.remove(key, 'file', 'path')
+            # Drop a stale inline content when the new one is too large for it.
+            if file_content is None:
+                self.hbase_table.remove(key, 'file', 'content')
+            self.insert_row(key, row)
+            self.invalidate(file, key)
+            self.index_version(file, version)
+            self.index_meta(key, row['meta_data'], old_meta)
+            if self.indexer is not None:
+                content = delta[3] if delta and size <= self.inline_limit else None
+                self.indexer.add(self.build_document(key, row, content))
+            old_digest = old_meta.get('hash')
+            if old_digest and old_digest != digest:
+                self.release_blob(old_digest, key)
+            old_pack = old_meta.get('pack')
+            if old_pack and old_pack != (pack or [None])[0]:
+                self.release_pack(old_pack, key)
+            elif ((pack or delta) and old_meta and not old_digest and not old_pack and
+                    'parts' not in old_meta and 'delta_base' not in old_meta):
+                # The version had its own hdfs file before it is packed or a delta.
+                self.hdfs.delete_file_dir(''.join([self.hdfs_path,self.version_name(file, version)]))
         except:
             if self.debug:
                 print "Update failed."
@@ -276,40 +3271,152 @@ class DMS:
             print "[Updated]", file, "version:", version
         return True
 
+    @timed('delete')
     def delete(self, file, version=None):
         ''' This function use to delete file in hbase, and hdfs. You can specify
         file's version in order to delete it.
         :param : file - file's name
         :param : version - file's version
-        :return: True if succes otherwise False.
+        :return: True if succes otherwise False. Spooled versions of the file are
+                 stored first, it fails if they are not (See flush).
         '''
+        if self.spool is not None and not self.spool.wait(file, self.spool_timeout):
+            # A spooled version stored later would bring the file back.
+            if self.debug:
+                print "Cannot delete.",file,"has spooled versions which are not stored."
+            return False
         if not version:
             version = self.get_lastest_version(file)
-        key = ''.join(['v',str(version),'.',file])
-        path = ''.join([self.hdfs_path,key])
+            if version is None:
+                if self.debug:
+                    print file,"is not exists."
+                return False
+        key = self.row_key(file, version)
 
         # Check if file exists
-        if self.hbase_table.fetch(key) == None:
+        row = self.fetch(self.hbase_table, key, ['meta_data'])
+        if row == None:
             if self.debug:
                 print "Cannot delete.",key,"is not exists."
             return False
 
-        # Remove row on hbase
-        t = self.hbase_table
-        if t.remove(key) != 200:
-            if self.debug:
-                print "[HBASE] cannot remove a row key:",key
-            return False
-
-        # Delete file on hdfs
-        if not self.hdfs.delete_file_dir(path):
+        try:
+            self.remove_version(key, row['meta_data'])
+        except Exception as e:
             if self.debug:
-                print "[HDFS] Cannot remove a file path:",path
+                print e
             return False
         if self.debug:
             print "[Deleted]", file, "version:", version
         return True
 
+    def remove_version(self, key, meta_data=None, detach=True):
+        ''' This function use to remove one version of a file: its row on hbase, its
+        entry of the version index and its file on hdfs (or its blob reference).
+        :param : key - row key (See row_key)
+        :param : meta_data - row's meta_data if it is already fetched, None to fetch it
+        :param : detach - store the next version as a full copy if it is a delta
+                 of this one (See detach_version) (default: True)
+        :return: Nothing. Raise IOError if it fails.
+        '''
+        self.check_writable()
+        parsed = self.parse_row_key(key)
+        if parsed is None:
+            raise IOError("%s is not a row key." % key)
+        file, version = parsed
+        if meta_data is None:
+            row = self.fetch(self.hbase_table, key, ['meta_data'])
+            if row == None:
+                raise IOError("%s is not exists." % key)
+            meta_data = row['meta_data']
+        if detach:
+            self.detach_version(file, version)
+
+        # Remove row on hbase
+        if self.hbase_table.remove(key) != 200:
+            raise IOError("[HBASE] cannot remove a row key: %s" % key)
+
+        # Remove version from the version index
+        if self.version_table.remove(file, 'version', str(version)) != 200:
+            if self.debug:
+                print "[HBASE] cannot remove a version index:",key
+        self.unindex_meta(key, meta_data)
+        if self.indexer is not None:
+            self.indexer.delete(key)
+        self.invalidate(file, key)
+
+        # Delete file on hdfs, a shared blob only goes with its last reference
+        # and a container is reclaimed by compact_packs.
+        digest = meta_data.get('hash')
+        if digest:
+            if not self.release_blob(digest, key):
+                raise IOError("[HDFS] Cannot remove a blob: %s" % digest)
+        elif meta_data.get('pack'):
+            if not self.release_pack(meta_data['pack'], key):
+                raise IOError("[HBASE] Cannot remove a container entry: %s" % key)
+        elif 'delta_base' not in meta_data:
+            path = ''.join([self.hdfs_path,self.version_name(file, version)])
+            if not self.hdfs.delete_file_dir(path, recursive='parts' in meta_data):
+                raise IOError("[HDFS] Cannot remove a file path: %s" % path)
+
+    @timed('delete_many')
+    def delete_many(self, keys=None, workers=8, batch_size=1000):
+        ''' This function use to delete many versions fast. Row keys are read page
+        by page (batch_size keys at a time, without file's content) and each page
+        is removed from hbase and hdfs concurrently by worker threads. HBase REST
+        has no batch delete (a starbase batch only inserts and updates), so every
+        row is still removed by its own request, the workers overlap them.
+        :param : keys - list of row keys (See row_key), None for all files
+        :param : workers - number of worker threads (default: 8), keys are
+                 removed one by one in delta mode
+        :param : batch_size - number of versions per page (default: 1000)
+        :return: summary as a dict (deleted - number of deleted versions,
+                 failed - dict of row key and its error). Raise IOError if
+                 spooled files are not stored first (See flush).
+        '''
+        if self.spool is not None and not self.spool.wait(timeout=self.spool_timeout):
+            raise IOError("spooled files are not stored")
+        if keys is None:
+            columns = [''.join(['meta_data:',field])
+                       for field in ('version', 'hash', 'pack', 'parts', 'delta_base') +
+                       self.meta_index]
+            rows = self.scan(columns=columns, batch_size=batch_size)
+            items = ((key, row['meta_data']) for key, row in rows)
+            detach = False
+        else:
+            detach = self.delta
+            if self.delta:
+                # Newer versions go first, one at a time, so a version is never
+                # rebuilt while its base is being removed.
+                keys = sorted(keys, key=lambda key: (self.parse_row_key(key) or (key, 0))[1],
+                              reverse=True)
+                workers = 1
+            items = ((key, None) for key in keys)
+        summary = {'deleted': 0, 'failed': dict()}
+        pool = WorkerPool(workers)
+        try:
+            page = list()
+            for item in itertools.chain(items, [None]):
+                if item is not None:
+                    page.append(item)
+                    if len(page) < batch_size:
+                        continue
+                futures = [(key, pool.submit(self.remove_version, key, meta_data, detach))
+                           for key, meta_data in page]
+                for key, future in futures:
+                    error = future.exception()
+                    if error is None:
+                        summary['deleted'] += 1
+                        if self.debug:
+                            print "[Deleted]", key
+                    else:
+                        summary['failed'][key] = str(error)
+                page = list()
+        finally:
+            pool.close()
+        return summary
+
+    @timed('get_file_meta_data')
     def get_file_meta_data(self, file, version=None):
         ''' This function use to get all file's meta_data from hbase. You can
         specify a file's version.
@@ -319,101 +3426,741 @@ class DMS:
         '''
         if not version:
             version = self.get_lastest_version(file)
-        key = ''.join(['v',str(version),'.',file])
-        if not self.hbase_table.fetch(key):
+            if version is None:
+                if self.debug:
+                    print file,"is not exists."
+                return False
+        spooled = self.open_spooled(file, version)
+        if spooled is not None:
+            try:
+                status = os.fstat(spooled.fileno())
+            finally:
+                spooled.close()
+            return {'version': int(version), 'length': status.st_size,
+                    'modificationTime': int(status.st_mtime * 1000), 'spooled': True}
+        key = self.row_key(file, version)
+        row = self.fetch_row(key)
+        if not row:
             if self.debug:
                 print key,"is not exists"
             return False
-        return self.hbase_table.fetch(key)['meta_data']
+        return dict(row['meta_data'])
 
+    @timed('get_file_content')
     def get_file_content(self, file, version=None):
         ''' This function use to get all file's content from hbase. You can
-        specify a file's version.
+        specify a file's version. Content of a large file is not stored in hbase,
+        it will be read from its hdfs path instead.
         :param : file - file's name
         :param : version - file's version
         :return: meta data as dict for success, 0 if fail
         '''
         if not version:
             version = self.get_lastest_version(file)
-        key = ''.join(['v',str(version),'.',file])
-        if not self.hbase_table.fetch(key):
+            if version is None:
+                if self.debug:
+                    print file,"is not exists."
+                return False
+        spooled = self.open_spooled(file, version)
+        if spooled is not None:
+            try:
+                return {'name': file, 'content': spooled.read()}
+            finally:
+                spooled.close()
+        key = self.row_key(file, version)
+        row = self.fetch_row(key)
+        if not row:
             if self.debug:
                 print key,"is not exists"
             return False
-        return self.hbase_table.fetch(key)['file']
+        file_data = dict(row['file'])
+        file_data.pop('manifest', None)
+        file_data.pop('delta', None)
+        file_data['content'] = self.version_content(file, version, row)
+        return file_data
 
-    def search(self, text):
-        ''' This function will search in xxxx via solr rest api.
-        :param : text - text for searching
+    @timed('search')
+    def search(self, text, start=0, rows=10, fields=None, filters=None, sort=None,
+               cursor=None):
+        ''' This function will search in xxxx via solr rest api. Results are kept
+        in the search cache if it is enabled (See search_cache_entries).
+        :param : text - text for searching (solr query)
+        :param : start - first hit to return (default: 0)
+        :param : rows - number of hits to return (default: 10)
+        :param : fields - list of fields to return (default: None, all fields)
+        :param : filters - list of filter queries (default: None)
+        :param : sort - solr sort, for example 'modificationTime desc' (default: None)
+        :param : cursor - cursorMark for deep paging, '*' for the first page. The
+                 next one is nextCursorMark of a response. (default: None)
         :return: json response from solr, False for not found.
         '''
-        query = urlopen(''.join([self.solr,'/select?q=',text,'&wt=json']))
-        response = simplejson.load(query)
+        params = [('q', text), ('wt', 'json'), ('start', start), ('rows', rows)]
+        if fields:
+            params.append(('fl', ','.join(fields)))
+        for query in filters or []:
+            params.append(('fq', query))
+        if cursor is not None:
+            params.append(('cursorMark', cursor))
+            sort = self.cursor_sort(sort)
+        if sort:
+            params.append(('sort', sort))
+        response = None
+        if self.search_cache is not None:
+            response = self.search_cache.get(('search', tuple(params)))
+        if response is None:
+            query = self.pool.get(''.join([self.solr,'/select']), params=params)
+            if query.status_code != 200:
+                raise IOError("[SOLR] cannot search %s: %s" % (text, query.status_code))
+            response = simplejson.loads(query.content)
+            if self.search_cache is not None:
+                self.search_cache.put(('search', tuple(params)), response, len(query.content))
         if response['response']['numFound'] == 0:
             if self.debug:
                 print text,"not found!"
             return False
-        return response
+        return copy.deepcopy(response)
+
+    def cursor_sort(self, sort):
+        ''' This function return a sort for cursorMark paging, which needs a sort
+        on the unique key (id) to break ties.
+        :param : sort - solr sort (None is allowed)
+        :return: sort as a string.
+        '''
+        if not sort:
+            return 'id asc'
+        if 'id' in [term.split()[0] for term in sort.split(',') if term.strip()]:
+            return sort
+        return ''.join([sort,',id asc'])
+
+    def iter_search(self, text, fields=None, filters=None, sort=None, rows=100):
+        ''' This function return all hits of a search one by one, reading them page
+        by page with cursorMark, so an export does not need a huge page or deep
+        start offsets.
+        :param : text - text for searching (solr query)
+        :param : fields - list of fields to return (default: None, all fields)
+        :param : filters - list of filter queries (default: None)
+        :param : sort - solr sort (default: None, by id)
+        :param : rows - number of hits per request (default: 100)
+        :return: generator of solr documents.
+        '''
+        cursor = '*'
+        while True:
+            response = self.search(text, 0, rows, fields, filters, sort, cursor)
+            if not response:
+                return
+            for document in response['response']['docs']:
+                yield document
+            next_cursor = response.get('nextCursorMark')
+            if not next_cursor or next_cursor == cursor:
+                return
+            cursor = next_cursor
 
-    def get_all_file(self):
+    @timed('get_all_file')
+    def get_all_file(self, columns=None):
         ''' This function return all files that stored on Hbase in a list format.
-        :param : Nothing.
+        Use iter_files or list_files for a large table.
+        :param : columns - list of 'family' or 'family:column' to fetch
+                 (default: None, all columns)
         :return: fetch result as a list.
         '''
-        rf = '{"type": "RowFilter", "op": "EQUAL", "comparator": {"type": "RegexStringComparator", "value": ""}}'
-        t = self.hbase_table
-        result = t.fetch_all_rows(with_row_id=True, filter_string=rf)
-        return list(result)
+        return list(self.iter_files(columns))
 
-    def get_file_version(self, file):
-        ''' This function will fetch data from file name then return them.
+    def iter_files(self, columns=None, start_row=None, stop_row=None, batch_size=1000):
+        ''' This function return all files that stored on Hbase one by one, reading
+        them from a scanner batch by batch instead of all at once. Fetch only the
+        columns you need, for example ['meta_data:version', 'meta_data:length'].
+        :param : columns - list of 'family' or 'family:column' to fetch
+                 (default: None, all columns)
+        :param : start_row - first row key (default: None, from the first row)
+        :param : stop_row - stop before this row key (default: None, to the end)
+        :param : batch_size - maximum cells per request (default: 1000)
+        :return: generator of {row key: row} dicts, like items of get_all_file.
+        '''
+        for key, row in self.scan(columns=columns, start_row=start_row,
+                                  stop_row=stop_row, batch_size=batch_size):
+            yield {key: row}
+
+    @timed('list_files')
+    def list_files(self, page_size=100, page_token=None, columns=None):
+        ''' This function return one page of files that stored on Hbase. Pass the
+        returned token to get the next page.
+        :param : page_size - number of files per page (default: 100)
+        :param : page_token - token of a page, None for the first page
+        :param : columns - list of 'family' or 'family:column' to fetch
+                 (default: None, all columns)
+        :return: (list of {row key: row} dicts, token of the next page or None
+                 for the last page) as a tuple.
+        '''
+        files = list()
+        rows = self.scan(columns=columns, start_row=page_token, batch_size=page_size + 1)
+        try:
+            for key, row in rows:
+                if len(files) == page_size:
+                    return files, key
+                files.append({key: row})
+        finally:
+            rows.close()
+        return files, None
+
+    def scan(self, table=None, start_row=None, stop_row=None, columns=None,
+             filter_string=None, batch_size=1000):
+        ''' This function use to scan rows of an hbase table with a stargate scanner,
+        batch by batch, so only one batch is held in memory at a time.
+        :param : table - starbase table (default: DMS table)
+        :param : start_row - first row key (default: None, from the first row)
+        :param : stop_row - stop before this row key (default: None, to the end)
+        :param : columns - list of 'family' or 'family:column' to fetch
+                 (default: None, all columns)
+        :param : filter_string - hbase filter as a json string (default: None)
+        :param : batch_size - maximum cells per request (default: 1000)
+        :return: generator of (row key, row) tuples sorted by row key.
+        '''
+        if table is None:
+            table = self.hbase_table
+        spec = {'batch': batch_size}
+        if start_row:
+            spec['startRow'] = base64.b64encode(start_row)
+        if stop_row:
+            spec['endRow'] = base64.b64encode(stop_row)
+        if columns:
+            spec['column'] = [base64.b64encode(column) for column in columns]
+        if filter_string:
+            spec['filter'] = filter_string
+        response = self.hbase.http_request(connection=self.hbase,
+                                           url='/'.join([table.name,'scanner']),
+                                           data=spec, method=methods.PUT).get_response()
+        if response.status_code == 404:
+            # The table is not created yet (See open_table).
+            return
+        location = response.raw.headers.get('location')
+        if not location:
+            raise IOError("[HBASE] cannot open a scanner on %s" % table.name)
+        url = '/'.join([table.name,'scanner',location.split('/')[-1]])
+        key = row = None
+        try:
+            while True:
+                response = self.hbase.http_request(connection=self.hbase, url=url).get_response()
+                if response.status_code != 200 or not response.content:
+                    break
+                for item in response.content['Row']:
+                    item_key, item_row = self.decode_row(item)
+                    # A row may be split over batches when it has many cells.
+                    if item_key == key:
+                        for family, cells in item_row.items():
+                            row.setdefault(family, dict()).update(cells)
+                        continue
+                    if key is not None:
+                        yield key, row
+                    key, row = item_key, item_row
+        finally:
+            self.hbase.http_request(connection=self.hbase, url=url,
+                                    method=methods.DELETE).get_response()
+        if key is not None:
+            yield key, row
+
+    @timed('get_file_version')
+    def get_file_version(self, file, spooled=True):
+        ''' This function will fetch file's versions from the version index with
+        a single keyed read, then return them.
         :param : file - file's name
-        :return: file_list with version as a dict.
-        '''
-        rf = ''.join(['{"type": "RowFilter", "op": "EQUAL", "comparator": {"type": "RegexStringComparator", "value": "',file,'"}}'])
-        t = self.hbase_table
-        result = t.fetch_all_rows(with_row_id=True, filter_string=rf)
-        lsr = list(result)
-        file_version = list()
-        for i in range(0,len(lsr)):
-            file_version.append(lsr[i].keys()[0].split('.')[0].split('v')[1])
+        :param : spooled - also return versions which are spooled and not stored
+                 yet (See spool_dir) (default: True)
+        :return: file_list with version (sorted by number) as a dict.
+        '''
+        file_version = None
+        if self.cache is not None:
+            file_version = self.cache.get(('version', file))
+        if file_version is None:
+            row = self.fetch(self.version_table, file)
+            file_version = list()
+            if row:
+                file_version = sorted(row['version'].keys(), key=int)
+            if self.cache is not None:
+                self.cache.put(('version', file), file_version, len(file_version))
+        file_version = list(file_version)
+        if spooled and self.spool is not None:
+            versions = self.spooled_versions(file, file_version)
+            file_version = sorted(set(file_version) | set([str(version) for version in versions]),
+                                  key=int)
         file_list = dict()
         file_list['name'] = file
         file_list['version'] = file_version
         return file_list
 
-    def get_lastest_version(self, file):
+    @timed('get_lastest_version')
+    def get_lastest_version(self, file, spooled=True):
         ''' This function will return a lastest version number as integer.
         :param : file - file's name
-        :return: version number as an integer.
+        :param : spooled - also count versions which are spooled and not stored
+                 yet (See spool_dir) (default: True)
+        :return: version number as an integer, None if file is not exists.
         '''
-        file_version = self.get_file_version(file)
-        file_version['version'].sort()
-        return file_version['version'][len(file_version['version'])-1]
+        file_version = self.get_file_version(file, spooled)
+        if not file_version['version']:
+            return None
+        return int(file_version['version'][-1])
 
-    def delete_all_version(self, file):
-        ''' This function will delete all file's version in an hbase and HDFS
+    def scan_versions(self, file, columns=None):
+        ''' This function use to read rows of all file's versions from DMS table,
+        newest first, without the version index. With 'name' row key layout it is
+        a range scan of only the file's rows, with 'version' layout it has to scan
+        the whole table with an anchored row filter.
         :param : file - file's name
-        :return: True if success otherwise False
+        :param : columns - list of 'family' or 'family:column' to fetch
+                 (default: None, all columns)
+        :return: generator of (row key, row) tuples.
         '''
-        self.get_file_version(file)['version'].sort()
-        for version in self.get_file_version(file)['version']:
+        if self.key_layout == 'name':
+            # Keys of other files which start with [file]. are in the range too.
+            rows = self.scan(start_row=''.join([file,'.']), stop_row=''.join([file,'/']),
+                             columns=columns)
             try:
-                self.delete(file,version)
-            except:
+                for key, row in rows:
+                    parsed = self.parse_row_key(key)
+                    if parsed and parsed[0] == file:
+                        yield key, row
+            finally:
+                rows.close()
+            return
+        regex = ''.join(['^v[0-9]+\\.',re.escape(file),'$'])
+        filter_string = simplejson.dumps({'type': 'RowFilter', 'op': 'EQUAL',
+            'comparator': {'type': 'RegexStringComparator', 'value': regex}})
+        rows = sorted(self.scan(columns=columns, filter_string=filter_string),
+                      key=lambda item: self.parse_row_key(item[0])[1], reverse=True)
+        for key, row in rows:
+            yield key, row
+
+    def scan_lastest_version(self, file):
+        ''' This function will return a lastest version number as integer, read
+        from DMS table instead of the version index. It is a one row range scan
+        with 'name' row key layout (See scan_versions).
+        :param : file - file's name
+        :return: version number as an integer, None if file is not exists.
+        '''
+        rows = self.scan_versions(file, ['meta_data:version'])
+        try:
+            for key, row in rows:
+                return self.parse_row_key(key)[1]
+        finally:
+            rows.close()
+        return None
+
+    def index_version(self, file, version):
+        ''' This function use to add file's version to the version index.
+        :param : file - file's name
+        :param : version - file's version
+        :return: True if success otherwise False.
+        '''
+        key = self.row_key(file, version)
+        self.invalidate(file)
+        if self.version_table.insert(file, {'version': {str(version): key}}) != 200:
+            if self.debug:
+                print "[HBASE] cannot index a version:",key
+            return False
+        return True
+
+    def rebuild_version_index(self, batch_size=1000):
+        ''' This function use to (re)build the version index from all row keys of
+        DMS table. Run it once on a table which was created before the index.
+        The index is updated in place (See write_index), lookups work meanwhile.
+        :param : batch_size - number of rows per request (default: 1000)
+        :return: True if success otherwise False.
+        '''
+        index = dict()
+        for key, row in self.scan(columns=['meta_data:version'], batch_size=batch_size):
+            parsed = self.parse_row_key(key)
+            if parsed is None:
+                if self.debug:
+                    print "[HBASE] skip an unknown row key:",key
+                continue
+            file, version = parsed
+            index.setdefault(file, dict())[str(version)] = key
+        def live(file, version):
+            # A version stored after the scan.
+            return self.fetch(self.hbase_table, self.row_key(file, version),
+                              ['meta_data:version']) is not None
+        success = self.write_index(self.version_table, 'version', index, batch_size, live)
+        if self.cache is not None:
+            self.cache.clear()
+        if not success:
+            if self.debug:
+                print "[HBASE] cannot rebuild the version index."
+            return False
+        if self.debug:
+            print "[Indexed]", len(index), "files"
+        return True
+
+    def write_index(self, table, family, index, batch_size, live):
+        ''' This function use to write a rebuilt index over its table in batches of
+        batch_size rows, then remove entries which are not in it. The table is
+        not dropped, so lookups work while it is rebuilt.
+        :param : table - starbase table of the index
+        :param : family - column family of index entries
+        :param : index - dict of index row key -> dict of column -> value
+        :param : batch_size - number of rows per request
+        :param : live - function(index row key, column) which tells whether an
+                 entry that is not in index is right, it may be added after
+                 index was built
+        :return: True if success otherwise False.
+        '''
+        rows = [(key, {family: columns}) for key, columns in index.items()]
+        for i in range(0, len(rows), batch_size):
+            if not self.insert_rows(rows[i:i + batch_size], table):
                 return False
+        success = True
+        for key, row in self.scan(table=table, batch_size=batch_size):
+            for column in row.get(family, dict()):
+                if column in index.get(key, ()) or live(key, column):
+                    continue
+                if table.remove(key, family, column) != 200:
+                    success = False
+        return success
+
+    def meta_index_key(self, field, value):
+        ''' This function return a row key of meta data index for a field's value,
+        [field]=[value as hex]. Numbers are zero padded to 20 digits so index rows
+        of a field are sorted by value and can be read with a range scan. Hex keeps
+        the order and lets values like 'text/plain' be used in a rest url.
+        :param : field - meta_data column's name
+        :param : value - column's value
+        :return: index row key as a string.
+        '''
+        if isinstance(value, (int, long)) or (isinstance(value, basestring) and value.isdigit()):
+            value = '%020d' % int(value)
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return ''.join([field,'=',str(value).encode('hex')])
+
+    def index_meta(self, key, meta_data, old_meta_data=None):
+        ''' This function use to add a version to meta data index of its indexed
+        columns (See meta_index), and remove it from the index of old values which
+        changed.
+        :param : key - row key
+        :param : meta_data - row's meta_data
+        :param : old_meta_data - row's meta_data before an update (default: None)
+        :return: True if success otherwise False.
+        '''
+        if not self.meta_index:
+            return True
+        rows = list()
+        changed = dict()
+        for field in self.meta_index:
+            if field in meta_data:
+                index_key = self.meta_index_key(field, meta_data[field])
+                rows.append((index_key, {'row': {key: '1'}}))
+            if field in (old_meta_data or dict()):
+                old_key = self.meta_index_key(field, old_meta_data[field])
+                if field not in meta_data or old_key != index_key:
+                    changed[field] = old_meta_data[field]
+        success = self.unindex_meta(key, changed)
+        if rows and not self.insert_rows(rows, self.meta_table):
+            success = False
+        return success
+
+    def unindex_meta(self, key, meta_data):
+        ''' This function use to remove a version from meta data index.
+        :param : key - row key
+        :param : meta_data - row's meta_data (only indexed columns are used)
+        :return: True if success otherwise False.
+        '''
+        success = True
+        for field in self.meta_index:
+            if field not in meta_data:
+                continue
+            index_key = self.meta_index_key(field, meta_data[field])
+            if self.meta_table.remove(index_key, 'row', key) != 200:
+                if self.debug:
+                    print "[HBASE] cannot remove a meta data index:",index_key
+                success = False
+        return success
+
+    @timed('find_by_meta')
+    def find_by_meta(self, field, value=None, range=None):
+        ''' This function use to find versions by an indexed meta data column (See
+        meta_index) through meta data index instead of scanning DMS table. Give a
+        value for an exact match, or a range for a range scan of the index. To
+        combine conditions, intersect the results, for example all PDFs modified
+        since last week:
+        set(find_by_meta('MIME type', 'application/pdf')) &
+        set(find_by_meta('modificationTime', range=(last_week, None)))
+        :param : field - meta_data column's name
+        :param : value - column's value (default: None)
+        :param : range - (low, high) tuple to find low <= value < high, None for
+                 an open end (default: None)
+        :return: sorted list of row keys (See parse_row_key).
+        '''
+        if field not in self.meta_index:
+            raise ValueError("%s is not indexed." % field)
+        if range is None:
+            if value is None:
+                raise ValueError("value or range is required.")
+            row = self.fetch(self.meta_table, self.meta_index_key(field, value))
+            if not row:
+                return list()
+            return sorted(row['row'].keys())
+        low, high = range
+        start_row = ''.join([field,'='])
+        stop_row = ''.join([field,'>'])
+        if low is not None:
+            start_row = self.meta_index_key(field, low)
+        if high is not None:
+            stop_row = self.meta_index_key(field, high)
+        keys = set()
+        for index_key, row in self.scan(self.meta_table, start_row, stop_row, ['row']):
+            keys.update(row['row'].keys())
+        return sorted(keys)
+
+    def rebuild_meta_index(self, batch_size=1000):
+        ''' This function use to (re)build meta data index from DMS table. Run it
+        after meta_index is changed. The index is updated in place (See
+        write_index), lookups work meanwhile.
+        :param : batch_size - number of rows per request (default: 1000)
+        :return: True if success otherwise False.
+        '''
+        if not self.meta_index:
+            # No field is indexed, so there is no index table.
+            return True
+        columns = [''.join(['meta_data:',field]) for field in self.meta_index]
+        index = dict()
+        for key, row in self.scan(columns=columns, batch_size=batch_size):
+            for field, value in row.get('meta_data', dict()).items():
+                index.setdefault(self.meta_index_key(field, value), dict())[key] = '1'
+        def live(index_key, key):
+            # A version stored or changed after the scan.
+            field = index_key.rsplit('=', 1)[0]
+            row = self.fetch(self.hbase_table, key, [''.join(['meta_data:',field])])
+            return (row is not None and field in row.get('meta_data', dict()) and
+                    self.meta_index_key(field, row['meta_data'][field]) == index_key)
+        if not self.write_index(self.meta_table, 'row', index, batch_size, live):
+            if self.debug:
+                print "[HBASE] cannot rebuild meta data index."
+            return False
+        if self.debug:
+            print "[Indexed]", len(index), "meta data values"
+        return True
+
+    def migrate_table(self, table, key_layout='name', batch_size=1000, batch_bytes=16777216):
+        ''' This function use to copy all rows of DMS table to a new table with
+        another row key layout (See row_key), build its version index, blob
+        references and container entries (whatever dedup and pack_limit of this
+        DMS are, the rows tell which ones they use), then use the new table from
+        now on. Files on hdfs are not moved because their names do not depend on
+        the layout. The old tables are kept, drop them when they are no longer
+        used.
+        Solr documents (See solr_connection) are re-added with new row keys.
+        :param : table - name of the new DMS table
+        :param : key_layout - row key layout of the new table (default: 'name')
+        :param : batch_size - number of rows per request (default: 1000)
+        :param : batch_bytes - rows are sent when their size reaches it, even if
+                 there are less than batch_size of them (default: 16 MB)
+        :return: True if success otherwise False.
+        '''
+        target = self.open_table(table, 'meta_data', 'file')
+        index = dict()
+        refs = dict()
+        packs = dict()
+        rows = list()
+        size = 0
+        success = True
+        for key, row in itertools.chain(self.scan(batch_size=batch_size), [(None, None)]):
+            if key is not None:
+                parsed = self.parse_row_key(key)
+                if parsed is None:
+                    if self.debug:
+                        print "[HBASE] skip an unknown row key:",key
+                    continue
+                file, version = parsed
+                new_key = self.row_key(file, version, key_layout)
+                rows.append((new_key, row))
+                size += self.row_size(row)
+                if self.indexer is not None:
+                    self.indexer.delete(key)
+                    self.indexer.add(self.build_document(new_key, row))
+                index.setdefault(file, dict())[str(version)] = new_key
+                meta_data = row.get('meta_data', dict())
+                if meta_data.get('hash'):
+                    refs.setdefault(meta_data['hash'], dict())[new_key] = '1'
+                span = self.pack_span(meta_data)
+                if span:
+                    packs.setdefault(meta_data['pack'], dict())[new_key] = '%d,%d' % span
+                if len(rows) < batch_size and size < batch_bytes:
+                    continue
+            if rows and not self.insert_rows(rows, target):
+                success = False
+            rows = list()
+            size = 0
+
+        tables = [(''.join([table,'_version']), ['version'],
+                   [(row_key, {'version': columns}) for row_key, columns in index.items()])]
+        if refs:
+            tables.append((''.join([table,'_blob']), ['ref'],
+                           [(row_key, {'ref': columns}) for row_key, columns in refs.items()]))
+        if packs:
+            items = list()
+            for row_key, columns in packs.items():
+                pack = self.fetch(self.pack_table, row_key, ['info']) or dict()
+                pack['entry'] = columns
+                items.append((row_key, pack))
+            tables.append((''.join([table,'_pack']), ['entry', 'info'], items))
+        for name, families, items in tables:
+            t = self.open_table(name, *families)
+            for i in range(0, len(items), batch_size):
+                if not self.insert_rows(items[i:i + batch_size], t):
+                    success = False
+        if not success:
+            if self.debug:
+                print "[HBASE] cannot migrate to a table:",table
+            return False
+
+        self.open_tables(table, key_layout)
+        if self.cache is not None:
+            self.cache.clear()
+        if self.meta_index and not self.rebuild_meta_index():
+            return False
+        if self.debug:
+            print "[Migrated]", len(index), "files to", table
+        return True
+
+    def row_size(self, row):
+        ''' This function return the size of a row's keys and values in bytes.
+        :param : row - row as a dict of family -> dict of column -> value
+        :return: size as an integer.
+        '''
+        size = 0
+        for family, columns in row.items():
+            for column, value in columns.items():
+                size += len(family) + len(column) + len(str(value))
+        return size
+
+    def delete_all_version(self, file, workers=8):
+        ''' This function will delete all file's version in an hbase and HDFS
+        :param : file - file's name
+        :param : workers - number of worker threads (default: 8)
+        :return: True if success otherwise False
+        '''
+        if self.key_layout == 'name':
+            keys = [key for key, row in self.scan_versions(file, ['meta_data:version'])]
+        else:
+            versions = self.get_file_version(file)['version']
+            keys = [self.row_key(file, version) for version in versions]
+        summary = self.delete_many(keys, workers)
+        if summary['failed']:
+            if self.debug:
+                print "Cannot delete:", summary['failed']
+            return False
         return True
 
-    def delete_all(self):
+    def delete_all(self, workers=8):
         ''' This function will delete all the files on an hbase and hdfs.
-        :param : Nothing
+        (See delete_many for a summary of what failed.)
+        :param : workers - number of worker threads (default: 8)
         :return: True if success otherwise False
         '''
-        for full_file in self.get_all_file():
-            file = full_file.keys()[0].split('.')[1]
-            version = full_file.keys()[0].split('.')[0].split('v')[1]
-            try:
-                self.delete(file,version)
-            except:
-                return False
+        summary = self.delete_many(workers=workers)
+        if summary['failed']:
+            if self.debug:
+                print "Cannot delete:", summary['failed']
+            return False
         return True
+
+class AsyncDMS:
+    def __init__(self, dms, workers=8):
+        ''' This class is a non-blocking client of a connected DMS. Every function
+        has the same arguments as the one of DMS, runs on a pool of worker threads
+        and return a Future (See Future) right away instead of its result.
+        Uploads, updates and deletes of the same file run one by one, in the
+        order they are called.
+        :param : dms - connected DMS
+        :param : workers - number of worker threads (default: 8)
+        :return: Nothing.
+        '''
+        self.dms = dms
+        self.pool = WorkerPool(workers)
+        # Future of the last upload, update or delete of each file.
+        self.last = dict()
+        self.last_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        ''' This function stop worker threads after queued calls are done.
+        :param : Nothing.
+        :return: Nothing.
+        '''
+        # Calls waiting for a previous call of their file are not queued yet.
+        with self.last_lock:
+            waiting = self.last.values()
+        for future in waiting:
+            future.exception()
+        self.pool.close()
+
+    def ordered(self, function, file, *args):
+        ''' This function queue function(file, ...) to run after the uploads,
+        updates and deletes of the file which are called before it. It is only
+        queued when the previous one has finished, so no worker thread waits.
+        :return: Future of the call.
+        '''
+        future = Future()
+        with self.last_lock:
+            previous = self.last.get(file)
+            self.last[file] = future
+        start = lambda previous: self.pool.put(future, function, file, *args)
+        if previous is None:
+            start(None)
+        else:
+            previous.add_done_callback(start)
+        future.add_done_callback(lambda future: self.forget(file, future))
+        return future
+
+    def forget(self, file, future):
+        ''' This function drop a finished call if it is the last one of a file.
+        '''
+        with self.last_lock:
+            if self.last.get(file) is future:
+                del self.last[file]
+
+    def upload(self, file):
+        ''' Non-blocking DMS.upload, return a Future of its result. '''
+        return self.ordered(self.dms.upload, file)
+
+    def download(self, file, version=None, download_dir=''):
+        ''' Non-blocking DMS.download, return a Future of its result. '''
+        return self.pool.submit(self.dms.download, file, version, download_dir)
+
+    def update(self, file, version=None):
+        ''' Non-blocking DMS.update, return a Future of its result. '''
+        return self.ordered(self.dms.update, file, version)
+
+    def delete(self, file, version=None):
+        ''' Non-blocking DMS.delete, return a Future of its result. '''
+        return self.ordered(self.dms.delete, file, version)
+
+    def get_file_meta_data(self, file, version=None):
+        ''' Non-blocking DMS.get_file_meta_data, return a Future of its result. '''
+        return self.pool.submit(self.dms.get_file_meta_data, file, version)
+
+    def get_file_content(self, file, version=None):
+        ''' Non-blocking DMS.get_file_content, return a Future of its result. '''
+        return self.pool.submit(self.dms.get_file_content, file, version)
+
+    def search(self, text, start=0, rows=10, fields=None, filters=None, sort=None,
+               cursor=None):
+        ''' Non-blocking DMS.search, return a Future of its result. '''
+        return self.pool.submit(self.dms.search, text, start, rows, fields, filters,
+                                sort, cursor)
+
+    def get_file_version(self, file):
+        ''' Non-blocking DMS.get_file_version, return a Future of its result. '''
+        return self.pool.submit(self.dms.get_file_version, file)
+
+    def get_lastest_version(self, file):
+        ''' Non-blocking DMS.get_lastest_version, return a Future of its result. '''
+        return self.pool.submit(self.dms.get_lastest_version, file)
+
+    def compact_packs(self, min_live=0.5, min_age=600):
+        ''' Non-blocking DMS.compact_packs, return a Future of its result. '''
+        return self.pool.submit(self.dms.compact_packs, min_live, min_age)
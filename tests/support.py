@@ -0,0 +1,60 @@
+''' Helpers of the tests: a DMS connected to the stand-in HBase REST, WebHDFS
+and Solr servers of bench/fakes.py, in a temporary working directory.
+'''
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'bench')]
+
+from DMS import DMS
+from fakes import FakeHBase, FakeWebHDFS, FakeSolr
+
+class BackendTestCase(unittest.TestCase):
+    ''' This class start fresh backends for every test and close every DMS made
+    by make_dms after it.
+    '''
+    def setUp(self):
+        self.hbase = FakeHBase().start()
+        self.hdfs = FakeWebHDFS().start()
+        self.solr = FakeSolr().start()
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='dms-test-')
+        os.chdir(self.work_dir)
+        self.dms_list = list()
+
+    def tearDown(self):
+        for dms in self.dms_list:
+            dms.close()
+        for backend in (self.hbase, self.hdfs, self.solr):
+            backend.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir)
+
+    def make_dms(self, solr=False, solr_options=None, **options):
+        ''' This function return a DMS connected to the backends.
+        :param : solr - True, also connect solr
+        :param : solr_options - other arguments of solr_connection
+        :param : options - arguments of DMS
+        :return: DMS.
+        '''
+        dms = DMS(**options)
+        self.dms_list.append(dms)
+        dms.hbase_connection(host=self.hbase.host, port=self.hbase.port)
+        dms.hdfs_connection(host=self.hdfs.host, port=str(self.hdfs.port), user_name='hdfs')
+        if solr:
+            dms.solr_connection(host=self.solr.host, port=str(self.solr.port),
+                                collection='dms', **(solr_options or {}))
+        return dms
+
+    def write_file(self, name, content):
+        ''' This function write a file in the working directory.
+        '''
+        f = open(name, 'wb')
+        try:
+            f.write(content)
+        finally:
+            f.close()
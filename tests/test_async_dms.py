@@ -0,0 +1,99 @@
+import threading
+import unittest
+
+from support import BackendTestCase
+from DMS import DMS, AsyncDMS
+
+class AsyncDMSTest(BackendTestCase):
+    def setUp(self):
+        BackendTestCase.setUp(self)
+        self.dms = self.make_dms()
+        self.async_dms = AsyncDMS(self.dms, workers=8)
+
+    def tearDown(self):
+        self.async_dms.close()
+        BackendTestCase.tearDown(self)
+
+    def test_result(self):
+        self.write_file('a.txt', 'hello')
+        self.assertTrue(self.async_dms.upload('a.txt').result(10))
+        self.assertEqual(self.async_dms.get_lastest_version('a.txt').result(10), 1)
+        content = self.async_dms.get_file_content('a.txt', 1).result(10)
+        self.assertEqual(content['content'], 'hello')
+        self.assertTrue(self.async_dms.download('a.txt', 1).result(10))
+
+    def test_exception(self):
+        # A DMS which is not connected has no tables.
+        async_dms = AsyncDMS(DMS(), workers=1)
+        try:
+            future = async_dms.get_lastest_version('a.txt')
+            self.assertTrue(isinstance(future.exception(10), AttributeError))
+            self.assertRaises(AttributeError, future.result, 10)
+            self.assertTrue(future.done())
+            # The worker thread is still alive.
+            self.assertTrue(isinstance(async_dms.get_file_version('a.txt').exception(10),
+                                       AttributeError))
+        finally:
+            async_dms.close()
+
+    def test_order_of_a_file(self):
+        self.hbase.latency = 0.005
+        files = ['f%d.txt' % i for i in range(4)]
+        futures = list()
+        for file in files:
+            self.write_file(file, file)
+            futures.append(self.async_dms.upload(file))
+            futures.append(self.async_dms.upload(file))
+            futures.append(self.async_dms.update(file, 2))
+            futures.append(self.async_dms.delete(file, 1))
+            futures.append(self.async_dms.upload(file))
+        self.assertEqual([future.result(30) for future in futures], [True] * len(futures))
+        for file in files:
+            self.assertEqual(self.dms.get_file_version(file)['version'], ['2', '3'])
+        # Done callbacks forget finished calls.
+        self.async_dms.close()
+        self.assertEqual(self.async_dms.last, {})
+
+    def test_calls_of_a_file_do_not_hold_workers(self):
+        async_dms = AsyncDMS(self.dms, workers=2)
+        release = threading.Event()
+        def update(file, version=None):
+            release.wait(10)
+            return True
+        self.dms.update = update
+        try:
+            updates = [async_dms.update('a.txt', 1) for i in range(4)]
+            # One worker runs the first update, the others are free.
+            self.assertEqual(async_dms.get_lastest_version('b.txt').result(5), None)
+            self.assertEqual(async_dms.get_file_version('b.txt').result(5)['version'], [])
+            self.assertFalse(updates[0].done())
+            release.set()
+            self.assertEqual([future.result(10) for future in updates], [True] * 4)
+        finally:
+            release.set()
+            async_dms.close()
+
+    def test_failed_call_does_not_stop_the_file(self):
+        self.write_file('a.txt', 'hello')
+        first = self.async_dms.delete('a.txt', 1)
+        second = self.async_dms.upload('a.txt')
+        self.assertFalse(first.result(10))
+        self.assertTrue(second.result(10))
+
+    def test_callbacks(self):
+        self.write_file('a.txt', 'hello')
+        called = list()
+        done = threading.Event()
+        def callback(future):
+            called.append(future.result())
+            done.set()
+        future = self.async_dms.upload('a.txt')
+        future.add_done_callback(callback)
+        self.assertTrue(done.wait(10))
+        self.assertEqual(called, [True])
+        # A callback of a finished call is called right away.
+        future.add_done_callback(lambda future: called.append('again'))
+        self.assertEqual(called, [True, 'again'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+import pywebhdfs.webhdfs
+import requests
+import starbase.client.transport
+
+from support import BackendTestCase
+
+class ConnectionPoolTest(BackendTestCase):
+    def test_each_dms_has_its_own_transport(self):
+        first = self.make_dms(timeout=5)
+        second = self.make_dms(max_connections=2)
+        self.write_file('a.txt', 'hello')
+        self.assertTrue(first.upload('a.txt'))
+        self.assertTrue(first.stats()['backends'])
+        self.assertEqual(second.stats()['backends'], {})
+        self.assertTrue(starbase.client.transport.requests is requests)
+        self.assertTrue(pywebhdfs.webhdfs.requests is requests)
+
+    def test_close_does_not_change_other_dms(self):
+        first = self.make_dms()
+        second = self.make_dms()
+        self.write_file('a.txt', 'hello')
+        self.assertTrue(first.upload('a.txt'))
+        first.close()
+        self.assertEqual(second.get_file_content('a.txt', 1)['content'], 'hello')
+        self.assertTrue(second.download('a.txt', 1))
+        self.assertTrue(second.stats()['backends']['hdfs.open']['count'])
+
+if __name__ == '__main__':
+    unittest.main()
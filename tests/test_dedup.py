@@ -0,0 +1,52 @@
+import unittest
+
+from support import BackendTestCase
+
+CONTENT = 'x' * 320
+
+class DedupTest(BackendTestCase):
+    def blobs(self):
+        return sorted(path for path in self.hdfs.files if '/blobs/' in path)
+
+    def test_concurrent_uploads_of_the_same_content(self):
+        self.hdfs.latency = 0.01
+        dms = self.make_dms(dedup=True, chunk_size=64)
+        names = ['f%d.txt' % i for i in range(4)]
+        for name in names:
+            self.write_file(name, CONTENT)
+        reports = dms.upload_many(names, workers=4)
+        self.assertEqual([report['status'] for report in reports], ['ok'] * 4)
+        blobs = self.blobs()
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(self.hdfs.files[blobs[0]], CONTENT)
+        for name in names:
+            self.assertEqual(dms.get_file_range(name, 1), CONTENT)
+
+    def test_blob_is_kept_for_a_reference_added_while_it_is_released(self):
+        dms = self.make_dms(dedup=True)
+        other = self.make_dms(dedup=True)
+        self.write_file('a.txt', CONTENT)
+        self.write_file('b.txt', CONTENT)
+        self.assertTrue(dms.upload('a.txt'))
+        delete_file_dir = dms.hdfs.delete_file_dir
+        def upload_meanwhile(path, *args, **kwargs):
+            if '/blobs/' in path:
+                self.assertTrue(other.upload('b.txt'))
+            return delete_file_dir(path, *args, **kwargs)
+        dms.hdfs.delete_file_dir = upload_meanwhile
+        self.assertTrue(dms.delete('a.txt', 1))
+        self.assertEqual(other.get_file_range('b.txt', 1), CONTENT)
+        self.assertEqual(len(self.blobs()), 1)
+
+    def test_last_reference_deletes_the_blob(self):
+        dms = self.make_dms(dedup=True)
+        for name in ('a.txt', 'b.txt'):
+            self.write_file(name, CONTENT)
+            self.assertTrue(dms.upload(name))
+        self.assertTrue(dms.delete('a.txt', 1))
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertTrue(dms.delete('b.txt', 1))
+        self.assertEqual(self.blobs(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from support import BackendTestCase
+
+class DeleteManyTest(BackendTestCase):
+    def upload(self, dms, name, *contents):
+        for content in contents:
+            self.write_file(name, content)
+            self.assertTrue(dms.upload(name))
+
+    def test_delete_keys(self):
+        dms = self.make_dms()
+        self.upload(dms, 'a.txt', 'hello', 'hello again')
+        self.upload(dms, 'b.txt', 'hello world')
+        unknown = dms.row_key('x.txt', 1)
+        summary = dms.delete_many([dms.row_key('a.txt', 1), dms.row_key('b.txt', 1), unknown],
+                                  workers=2, batch_size=2)
+        self.assertEqual(summary['deleted'], 2)
+        self.assertEqual(list(summary['failed']), [unknown])
+        self.assertEqual(sorted(self.hbase.tables['dms']), [dms.row_key('a.txt', 2)])
+        self.assertEqual(dms.get_lastest_version('a.txt'), 2)
+        self.assertEqual(dms.get_lastest_version('b.txt'), None)
+        self.assertEqual(dms.get_file_content('a.txt')['content'], 'hello again')
+        self.assertEqual(len(self.hdfs.files), 1)
+
+    def test_delete_all(self):
+        dms = self.make_dms()
+        self.upload(dms, 'a.txt', 'hello', 'hello again')
+        self.upload(dms, 'b.txt', 'hello world')
+        summary = dms.delete_many(batch_size=2)
+        self.assertEqual(summary, {'deleted': 3, 'failed': dict()})
+        self.assertEqual(self.hbase.tables['dms'], dict())
+        self.assertEqual(self.hdfs.files, dict())
+        self.assertEqual(dms.get_lastest_version('a.txt'), None)
+
+if __name__ == '__main__':
+    unittest.main()
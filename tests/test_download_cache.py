@@ -0,0 +1,67 @@
+import os
+import unittest
+
+from support import BackendTestCase
+
+class DownloadCacheTest(BackendTestCase):
+    def read(self, path):
+        f = open(path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def download(self, dms, name):
+        self.assertTrue(dms.download(name, 1, 'out/'))
+        return os.path.join('out', dms.version_name(name, 1))
+
+    def setUp(self):
+        BackendTestCase.setUp(self)
+        os.mkdir('out')
+
+    def test_caller_gets_a_copy(self):
+        dms = self.make_dms(download_cache='cache')
+        self.write_file('a.txt', 'cached')
+        self.assertTrue(dms.upload('a.txt'))
+        path = self.download(dms, 'a.txt')
+        self.assertEqual(os.stat(path).st_nlink, 1)
+        f = open(path, 'ab')
+        f.write(' and changed')
+        f.close()
+        requests = self.hdfs.requests
+        self.assertEqual(self.read(self.download(dms, 'a.txt')), 'cached')
+        self.assertEqual(self.hdfs.requests, requests)
+
+    def test_hardlink_is_opt_in(self):
+        dms = self.make_dms(download_cache='cache', download_cache_link=True)
+        self.write_file('a.txt', 'cached')
+        self.assertTrue(dms.upload('a.txt'))
+        path = self.download(dms, 'a.txt')
+        self.assertEqual(os.stat(path).st_nlink, 2)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0444)
+
+    def test_size_is_kept_without_listing(self):
+        dms = self.make_dms(download_cache='cache', download_cache_bytes=5000)
+        cache = dms.download_cache
+        evictions = list()
+        evict = cache.evict
+        def counted_evict(keep=None):
+            evictions.append(keep)
+            return evict(keep)
+        cache.evict = counted_evict
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.write_file(name, name[0] * 2000)
+            self.assertTrue(dms.upload(name))
+        self.download(dms, 'a.txt')
+        self.download(dms, 'b.txt')
+        # The first put finds no size file and lists the directory once.
+        self.assertEqual(len(evictions), 1)
+        self.assertEqual(cache.read_size(), 4000)
+        self.download(dms, 'c.txt')
+        self.assertEqual(len(evictions), 2)
+        cached = [name for name in os.listdir('cache') if len(name) == 64]
+        self.assertEqual(len(cached), 2)
+        self.assertEqual(cache.read_size(), 4000)
+
+if __name__ == '__main__':
+    unittest.main()
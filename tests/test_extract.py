@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from support import BackendTestCase
+from DMS import DMS
+
+class FailingExtractor:
+    def extract(self, file, max_bytes=None):
+        raise IOError("cannot extract %s: timed out after 1 seconds" % file)
+
+    def close(self):
+        pass
+
+class StubExtractor:
+    ''' An extractor which does not need hachoir, it records its calls. '''
+    def __init__(self):
+        self.calls = list()
+
+    def extract(self, file, max_bytes=None):
+        self.calls.append((file, max_bytes))
+        return {'max_bytes': max_bytes}
+
+    def close(self):
+        pass
+
+class ExtractCacheTest(BackendTestCase):
+    def test_failure_is_not_cached(self):
+        dms = DMS(extract_cache='cache')
+        dms.extractor = FailingExtractor()
+        self.write_file('a.txt', 'hello')
+        self.assertEqual(dms.extract('a.txt'), None)
+        self.assertEqual(os.listdir('cache'), [])
+
+    def test_cache_key_has_max_bytes(self):
+        self.write_file('a.txt', 'hello')
+        extractor = StubExtractor()
+        for max_bytes in (None, 2, None, 2):
+            dms = DMS(extract_cache='cache', extract_max_bytes=max_bytes)
+            dms.extractor = extractor
+            self.assertEqual(dms.extract('a.txt'), {'max_bytes': max_bytes})
+        self.assertEqual(extractor.calls, [('a.txt', None), ('a.txt', 2)])
+        self.assertEqual(len(os.listdir('cache')), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from support import BackendTestCase
+
+class MetaIndexTest(BackendTestCase):
+    def test_rebuild_without_indexed_fields(self):
+        dms = self.make_dms()
+        self.write_file('a.txt', 'hello')
+        self.assertTrue(dms.upload('a.txt'))
+        self.assertTrue(dms.rebuild_meta_index())
+        self.assertFalse([name for name in self.hbase.tables if name.endswith('_meta')])
+
+    def test_rebuild(self):
+        dms = self.make_dms(meta_index=('length',))
+        self.write_file('a.txt', 'hello')
+        self.write_file('b.txt', 'hello world')
+        self.assertTrue(dms.upload('a.txt'))
+        self.assertTrue(dms.upload('b.txt'))
+        self.hbase.tables['dms_meta'].clear()
+        self.assertEqual(dms.find_by_meta('length', 5), [])
+        self.assertTrue(dms.rebuild_meta_index())
+        self.assertEqual(dms.find_by_meta('length', 5), [dms.row_key('a.txt', 1)])
+
+    def test_rebuild_removes_stale_entries(self):
+        dms = self.make_dms(meta_index=('length',))
+        self.write_file('a.txt', 'hello')
+        self.write_file('b.txt', 'hello world')
+        self.assertTrue(dms.upload('a.txt'))
+        index = self.hbase.tables['dms_meta']
+        index[dms.meta_index_key('length', 7)] = {'row:'+dms.row_key('a.txt', 1): '1'}
+        insert_rows = dms.insert_rows
+        def upload_meanwhile(rows, table):
+            if table is dms.meta_table and not dms.get_lastest_version('b.txt'):
+                self.assertTrue(dms.upload('b.txt'))
+            return insert_rows(rows, table)
+        dms.insert_rows = upload_meanwhile
+        self.assertTrue(dms.rebuild_meta_index(batch_size=1))
+        self.assertEqual(dms.find_by_meta('length', 7), [])
+        self.assertEqual(dms.find_by_meta('length', 5), [dms.row_key('a.txt', 1)])
+        self.assertEqual(dms.find_by_meta('length', 11), [dms.row_key('b.txt', 1)])
+
+if __name__ == '__main__':
+    unittest.main()
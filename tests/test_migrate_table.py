@@ -0,0 +1,48 @@
+import unittest
+
+from support import BackendTestCase
+
+class MigrateTableTest(BackendTestCase):
+    def upload(self, dms, name, content):
+        self.write_file(name, content)
+        self.assertTrue(dms.upload(name))
+
+    def test_plain_dms_carries_blob_refs_and_pack_entries(self):
+        dedup = self.make_dms(dedup=True)
+        self.upload(dedup, 'a.txt', 'shared content')
+        self.upload(dedup, 'b.txt', 'shared content')
+        packer = self.make_dms(pack_limit=4096)
+        self.upload(packer, 'c.txt', 'c' * 1000)
+        self.upload(packer, 'd.txt', 'd' * 10)
+
+        dms = self.make_dms()
+        self.assertTrue(dms.migrate_table('dms_by_name'))
+        self.assertEqual(dms.key_layout, 'name')
+        refs = self.hbase.tables['dms_by_name_blob'].values()
+        self.assertEqual(sorted(refs[0]), ['ref:' + dms.row_key('a.txt', 1),
+                                           'ref:' + dms.row_key('b.txt', 1)])
+
+        self.assertTrue(dms.delete('a.txt', 1))
+        self.assertEqual(dms.get_file_range('b.txt', 1), 'shared content')
+        self.assertTrue(dms.delete('c.txt', 1))
+        summary = dms.compact_packs(min_live=0.9, min_age=0)
+        self.assertEqual((summary['containers'], summary['moved']), (1, 1))
+        self.assertEqual(dms.get_file_range('d.txt', 1), 'd' * 10)
+
+    def test_batches_are_bounded_by_bytes(self):
+        dms = self.make_dms()
+        for name in ('a.txt', 'b.txt', 'c.txt', 'd.txt', 'e.txt'):
+            self.upload(dms, name, name[0] * 1000)
+        batches = list()
+        insert_rows = dms.insert_rows
+        def counted_insert_rows(rows, table=None):
+            if table is not None and table.name == 'dms_by_name':
+                batches.append(len(rows))
+            return insert_rows(rows, table)
+        dms.insert_rows = counted_insert_rows
+        self.assertTrue(dms.migrate_table('dms_by_name', batch_bytes=2500))
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(dms.get_file_range('e.txt', 1), 'e' * 1000)
+
+if __name__ == '__main__':
+    unittest.main()
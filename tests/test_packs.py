@@ -0,0 +1,60 @@
+import unittest
+
+from support import BackendTestCase
+
+class CompactPacksTest(BackendTestCase):
+    def upload(self, dms, name, content):
+        self.write_file(name, content)
+        self.assertTrue(dms.upload(name))
+
+    def containers(self):
+        return [path for path in self.hdfs.files if '/packs/' in path]
+
+    def test_moves_live_files_and_deletes_container(self):
+        writer = self.make_dms(pack_limit=4096)
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.upload(writer, name, name * 100)
+        old = self.containers()
+        self.assertTrue(writer.delete('a.txt', 1))
+        self.assertTrue(writer.delete('b.txt', 1))
+        compactor = self.make_dms(pack_limit=4096)
+        summary = compactor.compact_packs(min_live=0.9, min_age=0)
+        self.assertEqual((summary['containers'], summary['moved']), (1, 1))
+        self.assertFalse(set(old) & set(self.containers()))
+        self.assertEqual(self.make_dms().get_file_range('c.txt', 1), 'c.txt' * 100)
+
+    def test_keeps_container_written_while_compacted(self):
+        writer = self.make_dms(pack_limit=4096)
+        self.upload(writer, 'a.txt', 'a' * 1000)
+        self.upload(writer, 'b.txt', 'b' * 10)
+        self.assertTrue(writer.delete('a.txt', 1))
+        compactor = self.make_dms(pack_limit=4096)
+        release_pack = compactor.release_pack
+        written = list()
+        def slow_writer(name, key):
+            # The writer appends after the container was scanned.
+            if not written:
+                written.append(key)
+                self.upload(writer, 'c.txt', 'c.txt')
+            return release_pack(name, key)
+        compactor.release_pack = slow_writer
+        summary = compactor.compact_packs(min_live=0.9, min_age=0)
+        self.assertEqual(summary['containers'], 0)
+        reader = self.make_dms()
+        self.assertEqual(reader.get_file_range('b.txt', 1), 'b' * 10)
+        self.assertEqual(reader.get_file_range('c.txt', 1), 'c.txt')
+        compactor.release_pack = release_pack
+        self.upload(writer, 'd.txt', 'd.txt')
+        self.assertEqual(reader.get_file_range('d.txt', 1), 'd.txt')
+
+    def test_writer_moves_on_from_a_fenced_container(self):
+        writer = self.make_dms(pack_limit=4096)
+        self.upload(writer, 'a.txt', 'a.txt')
+        path = self.containers()[0]
+        self.hdfs.files[path + '.compacting'] = self.hdfs.files.pop(path)
+        self.hdfs.mtimes[path + '.compacting'] = self.hdfs.mtimes.pop(path)
+        self.upload(writer, 'b.txt', 'b.txt')
+        self.assertEqual(self.make_dms().get_file_range('b.txt', 1), 'b.txt')
+
+if __name__ == '__main__':
+    unittest.main()
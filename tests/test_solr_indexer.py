@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+
+import simplejson
+
+from support import BackendTestCase
+from DMS import ConnectionPool, SolrIndexer
+
+class SolrIndexerTest(BackendTestCase):
+    def setUp(self):
+        BackendTestCase.setUp(self)
+        self.pool = ConnectionPool()
+        self.url = 'http://%s:%d/solr/dms' % (self.solr.host, self.solr.port)
+        self.indexers = list()
+
+    def tearDown(self):
+        for indexer in self.indexers:
+            indexer.close()
+        self.pool.close()
+        BackendTestCase.tearDown(self)
+
+    def make_indexer(self, **options):
+        indexer = SolrIndexer(self.pool, self.url, **options)
+        self.indexers.append(indexer)
+        return indexer
+
+    def bodies(self):
+        return [simplejson.loads(body) for query, body in self.solr.updates]
+
+    def docs(self):
+        return self.solr.collections.get('dms', {})
+
+    def test_batches(self):
+        indexer = self.make_indexer(batch_size=3, flush_interval=60)
+        for i in range(7):
+            indexer.add({'id': str(i)})
+        indexer.flush()
+        self.assertEqual([len(body) for body in self.bodies()], [3, 3, 1])
+        self.assertEqual(sorted(self.docs()), [str(i) for i in range(7)])
+
+    def test_commit_within(self):
+        indexer = self.make_indexer(commit_within=500)
+        indexer.add({'id': '1'})
+        indexer.delete('2')
+        indexer.flush()
+        self.assertTrue(self.solr.updates)
+        for query, body in self.solr.updates:
+            self.assertEqual(query['commitWithin'], '500')
+            self.assertFalse('commit' in query)
+
+    def test_flush_interval(self):
+        indexer = self.make_indexer(batch_size=100, flush_interval=0.1)
+        indexer.add({'id': '1'})
+        deadline = time.time() + 5
+        while not self.solr.updates and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.bodies(), [[{'id': '1'}]])
+
+    def test_coalesce(self):
+        indexer = self.make_indexer(batch_size=100, flush_interval=60)
+        indexer.add({'id': '1', 'name': 'old'})
+        indexer.add({'id': '2'})
+        indexer.add({'id': '1', 'name': 'new'})
+        indexer.delete('2')
+        indexer.flush()
+        self.assertEqual(self.bodies(), [{'delete': ['2']}, [{'id': '1', 'name': 'new'}]])
+        self.assertEqual(self.docs(), {'1': {'id': '1', 'name': 'new'}})
+
+    def test_close_sends_queued(self):
+        indexer = self.make_indexer(batch_size=100, flush_interval=60)
+        for i in range(5):
+            indexer.add({'id': str(i)})
+        indexer.close()
+        self.indexers.remove(indexer)
+        self.assertEqual(len(self.docs()), 5)
+        self.assertFalse(indexer.thread.is_alive())
+
+    def test_backpressure(self):
+        self.solr.latency = 0.5
+        indexer = self.make_indexer(batch_size=1, max_queue=2)
+        indexer.add({'id': '0'})
+        # The thread is sending the first document, two more fill the queue.
+        time.sleep(0.1)
+        indexer.add({'id': '1'})
+        indexer.add({'id': '2'})
+        thread = threading.Thread(target=indexer.add, args=({'id': '3'},))
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        indexer.flush()
+        self.assertEqual(len(self.docs()), 4)
+
+    def test_dms_keeps_solr_in_sync(self):
+        dms = self.make_dms(solr=True, solr_options={'index': True})
+        self.write_file('a.txt', 'hello solr')
+        self.assertTrue(dms.upload('a.txt'))
+        dms.flush()
+        key = dms.row_key('a.txt', 1)
+        self.assertEqual(self.docs()[key]['content'], 'hello solr')
+        self.write_file('a.txt', 'changed')
+        self.assertTrue(dms.update('a.txt', 1))
+        dms.flush()
+        self.assertEqual(self.docs()[key]['content'], 'changed')
+        self.assertTrue(dms.delete('a.txt', 1))
+        dms.flush()
+        self.assertFalse(key in self.docs())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import threading
+import unittest
+
+from support import BackendTestCase
+from DMS import DMS, Spool
+
+class SpoolTest(BackendTestCase):
+    def make_spool(self, drain, **options):
+        self.write_file('a.txt', 'hello')
+        spool = Spool('spool', drain, workers=1, **options)
+        self.spools.append(spool)
+        spool.add('upload', 'a.txt', None, 'a.txt')
+        return spool
+
+    def setUp(self):
+        BackendTestCase.setUp(self)
+        self.spools = list()
+
+    def tearDown(self):
+        for spool in self.spools:
+            spool.close()
+        BackendTestCase.tearDown(self)
+
+    def test_gives_up_after_max_attempts(self):
+        attempts = list()
+        def drain(entry):
+            attempts.append(entry['name'])
+            raise IOError("hdfs is down")
+        spool = self.make_spool(drain, retry_delay=0.01, max_attempts=3)
+        spool.start()
+        self.assertTrue(spool.wait(timeout=10))
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(os.listdir(os.path.join('spool', 'failed')), attempts[:1])
+
+    def test_wait_is_bounded(self):
+        release = threading.Event()
+        def drain(entry):
+            release.wait(10)
+            return True
+        spool = self.make_spool(drain)
+        self.assertFalse(spool.wait(timeout=1))
+        spool.start()
+        self.assertFalse(spool.wait('a.txt', timeout=0.2))
+        release.set()
+        self.assertTrue(spool.wait('a.txt', timeout=10))
+
+    def test_delete_waits_for_spooled_versions(self):
+        plain = self.make_dms()
+        self.write_file('a.txt', 'first')
+        self.assertTrue(plain.upload('a.txt'))
+        dms = DMS(spool_dir='spool', spool_timeout=0.2)
+        self.dms_list.append(dms)
+        # Workers are not started, the update stays spooled.
+        dms.start_spool = lambda: None
+        dms.hbase_connection(host=self.hbase.host, port=self.hbase.port)
+        dms.hdfs_connection(host=self.hdfs.host, port=str(self.hdfs.port), user_name='hdfs')
+        self.write_file('a.txt', 'second')
+        self.assertTrue(dms.update('a.txt', 1))
+        self.assertFalse(dms.delete('a.txt', 1))
+        self.assertFalse(dms.flush())
+        self.assertRaises(IOError, dms.delete_many, [dms.row_key('a.txt', 1)])
+        self.assertEqual(plain.get_file_range('a.txt', 1), 'first')
+        dms.spool.start()
+        self.assertTrue(dms.flush())
+        self.assertTrue(dms.delete('a.txt', 1))
+        self.assertFalse(plain.get_file_version('a.txt')['version'])
+
+if __name__ == '__main__':
+    unittest.main()
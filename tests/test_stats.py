@@ -0,0 +1,41 @@
+import unittest
+
+from support import BackendTestCase
+from DMS import ConnectionPool, Stats
+
+class StatsTest(BackendTestCase):
+    def test_failed_results_are_errors(self):
+        dms = self.make_dms()
+        self.write_file('a.txt', 'hello')
+        self.assertTrue(dms.upload('a.txt'))
+        self.assertFalse(dms.upload('missing.txt'))
+        self.assertFalse(dms.download('missing.txt', 1))
+        self.assertFalse(dms.delete('missing.txt', 1))
+        operations = dms.stats()['operations']
+        self.assertEqual(operations['upload']['count'], 2)
+        self.assertEqual(operations['upload']['errors'], 1)
+        self.assertEqual(operations['download']['errors'], 1)
+        self.assertEqual(operations['delete']['errors'], 1)
+
+    def test_sent_bytes_of_streamed_bodies(self):
+        stats = Stats()
+        pool = ConnectionPool(stats=stats)
+        url = 'http://%s:%d/solr/dms/update' % (self.solr.host, self.solr.port)
+        try:
+            pool.request('POST', url, data='[]', headers={'Content-Type': 'application/json'})
+            self.write_file('body.json', '[{"id": "1"}]')
+            f = open('body.json', 'rb')
+            try:
+                pool.request('POST', url, data=f, headers={'Content-Type': 'application/json'})
+            finally:
+                f.close()
+            pool.request('POST', url, data=iter(['[{"id": ', '"2"}]']),
+                         headers={'Content-Type': 'application/json'})
+        finally:
+            pool.close()
+        backend = stats.snapshot()['backends']['solr.update']
+        self.assertEqual(backend['count'], 3)
+        self.assertEqual(backend['bytes_sent'], 2 + 13 + 13)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+''' A version is read the way its row says it is stored, whatever options the
+reading DMS has.
+'''
+import os
+import unittest
+
+from support import BackendTestCase
+
+CONTENT = ''.join(['line %d of a compressible file\n' % i for i in range(400)])
+
+class StorageLayoutTest(BackendTestCase):
+    def read(self, dms, file, version):
+        self.assertTrue(dms.download(file, version, 'out/'))
+        f = open(os.path.join('out', dms.version_name(file, version)), 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def setUp(self):
+        BackendTestCase.setUp(self)
+        os.mkdir('out')
+
+    def check_plain_reader(self, **writer_options):
+        writer = self.make_dms(**writer_options)
+        reader = self.make_dms()
+        self.write_file('a.txt', CONTENT)
+        self.assertTrue(writer.upload('a.txt'))
+        self.assertEqual(self.read(reader, 'a.txt', 1), CONTENT)
+        self.assertEqual(reader.get_file_range('a.txt', 1, 100, 50), CONTENT[100:150])
+        self.assertEqual(reader.get_file_content('a.txt', 1)['content'], CONTENT)
+
+    def test_plain_reader_reads_compressed(self):
+        self.check_plain_reader(compression='zlib')
+
+    def test_plain_reader_reads_parts(self):
+        self.check_plain_reader(split_limit=1024, split_size=1024)
+
+    def test_plain_reader_reads_packed(self):
+        self.check_plain_reader(pack_limit=65536, compression='zlib')
+
+    def test_plain_writer_updates_compressed(self):
+        writer = self.make_dms(compression='zlib')
+        plain = self.make_dms()
+        self.write_file('a.txt', CONTENT)
+        self.assertTrue(writer.upload('a.txt'))
+        self.write_file('a.txt', 'short and plain')
+        self.assertTrue(plain.update('a.txt', 1))
+        self.assertEqual(self.read(plain, 'a.txt', 1), 'short and plain')
+        self.assertEqual(self.read(writer, 'a.txt', 1), 'short and plain')
+
+    def upload_delta(self):
+        writer = self.make_dms(delta=True)
+        self.write_file('a.txt', CONTENT)
+        self.assertTrue(writer.upload('a.txt'))
+        self.write_file('a.txt', CONTENT + 'one more line\n')
+        self.assertTrue(writer.upload('a.txt'))
+        self.assertTrue('delta_base' in writer.get_file_meta_data('a.txt', 2))
+        return writer
+
+    def test_plain_reader_reads_delta(self):
+        self.upload_delta()
+        reader = self.make_dms()
+        self.assertEqual(self.read(reader, 'a.txt', 2), CONTENT + 'one more line\n')
+        self.assertEqual(reader.get_file_range('a.txt', 2, len(CONTENT), 3), 'one')
+
+    def test_plain_writer_keeps_delta_of_changed_base(self):
+        writer = self.upload_delta()
+        plain = self.make_dms()
+        self.write_file('a.txt', 'new base')
+        self.assertTrue(plain.update('a.txt', 1))
+        self.assertEqual(plain.get_file_range('a.txt', 2), CONTENT + 'one more line\n')
+        self.assertTrue(plain.delete('a.txt', 1))
+        self.assertEqual(writer.get_file_range('a.txt', 2), CONTENT + 'one more line\n')
+
+    def test_length_is_file_size(self):
+        layouts = [('zlib.txt', {'compression': 'zlib'}), ('pack.txt', {'pack_limit': 65536}),
+                   ('parts.txt', {'split_limit': 1024, 'split_size': 1024,
+                                  'compression': 'zlib'})]
+        for name, options in layouts:
+            options['meta_index'] = ('length',)
+            self.write_file(name, CONTENT)
+            self.assertTrue(self.make_dms(**options).upload(name))
+        self.upload_delta()
+        reader = self.make_dms(meta_index=('length',))
+        for name, version in [(name, 1) for name, options in layouts] + [('a.txt', 2)]:
+            meta_data = reader.get_file_meta_data(name, version)
+            self.assertEqual(int(meta_data['length']), len(open(name).read()))
+            if name != 'pack.txt':
+                self.assertTrue(int(meta_data['stored_length']) < int(meta_data['length']))
+        self.assertEqual(reader.find_by_meta('length', len(CONTENT)),
+                         sorted([reader.row_key(name, 1) for name, options in layouts]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from support import BackendTestCase
+
+class UnknownFileTest(BackendTestCase):
+    def check(self, dms):
+        self.write_file('new.txt', 'new')
+        self.assertFalse(dms.update('new.txt'))
+        self.assertFalse(dms.download('new.txt'))
+        self.assertFalse(dms.delete('new.txt'))
+        self.assertFalse(dms.get_file_meta_data('new.txt'))
+        self.assertFalse(dms.get_file_content('new.txt'))
+        self.assertFalse(dms.get_file_range('new.txt'))
+        self.assertEqual(dms.get_file_version('new.txt')['version'], [])
+        self.assertTrue(dms.upload('new.txt'))
+        self.assertEqual(dms.get_lastest_version('new.txt'), 1)
+
+    def test_version_layout(self):
+        self.check(self.make_dms())
+
+    def test_name_layout(self):
+        dms = self.make_dms()
+        dms.open_tables('dms_by_name', key_layout='name')
+        self.check(dms)
+
+if __name__ == '__main__':
+    unittest.main()
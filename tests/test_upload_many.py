@@ -0,0 +1,29 @@
+import unittest
+
+from support import BackendTestCase
+
+class UploadManyTest(BackendTestCase):
+    def test_reports_in_order(self):
+        dms = self.make_dms()
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.write_file(name, 'content of ' + name)
+        files = ['a.txt', 'b.txt', 'missing.txt', 'c.txt']
+        reports = dms.upload_many(files, workers=3, hbase_workers=1)
+        self.assertEqual([report['file'] for report in reports], files)
+        self.assertEqual([report['status'] for report in reports], ['ok', 'ok', 'failed', 'ok'])
+        self.assertTrue(reports[2]['error'])
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.assertEqual(dms.get_file_content(name)['content'], 'content of ' + name)
+
+    def test_same_file_twice(self):
+        dms = self.make_dms()
+        self.write_file('a.txt', 'hello')
+        self.write_file('b.txt', 'hello world')
+        reports = dms.upload_many(['a.txt', 'b.txt', 'a.txt'], workers=3)
+        self.assertEqual([report['status'] for report in reports], ['ok', 'ok', 'ok'])
+        self.assertEqual(sorted([reports[0]['version'], reports[2]['version']]), [1, 2])
+        self.assertEqual(dms.get_lastest_version('a.txt'), 2)
+        self.assertEqual(reports[1]['version'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from support import BackendTestCase
+
+class VersionIndexTest(BackendTestCase):
+    def test_rebuild_in_place(self):
+        dms = self.make_dms()
+        self.write_file('a.txt', 'hello')
+        self.write_file('b.txt', 'hello world')
+        self.write_file('c.txt', 'stored while the index is rebuilt')
+        self.assertTrue(dms.upload('a.txt'))
+        self.write_file('a.txt', 'hello again')
+        self.assertTrue(dms.upload('a.txt'))
+        self.assertTrue(dms.upload('b.txt'))
+        index = self.hbase.tables['dms_version']
+        index['gone.txt'] = {'version:1': dms.row_key('gone.txt', 1)}
+        del index['b.txt']
+        batches = list()
+        insert_rows = dms.insert_rows
+        def record(rows, table):
+            batches.append(len(rows))
+            self.assertIn('a.txt', index)
+            if len(batches) == 1:
+                self.assertTrue(dms.upload('c.txt'))
+            return insert_rows(rows, table)
+        dms.insert_rows = record
+        self.assertTrue(dms.rebuild_version_index(batch_size=1))
+        self.assertEqual(batches, [1, 1])
+        self.assertEqual(sorted(index), ['a.txt', 'b.txt', 'c.txt'])
+        self.assertEqual(sorted(index['a.txt']), ['version:1', 'version:2'])
+        self.assertEqual(dms.get_lastest_version('b.txt'), 1)
+        self.assertEqual(dms.get_lastest_version('c.txt'), 1)
+
+if __name__ == '__main__':
+    unittest.main()